@@ -0,0 +1,238 @@
+"""
+Shared pieces of the benchmarks: running a server.py on a copy of the
+server directory, and a lobby session that talks to it exactly like the
+game client does.
+
+The server always listens on TCP 33445 and UDP 8888, so only one benchmark
+can run on a machine at a time, and no other server may be running.
+"""
+import os
+import sys
+import time
+import shutil
+import socket
+import pickle
+import secrets
+import tempfile
+import subprocess
+
+import rsa
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server")
+sys.path.insert(0, SERVER_DIR)
+
+import protocol
+from protocol import send_with_size, recv_by_size
+
+# The benchmarks send thousands of messages, don't print every one of them
+protocol.TCP_DEBUG = False
+
+HOST = "127.0.0.1"
+TCP_PORT = 33445
+UDP_PORT = 8888
+
+# The seconds to wait for a new server to accept clients
+SERVER_START_TIMEOUT = 30
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class Session:
+    """
+    This class is a lobby connection to the server. It does the RSA key
+    exchange of the game client, then sends requests encrypted with the AES
+    key it chose.
+    """
+
+    def __init__(self, host: str = HOST, timeout: float = 30, exchange_keys: bool = True):
+        """
+        Constructor for the Session class. Connects and does the key exchange.
+
+        Args:
+            host (str): The address of the server.
+            timeout (float): The seconds to wait for the server on every step.
+            exchange_keys (bool): False to leave the key exchange to the caller, to time it apart.
+        """
+        self.socket = socket.create_connection((host, TCP_PORT), timeout)
+        self.key = None
+        if exchange_keys:
+            self.exchange_keys()
+
+    def exchange_keys(self) -> None:
+        """
+        RSA key exchange - loads the public key from the server, and sends it our AES key.
+        """
+        try:
+            data = recv_by_size(self.socket)
+            if data == b"":
+                raise ConnectionError("Server closed the connection during the key exchange")
+            public_key = pickle.loads(data)
+            self.key = secrets.token_bytes(nbytes=32)
+            send_with_size(self.socket, rsa.encrypt(self.key, public_key))
+        except:
+            self.socket.close()
+            raise
+
+    def request(self, message: str) -> list:
+        """
+        Sends a request and waits for its answer.
+
+        Args:
+            message (str): The request, e.g. "LOGR#username$password".
+
+        Returns:
+            list: The fields of the answer, split by '#'.
+        """
+        send_with_size(self.socket, message.encode(), self.key)
+        data = recv_by_size(self.socket, self.key)
+        if data == b"":
+            raise ConnectionError(f"Server closed the connection after {message.split('#')[0]}")
+        return data.decode().split("#")
+
+    def send(self, message: str) -> None:
+        """
+        Sends a message that has no answer, like EXTG and EXTC.
+        """
+        send_with_size(self.socket, message.encode(), self.key)
+
+    def close(self) -> None:
+        self.socket.close()
+
+
+class Server:
+    """
+    This class runs server.py in a temporary copy of the server directory,
+    so the benchmark gets its own database and log and never touches the
+    real ones.
+    """
+
+    def __init__(self, keep: bool = False):
+        """
+        Constructor for the Server class. Starts the server and waits until it
+        accepts clients.
+
+        Args:
+            keep (bool): Whether to leave the temporary directory behind, to read its log.
+        """
+        if port_in_use():
+            raise RuntimeError(f"Port {UDP_PORT} is taken, stop the running server first")
+
+        self.keep = keep
+        self.directory = tempfile.mkdtemp(prefix="flightil-bench-")
+        for name in os.listdir(SERVER_DIR):
+            if name.endswith(".py") or name == "database.db":
+                shutil.copy(os.path.join(SERVER_DIR, name), self.directory)
+        os.mkdir(os.path.join(self.directory, "logs"))
+        self.output = open(os.path.join(self.directory, "output.txt"), "a")
+        self.process = None
+        try:
+            self.start()
+        except:
+            self.close()
+            raise
+
+    def start(self) -> None:
+        """
+        Starts the server and waits until it accepts clients.
+        """
+        self.process = subprocess.Popen([sys.executable, "server.py"], cwd=self.directory,
+                                        stdin=subprocess.PIPE, stdout=self.output,
+                                        stderr=subprocess.STDOUT, text=True)
+        self.wait_until_ready()
+
+    def wait_until_ready(self) -> None:
+        """
+        Waits for the server to finish a key exchange. A bare connection isn't
+        enough, the server's accept loop expects every client to send a key.
+        """
+        deadline = time.time() + SERVER_START_TIMEOUT
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}, see {self.directory}")
+            try:
+                Session(timeout=5).close()
+                return
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError("Server didn't start accepting clients in time")
+                time.sleep(0.2)
+
+    def cpu_time(self) -> float:
+        """
+        Returns the seconds of CPU the server used so far, user and system.
+        """
+        with open(f"/proc/{self.process.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+    def thread_count(self) -> int:
+        """
+        Returns the number of threads the server runs now.
+        """
+        with open(f"/proc/{self.process.pid}/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+        return 0
+
+    def read_output(self) -> str:
+        """
+        Returns everything the server printed and logged so far.
+        """
+        self.output.flush()
+        text = ""
+        for name in ("output.txt", os.path.join("logs", "serverside.log")):
+            with open(os.path.join(self.directory, name), errors="replace") as f:
+                text += f.read()
+        return text
+
+    def stop(self) -> None:
+        """
+        Stops the server with the EXIT command of its console. The database
+        stays, so the server can be started again on it.
+        """
+        if self.process is not None and self.process.poll() is None:
+            try:
+                self.process.stdin.write("EXIT\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=30)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+
+    def restart(self) -> None:
+        self.stop()
+        self.start()
+
+    def close(self) -> None:
+        """
+        Stops the server and removes its temporary directory.
+        """
+        self.stop()
+        self.output.close()
+        if not self.keep:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def port_in_use() -> bool:
+    """
+    Returns whether a server is running, by trying to bind its UDP port.
+    Connecting to its TCP port instead would break its accept loop, which
+    expects a key from every client.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            s.bind(("0.0.0.0", UDP_PORT))
+        except OSError:
+            return True
+    return False
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Returns a percentile of values by the nearest rank, or None if there are none.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
@@ -0,0 +1,264 @@
+"""
+Lobby login storm. Measures how fast the lobby absorbs a wave of
+reconnecting clients after a restart, apart from the open world traffic.
+
+Starts a server on a temporary copy of the database, and signs up the
+accounts the storm logs in to, which is measured as a storm of its own.
+Then restarts the server, and opens the sessions all at once from many
+threads. Every session does what the game client does: the RSA key
+exchange, LOGR, SHPR and SELR, then quits the open world with EXTC. Signing
+up and logging in go through handle_client and AccountManagement like they
+do for real clients.
+
+It reports sessions and key exchanges per second, the latency percentiles
+of every step, the errors, the "database is locked" errors and tracebacks
+the server printed or logged, and the most threads the server ran.
+
+Usage (from the repo root, Linux only):
+    python benchmarks/login_storm.py --sessions 2000 --concurrency 500 --output storm.json
+"""
+import os
+import sys
+import json
+import time
+import secrets
+import argparse
+import threading
+
+from harness import Server, Session, percentile
+
+DEFAULT_SESSIONS = 1000
+DEFAULT_CONCURRENCY = 200
+DEFAULT_TIMEOUT = 30
+
+PASSWORD = "password"
+AIRCRAFT = "efroni"
+
+# The seconds between two samples of the server's thread count
+THREAD_SAMPLE_INTERVAL = 0.05
+
+SIGN_UP_STEPS = ("connect", "handshake", "SGNR", "total")
+LOG_IN_STEPS = ("connect", "handshake", "LOGR", "SHPR", "SELR", "total")
+
+
+class Storm:
+    """
+    This class opens sessions from many threads at once, and records how
+    long every step of every session took.
+    """
+
+    def __init__(self, server: Server, usernames: list, sign_up: bool, concurrency: int, timeout: float):
+        """
+        Constructor for the Storm class.
+
+        Args:
+            server (Server): The server, to sample its threads.
+            usernames (list): The account of every session.
+            sign_up (bool): Whether the sessions sign up, or log in and enter the open world.
+            concurrency (int): The number of sessions open at once.
+            timeout (float): The seconds a session waits for the server on every step.
+        """
+        self.server = server
+        self.usernames = usernames
+        self.sign_up = sign_up
+        self.concurrency = min(concurrency, len(usernames))
+        self.timeout = timeout
+        self.steps = SIGN_UP_STEPS if sign_up else LOG_IN_STEPS
+
+        self.next_session = 0
+        self.latencies = {step: [] for step in self.steps}  # seconds
+        self.errors = {}  # error -> count
+        self.succeeded = []  # the accounts whose session finished
+        self.lock = threading.Lock()
+        self.start = threading.Event()
+
+    def session(self, username: str, times: dict) -> None:
+        """
+        Runs one session.
+
+        Args:
+            username (str): The account of the session.
+            times (dict): Filled with the seconds every step took, as the steps finish.
+        """
+        began = time.perf_counter()
+        session = Session(timeout=self.timeout, exchange_keys=False)
+        times["connect"] = time.perf_counter() - began
+        try:
+            session.exchange_keys()
+            times["handshake"] = time.perf_counter() - began - times["connect"]
+            if self.sign_up:
+                self.timed(times, "SGNR", session, f"SGNR#{username}${PASSWORD}", "1")
+            else:
+                self.timed(times, "LOGR", session, f"LOGR#{username}${PASSWORD}", "1")
+                self.timed(times, "SHPR", session, "SHPR#", None)
+                self.timed(times, "SELR", session, f"SELR#{AIRCRAFT}|{secrets.token_urlsafe(20)}", "1")
+                session.send("EXTC")
+        finally:
+            session.close()
+        times["total"] = time.perf_counter() - began
+
+    @staticmethod
+    def timed(times: dict, step: str, session: Session, message: str, expected: str) -> None:
+        """
+        Sends a request, records how long its answer took and checks it.
+        """
+        began = time.perf_counter()
+        fields = session.request(message)
+        if expected is not None and fields[1] != expected:
+            raise RuntimeError("refused")
+        times[step] = time.perf_counter() - began
+
+    def run_sessions(self) -> None:
+        self.start.wait()
+        while True:
+            with self.lock:
+                if self.next_session == len(self.usernames):
+                    return
+                username = self.usernames[self.next_session]
+                self.next_session += 1
+
+            # The steps a failed session finished still count
+            times = {}
+            try:
+                self.session(username, times)
+            except Exception as error:
+                # Named after the step it failed on
+                step = next(step for step in self.steps if step not in times)
+                with self.lock:
+                    name = f"{step}: {type(error).__name__}: {error}"
+                    self.errors[name] = self.errors.get(name, 0) + 1
+            with self.lock:
+                for step, seconds in times.items():
+                    self.latencies[step].append(seconds)
+                if "total" in times:
+                    self.succeeded.append(username)
+
+    def run(self) -> dict:
+        """
+        Runs all the sessions.
+
+        Returns:
+            dict: The report of the storm.
+        """
+        threads = [threading.Thread(target=self.run_sessions, daemon=True) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+
+        most_threads = self.server.thread_count()
+        began = time.perf_counter()
+        self.start.set()
+        while any(thread.is_alive() for thread in threads):
+            try:
+                most_threads = max(most_threads, self.server.thread_count())
+            except OSError:
+                pass  # the server exited
+            time.sleep(THREAD_SAMPLE_INTERVAL)
+        elapsed = time.perf_counter() - began
+
+        completed = len(self.latencies["total"])
+        return {
+            "sessions": len(self.usernames),
+            "concurrency": self.concurrency,
+            "completed": completed,
+            "seconds": round(elapsed, 2),
+            "sessions_per_second": round(completed / elapsed, 1),
+            "handshakes_per_second": round(len(self.latencies["handshake"]) / elapsed, 1),
+            "latency_ms": {step: latency_summary(self.latencies[step]) for step in self.steps},
+            "errors": self.errors,
+            "most_server_threads": most_threads,
+        }
+
+
+def latency_summary(values: list) -> dict:
+    def milliseconds(value):
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        "p50": milliseconds(percentile(values, 0.5)),
+        "p95": milliseconds(percentile(values, 0.95)),
+        "p99": milliseconds(percentile(values, 0.99)),
+        "max": milliseconds(max(values, default=None)),
+    }
+
+
+def count_server_errors(server: Server) -> dict:
+    """
+    Returns the number of "database is locked" errors and of tracebacks the
+    server printed or logged so far. A traceback of the accept loop means
+    the server stopped taking new clients.
+    """
+    output = server.read_output()
+    return {"lock_errors": output.count("database is locked"),
+            "server_tracebacks": output.count("Traceback (most recent call last)")}
+
+
+def run_storm(sessions: int, concurrency: int, timeout: float, keep: bool = False) -> dict:
+    """
+    Signs up the accounts, restarts the server, then logs in all the accounts
+    that signed up at once.
+
+    Args:
+        sessions (int): The number of accounts, and of sessions in every storm.
+        concurrency (int): The number of sessions open at once.
+        timeout (float): The seconds a session waits for the server on every step.
+        keep (bool): Whether to keep the server's temporary directory.
+
+    Returns:
+        dict: The reports of the sign up storm and of the log in storm.
+    """
+    run = secrets.token_hex(3)
+    usernames = [f"storm_{run}_{i}" for i in range(sessions)]
+
+    server = Server(keep)
+    try:
+        sign_up = Storm(server, usernames, True, concurrency, timeout)
+        report = {"sign_up": sign_up.run()}
+        report["sign_up"].update(count_server_errors(server))
+
+        # Like clients reconnecting after the server went down
+        server.restart()
+        errors_before = count_server_errors(server)
+        report["log_in"] = Storm(server, sign_up.succeeded, False, concurrency, timeout).run()
+        for name, count in count_server_errors(server).items():
+            report["log_in"][name] = count - errors_before[name]
+    finally:
+        server.close()
+    return report
+
+
+def print_report(report: dict) -> None:
+    for name, storm in report.items():
+        print(f"\n{name}: {storm['completed']}/{storm['sessions']} sessions in {storm['seconds']} s "
+              f"from {storm['concurrency']} threads")
+        print(f"    {storm['sessions_per_second']} sessions/s, {storm['handshakes_per_second']} handshakes/s, "
+              f"{storm['most_server_threads']} server threads at most")
+        print(f"    {storm['lock_errors']} DB lock errors, {storm['server_tracebacks']} server tracebacks")
+        print(f"    {'step':>10}  {'p50 ms':>8}  {'p95 ms':>8}  {'p99 ms':>8}  {'max ms':>8}")
+        for step, latency in storm["latency_ms"].items():
+            print(f"    {step:>10}  " + "  ".join(f"{str(latency[key]):>8}" for key in ("p50", "p95", "p99", "max")))
+        for error, count in storm["errors"].items():
+            print(f"    {count} x {error}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Storm the lobby of a local server with sessions.")
+    parser.add_argument("--sessions", type=int, default=DEFAULT_SESSIONS,
+                        help=f"accounts signed up and then logged in, default {DEFAULT_SESSIONS}")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"sessions open at once, default {DEFAULT_CONCURRENCY}")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help=f"seconds a session waits for the server on every step, default {DEFAULT_TIMEOUT}")
+    parser.add_argument("--output", help="a .json file to write the report to")
+    parser.add_argument("--keep", action="store_true", help="keep the server's temporary directory")
+    args = parser.parse_args()
+
+    report = run_storm(args.sessions, args.concurrency, args.timeout, args.keep)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"platform": sys.platform, "cpus": os.cpu_count(), **report}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+"""
+Open world load test. Starts a server on a temporary copy of the database,
+then for every number of clients in the sweep N bots sign up over TCP with
+the real key exchange, select an aircraft (SELR), get admitted over UDP
+(ADDS) and stream UPDR along scripted flight paths, like game clients do.
+Bots run in several processes, each flying its bots in one asyncio loop.
+
+For every N it measures, over a window once all the bots are flying:
+    - the broadcasts (UPDA) every bot received per second, the server aims at 50,
+    - the size of the broadcasts, and how many don't fit the 1024 bytes the game client reads,
+    - snapshot staleness, the age of a bot's own position when a broadcast brings it back,
+    - update loss, the share of a bot's UPDRs that never showed up in a broadcast,
+    - the CPU the server used, in percent of one core.
+
+The server relays the position fields of UPDR without reading them, so
+every bot sends its update's sequence number as the pitch and its send
+time as the roll. Loss is only measurable when bots send slower than the
+server broadcasts, otherwise the server overwrites updates it never sent.
+
+Usage (from the repo root, Linux only):
+    python benchmarks/open_world_load.py --clients 10,50,100,200 --duration 20 --output report.json
+"""
+import os
+import sys
+import math
+import json
+import time
+import asyncio
+import secrets
+import argparse
+import multiprocessing
+
+from harness import Server, Session, HOST, UDP_PORT, percentile
+
+# The server broadcasts every 0.02 seconds
+BROADCAST_RATE = 50
+
+# The game client reads every broadcast into a buffer of this many bytes
+CLIENT_RECV_SIZE = 1024
+
+DEFAULT_CLIENTS = "10,50,100"
+DEFAULT_DURATION = 20
+DEFAULT_UPDATE_RATE = 20
+
+# Updates sent this close to the end of the window may not be broadcast yet, so they aren't counted as lost
+LOSS_GRACE = 0.5
+
+# The seconds every bot may take to get admitted to the open world
+ADMISSION_TIMEOUT = 10
+
+PASSWORD = "password"
+AIRCRAFT = "efroni"
+
+# The scripted flight, a circle around a point of its own for every bot
+FLIGHT_RADIUS = 1500
+FLIGHT_SPEED = 200
+FLIGHT_ALTITUDE = 800
+
+
+class Bot(asyncio.DatagramProtocol):
+    """
+    This class is a simulated pilot. Its lobby part is blocking and runs on
+    a thread, its open world part is a datagram protocol on the asyncio loop.
+    """
+
+    def __init__(self, username: str, index: int):
+        """
+        Constructor for the Bot class.
+
+        Args:
+            username (str): The username the bot signs up with.
+            index (int): The number of the bot, which places its flight path.
+        """
+        self.username = username
+        self.token = secrets.token_urlsafe(20)
+        self.marker = f"{username}|".encode()
+        self.center = ((index % 32) * 2 * FLIGHT_RADIUS, (index // 32) * 2 * FLIGHT_RADIUS)
+        self.session = None
+        self.transport = None
+        self.admitted = asyncio.Event()
+        self.error = None
+
+        # Measured between the start and the end of the window
+        self.measuring = False
+        self.received = 0
+        self.oversized = 0
+        self.largest = 0
+        self.staleness = []  # seconds
+        self.seen = set()  # the sequence numbers of the updates that came back
+        self.first_seq = None  # the first update sent in the window
+        self.last_seq = None  # the last update sent in the window, before the grace period
+
+    def lobby(self) -> None:
+        """
+        Signs up, or logs in if the account exists, and selects an aircraft.
+        """
+        self.session = Session()
+        action, answer = self.session.request(f"SGNR#{self.username}${PASSWORD}")
+        if answer != "1":
+            action, answer = self.session.request(f"LOGR#{self.username}${PASSWORD}")
+            if answer != "1":
+                raise RuntimeError(f"Could not log in as {self.username}")
+
+        action, answer = self.session.request(f"SELR#{AIRCRAFT}|{self.token}")
+        if action != "SELA" or answer != "1":
+            raise RuntimeError(f"Could not select {AIRCRAFT} as {self.username}")
+
+    def leave(self) -> None:
+        """
+        Leaves the open world and disconnects, like quitting the game does.
+        """
+        try:
+            self.session.send("EXTC")
+        except OSError:
+            pass
+        self.session.close()
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, address) -> None:
+        if data.startswith(b"ADDC"):
+            self.admitted.set()
+            return
+        if not self.measuring:
+            return
+
+        now = time.time()
+        self.received += 1
+        self.largest = max(self.largest, len(data))
+        if len(data) > CLIENT_RECV_SIZE:
+            self.oversized += 1
+
+        # Only the bot's own entry is parsed, the others cost the server the same to send
+        start = data.find(self.marker)
+        if start == -1:
+            return
+        end = data.find(b"$", start)
+        fields = data[start:end if end != -1 else len(data)].split(b"|")
+        try:
+            seq, sent = int(float(fields[6])), float(fields[7])
+        except (IndexError, ValueError):
+            return
+        if seq not in self.seen:
+            self.seen.add(seq)
+            self.staleness.append(now - sent)
+
+    def position(self, now: float) -> tuple:
+        """
+        Returns the (x, y, z, heading) of the bot along its circle at a time.
+        """
+        angle = now * FLIGHT_SPEED / FLIGHT_RADIUS
+        x = self.center[0] + FLIGHT_RADIUS * math.cos(angle)
+        y = self.center[1] + FLIGHT_RADIUS * math.sin(angle)
+        z = FLIGHT_ALTITUDE + 100 * math.sin(angle / 3)
+        return x, y, z, math.degrees(angle) % 360
+
+    async def join(self) -> None:
+        """
+        Asks to be admitted to the open world until the server confirms.
+        """
+        deadline = time.time() + ADMISSION_TIMEOUT
+        while not self.admitted.is_set():
+            if time.time() > deadline:
+                raise TimeoutError(f"{self.username} wasn't admitted to the open world")
+            self.transport.sendto(f"ADDS#{self.token}".encode())
+            try:
+                await asyncio.wait_for(self.admitted.wait(), 0.1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def fly(self, rate: float, window: dict) -> None:
+        """
+        Sends UPDR at a rate until the end of the window.
+
+        Args:
+            rate (float): The updates per second.
+            window (dict): The "start" and "end" times of the window, None until they are known.
+        """
+        seq = 0
+        next_update = time.time()
+        while window["end"] is None or next_update < window["end"]:
+            now = time.time()
+            x, y, z, h = self.position(now)
+            self.transport.sendto(f"UPDR#{self.token}${x}${y}${z}${h}${seq}${now}".encode())
+
+            if window["start"] is not None and now >= window["start"]:
+                self.measuring = True
+                if self.first_seq is None:
+                    self.first_seq = seq
+                if now < window["end"] - LOSS_GRACE:
+                    self.last_seq = seq
+
+            seq += 1
+            next_update += 1 / rate
+            await asyncio.sleep(max(0, next_update - time.time()))
+        self.measuring = False
+
+    def results(self) -> dict:
+        if self.error is not None:
+            return {"error": self.error}
+        counted = range(self.first_seq, self.last_seq + 1) if self.last_seq is not None else range(0)
+        return {
+            "received": self.received,
+            "oversized": self.oversized,
+            "largest": self.largest,
+            "staleness": self.staleness,
+            "sent": len(counted),
+            "lost": sum(1 for seq in counted if seq not in self.seen),
+        }
+
+
+async def fly_bots(pilots: list, rate: float, ready, window_times, go) -> list:
+    """
+    Flies a process' share of the bots, given as (index, username) pairs.
+
+    Returns:
+        list: The results of every bot.
+    """
+    loop = asyncio.get_running_loop()
+    bots = [Bot(username, index) for index, username in pilots]
+
+    async def enter(bot):
+        try:
+            await asyncio.to_thread(bot.lobby)
+            await loop.create_datagram_endpoint(lambda: bot, remote_addr=(HOST, UDP_PORT))
+            await bot.join()
+        except Exception as error:
+            bot.error = str(error)
+
+    await asyncio.gather(*(enter(bot) for bot in bots))
+    flying = [bot for bot in bots if bot.error is None]
+
+    # Fly while the other processes get their bots in, then measure in the common window
+    window = {"start": None, "end": None}
+    tasks = [asyncio.create_task(bot.fly(rate, window)) for bot in flying]
+    ready.put(len(flying))
+    await asyncio.to_thread(go.wait)
+    window["start"], window["end"] = window_times[0], window_times[1]
+    await asyncio.gather(*tasks)
+
+    for bot in flying:
+        bot.transport.close()
+    await asyncio.gather(*(asyncio.to_thread(bot.leave) for bot in flying))
+    return [bot.results() for bot in bots]
+
+
+def worker(pilots: list, rate: float, ready, window_times, go, results) -> None:
+    results.put(asyncio.run(fly_bots(pilots, rate, ready, window_times, go)))
+
+
+def run_load(clients: int, duration: float, rate: float, processes: int, keep: bool = False) -> dict:
+    """
+    Runs one load test against a new server.
+
+    Args:
+        clients (int): The number of bots.
+        duration (float): The seconds measured.
+        rate (float): The updates every bot sends per second.
+        processes (int): The number of processes the bots are split between.
+        keep (bool): Whether to keep the server's temporary directory.
+
+    Returns:
+        dict: The report of the run.
+    """
+    processes = max(1, min(processes, clients))
+    run = secrets.token_hex(3)
+    usernames = [f"bot_{run}_{i}" for i in range(clients)]
+
+    server = Server(keep)
+    try:
+        ready = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        window_times = multiprocessing.Array("d", 2)
+        go = multiprocessing.Event()
+        workers = []
+        for i in range(processes):
+            pilots = list(enumerate(usernames))[i::processes]
+            p = multiprocessing.Process(target=worker, args=(pilots, rate, ready, window_times, go, results), daemon=True)
+            p.start()
+            workers.append(p)
+
+        # Wait for every process to get its bots in, signing up takes a KDF per bot
+        joined = 0
+        for _ in workers:
+            joined += ready.get(timeout=60 + clients)
+
+        start = time.time() + 1
+        window_times[0], window_times[1] = start, start + duration
+        go.set()
+
+        time.sleep(max(0, start - time.time()))
+        cpu_before = server.cpu_time()
+        time.sleep(max(0, start + duration - time.time()))
+        cpu_after = server.cpu_time()
+
+        bots = []
+        for _ in workers:
+            bots.extend(results.get(timeout=60 + clients))
+        for p in workers:
+            p.join()
+    finally:
+        server.close()
+
+    flown = [bot for bot in bots if "error" not in bot]
+    staleness = [age for bot in flown for age in bot["staleness"]]
+    received = sum(bot["received"] for bot in flown)
+    sent = sum(bot["sent"] for bot in flown)
+    rates = [bot["received"] / duration for bot in flown]
+
+    def milliseconds(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        "clients": clients,
+        "joined": joined,
+        "errors": sorted({bot["error"] for bot in bots if "error" in bot}),
+        "update_rate": rate,
+        "broadcasts_per_second": round(sum(rates) / len(rates), 2) if rates else None,
+        "slowest_broadcasts_per_second": round(min(rates), 2) if rates else None,
+        "largest_broadcast": max((bot["largest"] for bot in flown), default=0),
+        "oversized_share": round(sum(bot["oversized"] for bot in flown) / received, 4) if received else None,
+        "staleness_p50_ms": milliseconds(percentile(staleness, 0.5)),
+        "staleness_p95_ms": milliseconds(percentile(staleness, 0.95)),
+        "staleness_p99_ms": milliseconds(percentile(staleness, 0.99)),
+        "update_loss": round(sum(bot["lost"] for bot in flown) / sent, 4) if sent else None,
+        "server_cpu_percent": round(100 * (cpu_after - cpu_before) / duration, 1),
+    }
+
+
+def print_report(reports: list) -> None:
+    columns = [("clients", "clients"), ("joined", "joined"), ("broadcasts_per_second", "UPDA/s"),
+               ("largest_broadcast", "max bytes"), ("oversized_share", ">1024"),
+               ("staleness_p50_ms", "p50 ms"), ("staleness_p95_ms", "p95 ms"), ("staleness_p99_ms", "p99 ms"),
+               ("update_loss", "loss"), ("server_cpu_percent", "CPU %")]
+    print("  ".join(f"{title:>10}" for _, title in columns))
+    for report in reports:
+        print("  ".join(f"{str(report[key]):>10}" for key, _ in columns))
+        for error in report["errors"]:
+            print(f"    error: {error}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the open world of a local server.")
+    parser.add_argument("--clients", default=DEFAULT_CLIENTS,
+                        help=f"comma separated numbers of bots to sweep, default {DEFAULT_CLIENTS}")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION,
+                        help=f"seconds measured for every number of bots, default {DEFAULT_DURATION}")
+    parser.add_argument("--rate", type=float, default=DEFAULT_UPDATE_RATE,
+                        help=f"updates every bot sends per second, default {DEFAULT_UPDATE_RATE}")
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="processes the bots are split between, default half the CPUs")
+    parser.add_argument("--output", help="a .json file to write the report to")
+    parser.add_argument("--keep", action="store_true", help="keep the servers' temporary directories")
+    args = parser.parse_args()
+
+    if args.rate * 2 > BROADCAST_RATE:
+        print(f"Sending faster than {BROADCAST_RATE // 2} updates per second, "
+              f"the server overwrites updates before broadcasting them and loss is overstated")
+
+    reports = []
+    for clients in [int(n) for n in args.clients.split(",")]:
+        print(f"Flying {clients} bots for {args.duration} seconds...")
+        reports.append(run_load(clients, args.duration, args.rate, args.processes, args.keep))
+    print_report(reports)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"platform": sys.platform, "cpus": os.cpu_count(), "runs": reports}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Microbenchmarks of the protocol's hot paths: pad and unpad, send_with_size
+and recv_by_size over a socketpair with and without AES, and building and
+parsing UPDR and UPDA, alone and through loopback UDP, for several message
+sizes and player counts.
+
+Every benchmark is timed like timeit does: the number of runs is doubled
+until they take MIN_TIME, then the best of REPEATS timings is kept. The
+results are compared with a saved baseline, and any benchmark slower than
+the baseline by more than the threshold is a regression, which makes the
+exit code 1. Baselines only compare runs on the same machine, save one
+before changing the protocol and compare after.
+
+Usage (from the repo root):
+    python benchmarks/protocol_bench.py --save          # save the baseline
+    python benchmarks/protocol_bench.py                 # compare with the baseline
+    python benchmarks/protocol_bench.py --filter UPDA --threshold 0.1
+"""
+import gc
+import os
+import sys
+import json
+import time
+import random
+import socket
+import secrets
+import platform
+import argparse
+
+import harness  # finds the server's modules, and turns off printing every message
+from protocol import (pad, unpad, send_with_size, recv_by_size,
+                      encode_update, decode_update, encode_players, decode_players)
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "protocol.json")
+
+# A benchmark slower than its baseline by more than this share is a regression
+DEFAULT_THRESHOLD = 0.25
+
+# The seconds every timing takes at least, and the number of timings of every benchmark
+MIN_TIME = 0.2
+REPEATS = 7
+
+MESSAGE_SIZES = (64, 1024, 16384)
+PLAYER_COUNTS = (1, 10, 50, 200)
+
+
+def random_player(index: int) -> list:
+    """
+    Returns an UPDA entry with coordinates as long as the client's floats.
+    """
+    return [f"pilot{index}", "efroni"] + [random.uniform(-5000, 5000) for _ in range(6)]
+
+
+def pad_benchmark(size: int):
+    data = secrets.token_bytes(size)
+    return lambda: pad(data), None
+
+
+def unpad_benchmark(size: int):
+    data = pad(secrets.token_bytes(size))
+    return lambda: unpad(data), None
+
+
+def tcp_benchmark(size: int, encrypted: bool):
+    """
+    Sends a message with send_with_size and receives it with recv_by_size,
+    over a socketpair.
+    """
+    sender, receiver = socket.socketpair()
+    data = secrets.token_bytes(size)
+    key = secrets.token_bytes(32) if encrypted else None
+
+    def operation():
+        send_with_size(sender, data, key)
+        recv_by_size(receiver, key)
+
+    def cleanup():
+        sender.close()
+        receiver.close()
+
+    return operation, cleanup
+
+
+def udp_benchmark(message: bytes, decode):
+    """
+    Sends a datagram over loopback UDP, receives it and parses it like its
+    receiver does.
+    """
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    address = receiver.getsockname()
+
+    def operation():
+        sender.sendto(message, address)
+        data, _ = receiver.recvfrom(65536)
+        decode(data.decode().split("#")[1])
+
+    def cleanup():
+        sender.close()
+        receiver.close()
+
+    return operation, cleanup
+
+
+def update_request_benchmarks() -> dict:
+    position = [random.uniform(-5000, 5000) for _ in range(6)]
+    token = secrets.token_urlsafe(20)
+    parameters = encode_update(token, *position).decode().split("#")[1]
+    return {
+        "UPDR/encode": lambda: (lambda: encode_update(token, *position), None),
+        "UPDR/decode": lambda: (lambda: decode_update(parameters), None),
+        "UPDR/udp": lambda: udp_benchmark(encode_update(token, *position), decode_update),
+    }
+
+
+def update_all_benchmarks(count: int) -> dict:
+    players = [random_player(i) for i in range(count)]
+    message = encode_players(players)
+    parameters = message.decode().split("#")[1]
+    return {
+        f"UPDA/encode/{count}": lambda: (lambda: encode_players(players), None),
+        f"UPDA/decode/{count}": lambda: (lambda: decode_players(parameters), None),
+        f"UPDA/udp/{count}": lambda: udp_benchmark(message, decode_players),
+    }
+
+
+def benchmarks() -> dict:
+    """
+    Returns every benchmark by name. A benchmark is a function that sets it
+    up, and returns the operation to time and a cleanup function or None.
+    """
+    random.seed(0)
+    cases = {}
+    for size in MESSAGE_SIZES:
+        cases[f"pad/{size}"] = lambda size=size: pad_benchmark(size)
+        cases[f"unpad/{size}"] = lambda size=size: unpad_benchmark(size)
+    for size in MESSAGE_SIZES:
+        cases[f"tcp/plain/{size}"] = lambda size=size: tcp_benchmark(size, False)
+        cases[f"tcp/aes/{size}"] = lambda size=size: tcp_benchmark(size, True)
+    cases.update(update_request_benchmarks())
+    for count in PLAYER_COUNTS:
+        cases.update(update_all_benchmarks(count))
+    return cases
+
+
+def measure(operation) -> float:
+    """
+    Returns the best seconds one run of an operation took.
+    """
+    def timing(number):
+        started = time.perf_counter()
+        for _ in range(number):
+            operation()
+        return time.perf_counter() - started
+
+    number = 1
+    while timing(number) < MIN_TIME:
+        number *= 2
+
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return min(timing(number) for _ in range(REPEATS)) / number
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def run(name_filter: str = None) -> dict:
+    """
+    Runs the benchmarks whose name contains a filter, or all of them.
+
+    Returns:
+        dict: The seconds of one run of every benchmark, by name.
+    """
+    results = {}
+    for name, setup in benchmarks().items():
+        if name_filter and name_filter not in name:
+            continue
+        operation, cleanup = setup()
+        try:
+            results[name] = measure(operation)
+        finally:
+            if cleanup is not None:
+                cleanup()
+        print(f"{name:>20}  {format_time(results[name]):>10}")
+    return results
+
+
+def format_time(seconds: float) -> str:
+    if seconds < 1e-6:
+        return f"{seconds * 1e9:.0f} ns"
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.2f} us"
+    return f"{seconds * 1e3:.2f} ms"
+
+
+def machine() -> dict:
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(), "cpus": os.cpu_count()}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Prints every benchmark next to its baseline.
+
+    Returns:
+        list: The names of the benchmarks slower than their baseline by more than the threshold.
+    """
+    if baseline["machine"] != machine():
+        print(f"\nThe baseline is from another machine ({baseline['machine']['platform']}), "
+              f"differences may not come from the code")
+
+    regressions = []
+    print(f"\n{'benchmark':>20}  {'now':>10}  {'baseline':>10}  {'change':>8}")
+    for name, seconds in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:>20}  {format_time(seconds):>10}  {'-':>10}  {'new':>8}")
+            continue
+        change = seconds / before - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:>20}  {format_time(seconds):>10}  {format_time(before):>10}  {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the protocol's hot paths.")
+    parser.add_argument("--filter", help="only run the benchmarks whose name contains this")
+    parser.add_argument("--baseline", default=BASELINE, help="the baseline .json file")
+    parser.add_argument("--save", action="store_true", help="save the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"the slowdown counted as a regression, default {DEFAULT_THRESHOLD}")
+    args = parser.parse_args()
+
+    results = run(args.filter)
+
+    if args.save:
+        # Keep the baselines of the benchmarks that were filtered out
+        saved = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                saved = json.load(f)["results"]
+        saved.update(results)
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({"machine": machine(), "results": saved}, f, indent=4)
+        print(f"\nSaved the baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, save one with --save")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
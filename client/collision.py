@@ -0,0 +1,124 @@
+import math
+from collections import defaultdict
+
+# The size of a spatial hash cell in world units. It should be a few times
+# larger than an aircraft together with the distance it moves in a frame.
+CELL_SIZE = 1000
+
+
+class SpatialHash:
+    """
+    This class represents a uniform grid over the world, used as the broad
+    phase of the collision detection. Every item is stored in all the cells
+    its bounding box overlaps, so a query only looks at the items near it.
+    """
+
+    def __init__(self, cell_size: float = CELL_SIZE):
+        """
+        Constructor for the SpatialHash class.
+
+        Args:
+            cell_size (float): The size of a cell in world units.
+        """
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+
+    def clear(self) -> None:
+        """
+        Removes all the items from the grid.
+        """
+        self.cells.clear()
+
+    def cell_range(self, low, high):
+        """
+        Returns the cells overlapped by an axis aligned bounding box.
+
+        Args:
+            low (sequence): The minimum (x, y, z) of the box.
+            high (sequence): The maximum (x, y, z) of the box.
+        """
+        size = self.cell_size
+        for x in range(math.floor(low[0] / size), math.floor(high[0] / size) + 1):
+            for y in range(math.floor(low[1] / size), math.floor(high[1] / size) + 1):
+                for z in range(math.floor(low[2] / size), math.floor(high[2] / size) + 1):
+                    yield x, y, z
+
+    def insert(self, item, low, high) -> None:
+        """
+        Adds an item with the given bounding box to the grid.
+
+        Args:
+            item: The item to store.
+            low (sequence): The minimum (x, y, z) of the box.
+            high (sequence): The maximum (x, y, z) of the box.
+        """
+        for cell in self.cell_range(low, high):
+            self.cells[cell].append(item)
+
+    def query(self, low, high) -> set:
+        """
+        Returns the items whose cells overlap the given bounding box.
+
+        Args:
+            low (sequence): The minimum (x, y, z) of the box.
+            high (sequence): The maximum (x, y, z) of the box.
+
+        Returns:
+            set: The candidate items.
+        """
+        found = set()
+        for cell in self.cell_range(low, high):
+            items = self.cells.get(cell)
+            if items:
+                found.update(items)
+        return found
+
+
+def swept_bounds(start, end, radius):
+    """
+    Returns the bounding box of a sphere moving from start to end.
+
+    Args:
+        start (sequence): The (x, y, z) at the start of the movement.
+        end (sequence): The (x, y, z) at the end of the movement.
+        radius (float): The radius of the sphere.
+
+    Returns:
+        tuple: The minimum and maximum (x, y, z) of the box.
+    """
+    low = tuple(min(start[i], end[i]) - radius for i in range(3))
+    high = tuple(max(start[i], end[i]) + radius for i in range(3))
+    return low, high
+
+
+def swept_spheres_hit(start_a, end_a, start_b, end_b, radius: float) -> bool:
+    """
+    Checks whether two spheres moving at the same time over the same interval
+    ever come closer than the sum of their radii. This is the narrow phase, so
+    a fast pass between two frames is not missed.
+
+    Args:
+        start_a (sequence): The (x, y, z) of the first sphere at the start.
+        end_a (sequence): The (x, y, z) of the first sphere at the end.
+        start_b (sequence): The (x, y, z) of the second sphere at the start.
+        end_b (sequence): The (x, y, z) of the second sphere at the end.
+        radius (float): The sum of the radii of the spheres.
+
+    Returns:
+        bool: True if the spheres touch during the movement.
+    """
+    # Work in the frame of the second sphere: the first one moves from
+    # offset to offset + motion and the second one stands at the origin
+    offset = [start_a[i] - start_b[i] for i in range(3)]
+    motion = [(end_a[i] - start_a[i]) - (end_b[i] - start_b[i]) for i in range(3)]
+
+    # Find the time of the closest approach, clamped to the interval
+    motion_squared = sum(m * m for m in motion)
+    if motion_squared == 0:
+        t = 0
+    else:
+        t = -sum(offset[i] * motion[i] for i in range(3)) / motion_squared
+        t = min(max(t, 0), 1)
+
+    closest = [offset[i] + motion[i] * t for i in range(3)]
+    return sum(c * c for c in closest) < radius * radius
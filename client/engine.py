@@ -1,10 +1,9 @@
-import os
-os.environ["OPENCV_IO_ENABLE_OPENEXR"] = "1"
-import cv2
-
 from gui import GUI
 from hud import HUD
-from protocol import send_with_size, recv_by_size
+from model_cache import ModelCache
+from preloader import AssetPreloader
+from collision import SpatialHash, swept_bounds, swept_spheres_hit
+from protocol import send_with_size, recv_by_size, encode_update, decode_players
 from direct.showbase.ShowBase import ShowBase
 
 from panda3d.core import AmbientLight, DirectionalLight, Vec4, Vec3,\
@@ -20,6 +19,18 @@ import secrets
 
 MAP = "alps"
 
+# Where the aircraft enters the world
+SPAWN_POS = (0, -150000, 3000)
+
+# How many seconds ahead along the velocity the ground proximity warning looks
+LOOKAHEAD_TIME = 5
+
+# Another aircraft that moved faster than this between two updates teleported,
+# like after a reset, and isn't swept along the way. Updates that arrive
+# bunched together are given at least TRACK_MIN_INTERVAL seconds.
+MAX_AIRCRAFT_SPEED = 2000
+TRACK_MIN_INTERVAL = 0.1
+
 
 class FlightSimulator(ShowBase):
     """
@@ -65,26 +76,50 @@ class FlightSimulator(ShowBase):
         # Send the crypted key back to the server
         send_with_size(self.socket, encrypted_AES_key)
 
+        # Models are loaded from .bam files converted once from the glTFs
+        self.model_cache = ModelCache()
+
         # Set up the GUI
         self.GUI = GUI(self.socket, AES_key, self.font, self.render2d,
                        self.setup_world, self.cleanup, self.exit)
 
-    def setup_world(self, aircraft: str, token: str, username: str, aircraft_specs: tuple):
+        # Load the world in the background while the player is in the menus
+        self.preloader = AssetPreloader(self.model_cache)
+        self.preloader.start(MAP, SPAWN_POS)
+        taskMgr.add(self.show_loading_progress, 'Show the loading progress')
+
+    def show_loading_progress(self, task):
+        """
+        Shows the progress of the preloader in the menus, until it loaded everything.
+        """
+        if self.preloader.done():
+            self.GUI.show_loading_progress("")
+            return task.done
+        self.GUI.show_loading_progress(self.preloader.progress_text())
+        return task.cont
+
+    def setup_world(self, aircraft: str, token: str, username: str, aircraft_specs):
         """
         Sets up the environment by loading terrain, aircraft and camera.
         """
-        # Load the aircraft
-        self.aircraft = loader.loadModel(f'models/aircrafts/{aircraft}.gltf')
+        # Load the aircraft, once the preloader baked the aircrafts
+        self.preloader.get("aircrafts")
+        self.aircraft = self.model_cache.load(f'models/aircrafts/{aircraft}.gltf')
         self.aircraft.reparentTo(render)
-        self.aircraft.setPos(0, -150000, 3000)
+        self.aircraft.setPos(*SPAWN_POS)
         self.aircraft.setScale(3)
+        self.last_aircraft_pos = self.aircraft.getPos()
 
-        # Load the terrain
-        self.terrain = loader.loadModel(f'models/enviorment/{MAP}/{MAP}.gltf')
-        self.terrain.reparentTo(render)
+        # Load the terrain. It is streamed in chunks around the aircraft, and
+        # the chunks around the spawn point were already loaded in the menus.
+        self.terrain = self.preloader.get("terrain")
+        self.terrain.root.reparentTo(render)
 
-        min_bound, max_bound = self.terrain.getTightBounds()
-        self.terrain_dimensions = max_bound - min_bound
+        # The height map of the terrain, and its min/max pyramid for swept
+        # terrain collisions. The height map is memory-mapped, so only the
+        # parts around the aircraft are actually read from the disk.
+        self.height_map = self.preloader.get("height map")
+        self.height_pyramid = self.preloader.get("height pyramid")
 
         # Add Light
         mainLight = DirectionalLight("main light")
@@ -107,7 +142,7 @@ class FlightSimulator(ShowBase):
         self.render.setFog(fog)
 
         # Set up the HUD
-        self.HUD = HUD()
+        self.HUD = HUD(self.preloader.get("satellite map"), self.preloader.get("satellite texture"))
 
         # Set up the values that will be used for the physic calculations
         self.velocity = Vec3(0, 500, 0)
@@ -116,7 +151,7 @@ class FlightSimulator(ShowBase):
         self.throttle = 1
 
         # Aircraft data
-        self.mass, self.max_thrust = aircraft_specs
+        self.mass, self.max_thrust = aircraft_specs.mass, aircraft_specs.max_thrust
         self.built_in_angle_of_attack = 10
 
         # Angle of attack values
@@ -128,26 +163,15 @@ class FlightSimulator(ShowBase):
         # Controls
         self.sensitivity = 0.6
 
-        # For Collisions
-        self.height_map = cv2.imread(
-            f"models/enviorment/{MAP}/srtm.exr", cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH)
-        self.height_map = cv2.flip(self.height_map, 0)
+        # Seconds until the terrain is hit at the current velocity, None if
+        # the terrain isn't hit within LOOKAHEAD_TIME
+        self.time_to_impact = None
 
         # Set up the camera
         a, b = self.aircraft.getTightBounds()
         self.aircraft_size = b - a
-        if aircraft == 'efroni':
-            self.camera_distance = 0.7
-        elif aircraft == 'tsofit':
-            self.camera_distance = 0.6
-        elif aircraft == 'lavie':
-            self.camera_distance = 0.8
-        elif aircraft == 'baz' or aircraft == 'raam':
-            self.camera_distance = 1.3
-        elif aircraft == 'adir':
-            self.camera_distance = 1.5
-        elif aircraft == 'barak' or aircraft == 'sufa':
-            self.camera_distance = 1
+        self.aircraft_radius = self.aircraft_size.length() / 2
+        self.camera_distance = aircraft_specs.camera_distance
         base.cam.setPos(LVecBase3(
             0, -4, 1)*int(self.aircraft_size[0]/3) * self.camera_distance + self.aircraft.getPos())
         base.cam.setHpr(self.aircraft.getHpr())
@@ -158,7 +182,16 @@ class FlightSimulator(ShowBase):
         self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.udp_socket.settimeout(0.001)
 
-        self.other_aircrafts = []
+        # The models of the other aircrafts by their usernames
+        self.other_aircrafts = {}
+
+        # For the collisions between aircrafts. Every other aircraft has a
+        # track of [aircraft type, previous position, position, frame of the
+        # last update, time of the last update], and the tracks are indexed by
+        # a spatial hash.
+        self.other_aircraft_tracks = {}
+        self.aircraft_radii = {}
+        self.aircraft_hash = SpatialHash()
 
         # For the communication with the server
         self.token = token
@@ -226,6 +259,7 @@ class FlightSimulator(ShowBase):
         self.accept("wheel_down", self.HUD.update_zoom, extraArgs=[-5])
 
         # Set up the Tasks - an altenative to the main loop.
+        taskMgr.add(self.stream_terrain, 'Stream the terrain')
         taskMgr.add(self.calculate_ground_height,
                     'Calculate the height of the ground')
         taskMgr.add(self.update_aircraft_by_physics,
@@ -245,34 +279,26 @@ class FlightSimulator(ShowBase):
     def update_key_map(self, key, state):
         self.key_map[key] = state
     
-    def calculate_ground_height(self, task):
-        x = int((self.aircraft.getX() + (408400/2)) * (self.height_map.shape[1]/408400))
-        y = int((self.aircraft.getY() + (233000/2)) * (self.height_map.shape[0]/233000))
-        try:
-            self.ground_height = self.height_map[y,x][0]
-        except:
-            self.ground_height = 0
+    def stream_terrain(self, task):
+        """
+        Loads the terrain chunks around the aircraft and releases far ones.
+
+        Returns:
+            task.cont: A flag indicating that the task should continue.
+        """
+        self.terrain.update(self.aircraft.getX(), self.aircraft.getY())
         return task.cont
 
     def calculate_ground_height(self, task):
         """
         Finds the Z value of the terrain for the (x,y) of the aircraft
-        by using the height map of the terrain. 
+        by bilinearly sampling the height map of the terrain. Outside of the
+        terrain the height is 0.
 
         Returns:
             task.cont: A flag indicating that the task should continue.
         """
-        x = int((self.aircraft.getX() + (self.terrain_dimensions.x/2))
-                * (self.height_map.shape[1]/self.terrain_dimensions.x))
-        y = int((self.aircraft.getY() + (self.terrain_dimensions.y/2))
-                * (self.height_map.shape[0]/self.terrain_dimensions.y))
-
-        # We use try-except in other to prevent the game from crashing when
-        # the (x,y) is outside of the terrain.
-        try:
-            self.ground_height = self.height_map[y, x][0]
-        except:
-            self.ground_height = 0
+        self.ground_height = self.height_map.sample(self.aircraft.getX(), self.aircraft.getY())
         return task.cont
 
     def get_forward(self) -> Vec3:
@@ -345,7 +371,8 @@ class FlightSimulator(ShowBase):
         self.velocity += acceleration * globalClock.getDt()
 
         # Update the aircraft's position based on the current throttle and orientation
-        new_aircraft_pos = self.aircraft.getPos() + self.velocity * globalClock.getDt()
+        self.last_aircraft_pos = self.aircraft.getPos()
+        new_aircraft_pos = self.last_aircraft_pos + self.velocity * globalClock.getDt()
         self.aircraft.setPos(new_aircraft_pos)
 
         return task.cont
@@ -398,11 +425,11 @@ class FlightSimulator(ShowBase):
             int: A flag indicating that the task should continue.
         """
         aircrafts_pos = [self.aircraft.getPos()] + [aircraft.getPos()
-                                                    for aircraft in self.other_aircrafts]
+                                                    for aircraft in self.other_aircrafts.values()]
         aircrafts_hpr = [self.aircraft.getHpr()] + [aircraft.getHpr()
-                                                    for aircraft in self.other_aircrafts]
+                                                    for aircraft in self.other_aircrafts.values()]
         self.HUD.update(aircrafts_pos, aircrafts_hpr,
-                        self.velocity, self.ground_height)
+                        self.velocity, self.ground_height, self.time_to_impact)
         return task.cont
 
     def update_aircraft_to_server(self, task):
@@ -418,8 +445,7 @@ class FlightSimulator(ShowBase):
         """
         x, y, z = self.aircraft.getPos()
         h, p, r = self.aircraft.getHpr()
-        to_send = f"UPDR#{self.token}${x}${y}${z}${h}${p}${r}"
-        self.udp_socket.sendto(to_send.encode(), self.server_address)
+        self.udp_socket.sendto(encode_update(self.token, x, y, z, h, p, r), self.server_address)
         return task.cont
 
     def update_other_aircrafts(self, task):
@@ -439,11 +465,6 @@ class FlightSimulator(ShowBase):
         except socket.error:
             return task.cont
 
-        # Remove all existing aircrafts to avoid duplicates.
-        for aircraft in self.other_aircrafts:
-            aircraft.removeNode()
-        self.other_aircrafts.clear()
-
         # Parse server data.
         fields = data.decode().split("#")
         action = fields[0]
@@ -451,48 +472,100 @@ class FlightSimulator(ShowBase):
             raise ValueError("Illegal action sent by the server")
 
         # Load and position other aircraft models.
-        other_aircraft_data = fields[1].split("$")
-        for aircraft in other_aircraft_data:
+        frame = globalClock.getFrameCount()
+        now = globalClock.getFrameTime()
+        tracks = {}
+        for name, aircraft_type, x, y, z, h, p, r in decode_players(fields[1]):
             # Skip own aircraft.
-            if self.username in aircraft:
+            if name == self.username:
                 continue
 
-            # Parse aircraft data.
-            name, aircraft_type, x, y, z, h, p, r = aircraft.split('|')
-
-            # Type casting all values from string values to float values
-            x = float(x)
-            y = float(y)
-            z = float(z)
-            h = float(h)
-            p = float(p)
-            r = float(r)
-
-            # Load aircraft model.
-            aircraft_model = loader.loadModel(
-                f"models/aircrafts/{aircraft_type}.gltf")
-            aircraft_model.reparentTo(render)
+            # Load the aircraft model, unless the aircraft already has one.
+            aircraft_model = self.other_aircrafts.get(name)
+            previous = self.other_aircraft_tracks.get(name)
+            if aircraft_model is None or previous[0] != aircraft_type:
+                if aircraft_model is not None:
+                    aircraft_model.removeNode()
+                aircraft_model = self.model_cache.load(
+                    f"models/aircrafts/{aircraft_type}.gltf")
+                aircraft_model.reparentTo(render)
+                aircraft_model.setScale(3)
+                self.other_aircrafts[name] = aircraft_model
+
+                # The bounding radius is measured once per aircraft type
+                if aircraft_type not in self.aircraft_radii:
+                    a, b = aircraft_model.getTightBounds()
+                    self.aircraft_radii[aircraft_type] = (b - a).length() / 2
+
             aircraft_model.setPos(x, y, z)
             aircraft_model.setHpr(h, p, r)
-            aircraft_model.setScale(3)
 
-            # Append aircraft model to the list of other aircrafts.
-            self.other_aircrafts.append(aircraft_model)
+            # The aircraft moved from its last known position during this frame,
+            # unless it moved too far to have flown there
+            pos = (x, y, z)
+            start = pos
+            if previous is not None:
+                elapsed = max(now - previous[4], TRACK_MIN_INTERVAL)
+                distance = math.dist(previous[2], pos)
+                if distance <= MAX_AIRCRAFT_SPEED * elapsed:
+                    start = previous[2]
+            tracks[name] = [aircraft_type, start, pos, frame, now]
+
+        # Remove the aircrafts that left the open world.
+        for name in list(self.other_aircrafts):
+            if name not in tracks:
+                self.other_aircrafts.pop(name).removeNode()
+
+        # Rebuild the broad phase with the swept bounds of the aircrafts
+        self.other_aircraft_tracks = tracks
+        self.aircraft_hash.clear()
+        for name, (aircraft_type, previous, pos, _, _) in tracks.items():
+            self.aircraft_hash.insert(name, *swept_bounds(previous, pos, self.aircraft_radii[aircraft_type]))
 
         # Continue with the next task.
         return task.cont
 
     def detect_collisions(self, task):
-        # Collision between aircrafts
-        for other_aircraft in self.other_aircrafts:
-            if self.aircraft.getPos(other_aircraft).length() < 2:
+        """
+        Blows the aircraft if it hit another aircraft or the terrain since the
+        last frame, and updates the ground proximity lookahead.
+
+        Args:
+            task (Task): The task manager.
+
+        Returns:
+            int: A flag indicating that the task should continue.
+        """
+        # Collision between aircrafts. The spatial hash gives the few aircrafts
+        # close to our path, which are then tested as moving spheres.
+        aircraft_pos = self.aircraft.getPos()
+        frame = globalClock.getFrameCount()
+        low, high = swept_bounds(self.last_aircraft_pos, aircraft_pos, self.aircraft_radius)
+        for name in self.aircraft_hash.query(low, high):
+            aircraft_type, previous, pos, updated_frame, _ = self.other_aircraft_tracks[name]
+
+            # Other aircrafts only move on the frame their update arrives
+            if updated_frame != frame:
+                previous = pos
+            radius = self.aircraft_radius + self.aircraft_radii[aircraft_type]
+            if swept_spheres_hit(self.last_aircraft_pos, aircraft_pos, previous, pos, radius):
                 self.blow_aircraft()
                 return task.cont
 
-        # Collision between aircraft and terrain
+        # Collision between aircraft and terrain. The whole path flown since the
+        # last frame is tested, so that fast aircrafts can't pass through ridges.
+        if self.height_pyramid.segment_hit(self.last_aircraft_pos, aircraft_pos) is not None:
+            self.blow_aircraft()
+            return task.cont
         if self.ground_height is not None:
             if self.aircraft.getZ() < self.ground_height:
                 self.blow_aircraft()
+                return task.cont
+
+        # Ground proximity lookahead along the velocity of the aircraft
+        lookahead_pos = aircraft_pos + self.velocity * LOOKAHEAD_TIME
+        hit = self.height_pyramid.segment_hit(aircraft_pos, lookahead_pos)
+        self.time_to_impact = None if hit is None else hit * LOOKAHEAD_TIME
 
         return task.cont
 
@@ -530,6 +603,7 @@ class FlightSimulator(ShowBase):
         """
         self.aircraft.setPos(0, 0, 3000)
         self.aircraft.setHpr(0, 0, 0)
+        self.last_aircraft_pos = self.aircraft.getPos()
         self.velocity = Vec3(0, 500, 0)
 
     def toggle_game_menu(self):
@@ -569,6 +643,7 @@ class FlightSimulator(ShowBase):
         self.ignore("wheel_up")
         self.ignore("wheel_down")
 
+        taskMgr.remove('Stream the terrain')
         taskMgr.remove('Calculate the height of the ground')
         taskMgr.remove('Update aircraft by physics')
         taskMgr.remove('Update aircraft by input')
@@ -579,9 +654,10 @@ class FlightSimulator(ShowBase):
         taskMgr.remove('Update the camera')
 
         self.aircraft.removeNode()
-        for aircraft in self.other_aircrafts:
+        for aircraft in self.other_aircrafts.values():
             aircraft.removeNode()
-        self.terrain.removeNode()
+        # The terrain stays loaded for the next time the world is entered
+        self.terrain.root.detachNode()
 
         render.clearLight()
         render.clearFog()
@@ -4,7 +4,7 @@ from direct.gui.DirectGui import (DirectFrame, DirectButton, DirectLabel,
                                    DirectEntry, DirectDialog, OnscreenImage,
                                    OkDialog, YesNoDialog, DGG)
 from panda3d.core import TextNode
-from sql import SQL
+from aircraft_catalog import AircraftCatalog
 import secrets
 
 
@@ -18,17 +18,41 @@ class GUI:
         self.cleanup_game_func = cleanup_game_func
         self.exit_func = exit_func
 
-        self.sql = SQL()
+        # The aircrafts of the game, read once
+        self.catalog = AircraftCatalog.load()
 
-        # Initialize login, sign up, and game menus
+        # Load the images of all the aircrafts once, so swiping never reads the disk
+        self.aircraft_textures = {}
+        for aircraft in self.catalog:
+            texture = loader.loadTexture(f"models/UI/select_aircraft/{aircraft.name}.png")
+            if base.win is not None:
+                # Upload it to the GPU now rather than on the first frame it is shown
+                texture.prepare(base.win.getGsg().getPreparedObjects())
+            self.aircraft_textures[aircraft.name] = texture
+
+        # Initialize all the menus once. Moving between them only hides and shows them.
         self.login_menu()
         self.sign_up_menu()
+        self.select_aircraft_menu()
         self.game_menu()
 
+        # Create the label of the assets still loading, shown over all the menus
+        self.loading_label = DirectLabel(text="",
+                                         scale=0.04,
+                                         pos=(0, 0, -0.93),
+                                         relief=None,
+                                         text_font=self.font,
+                                         text_fg=(1, 1, 1, 1))
+
         # Show login menu and backdrop
         self.titleLogin.show()
         self.titleLoginBackdrop.show()
 
+    def show_loading_progress(self, text):
+        # Only set the text when it changed, as it is called every frame
+        if self.loading_label['text'] != text:
+            self.loading_label.setText(text)
+
     def login(self, text_entered):
         # Check if username and password fields are filled out
         if len(self.username_entry_login.get()) == 0:
@@ -394,26 +418,15 @@ class GUI:
 
         self.titleSelectAircraft = DirectFrame(frameColor=(1, 1, 1, 0))
 
-        # Determine the appropriate greeting based on the current time
-        time = datetime.now().hour
-        if time < 12:
-            title_label = f"Good Morning, {self.username}"
-        elif time < 16:
-            title_label = f"Good Afternoon, {self.username}"
-        elif time < 19:
-            title_label = f"Good Evening, {self.username}"
-        else:
-            title_label = f"Good Night, {self.username}"
-
-        # Create the title label
-        title = DirectLabel(text=title_label,
-                            scale=0.2,
-                            pos=(-1.6, 0, 0.7),
-                            relief=None,
-                            parent=self.titleSelectAircraft,
-                            text_font=self.font,
-                            text_fg=(1, 1, 1, 1),
-                            text_align=TextNode.ALeft)
+        # Create the title label. The greeting is set when the menu is entered.
+        self.select_aircraft_title = DirectLabel(text="",
+                                                scale=0.2,
+                                                pos=(-1.6, 0, 0.7),
+                                                relief=None,
+                                                parent=self.titleSelectAircraft,
+                                                text_font=self.font,
+                                                text_fg=(1, 1, 1, 1),
+                                                text_align=TextNode.ALeft)
 
         # Create the secondary title label
         secondary_title = DirectLabel(text='Please select an Aircraft',
@@ -425,24 +438,8 @@ class GUI:
                                     text_fg=(1, 1, 1, 1),
                                     text_align=TextNode.ALeft)
 
-        # Send a request to the server to retrieve aircraft data
-        to_send = f"SHPR#".encode()
-        send_with_size(self.socket, to_send, self.key)
-
-        data = recv_by_size(self.socket, self.key)
-        if data == b"":
-            raise Exception("Server is down")
-        fields = data.decode().split("#")
-        action = fields[0]
-        parameters = fields[1].split('$')
-
-        if action != "SHPA":
-            raise ValueError("Illegal action sent by the server")
-        self.balance = int(float(parameters[0]))
-        self.inventory = parameters[1].split('|')
-
         # Create the balance label
-        self.money_title = DirectLabel(text=f"Balance: {self.balance}",
+        self.money_title = DirectLabel(text="",
                                     scale=0.05,
                                     pos=(-1.6, 0, -0.8),
                                     relief=None,
@@ -451,10 +448,22 @@ class GUI:
                                     text_fg=(1, 1, 1, 1),
                                     text_align=TextNode.ALeft)
 
+        # Create the leaderboard button
+        leaderboard_button = DirectButton(text="Leaderboard",
+                                        scale=0.05,
+                                        pos=(1.6, 0, -0.8),
+                                        relief=None,
+                                        parent=self.titleSelectAircraft,
+                                        command=self.show_leaderboard,
+                                        text_font=self.font,
+                                        text_fg=(1, 1, 1, 1),
+                                        text_align=TextNode.ARight)
+
         self.select_aircraft_id = 0
+        self.inventory = []
 
         # Create the image and label for the selected aircraft
-        self.select_aircraft_image = OnscreenImage(image="models/UI/select_aircraft/efroni.png",
+        self.select_aircraft_image = OnscreenImage(image=self.aircraft_textures["efroni"],
                                                 parent=self.titleSelectAircraft,
                                                 scale=0.8)
         self.select_aircraft_image.setTransparency(True)
@@ -467,10 +476,6 @@ class GUI:
                                                 extraArgs=["efroni"],
                                                 text_font=self.font)
 
-        if self.select_aircraft_label['extraArgs'][0] not in self.inventory:
-            self.select_aircraft_label.setText(f"PRICE: {self.sql.get_price(self.select_aircraft_id)[0]}")
-            self.select_aircraft_label['command'] = self.confirm_purchase
-
         # Create the swipe right button
         swipe_right_button = DirectButton(frameTexture="models/UI/right_arrow.png",
                                         pos=(1.5, 0, 0),
@@ -484,11 +489,82 @@ class GUI:
                                         parent=self.titleSelectAircraft,
                                         command=self.swipe_left)
         swipe_left_button.setTransparency(True)
+
+        # Hide the select aircraft menu
+        self.titleSelectAircraft.hide()
+        self.titleSelectAircraftBackdrop.hide()
+
+    def enter_select_aircraft_menu(self):
+        # Determine the appropriate greeting based on the current time
+        time = datetime.now().hour
+        if time < 12:
+            title_label = f"Good Morning, {self.username}"
+        elif time < 16:
+            title_label = f"Good Afternoon, {self.username}"
+        elif time < 19:
+            title_label = f"Good Evening, {self.username}"
+        else:
+            title_label = f"Good Night, {self.username}"
+        self.select_aircraft_title.setText(title_label)
+
+        # Retrieve the balance and inventory of the player, and start from the first aircraft
+        self.request_balance_and_inventory()
+        self.select_aircraft_id = 0
+        self.update_select_aircraft_menu()
+
+    def request_balance_and_inventory(self):
+        # Send a request to the server to retrieve aircraft data
+        to_send = f"SHPR#".encode()
+        send_with_size(self.socket, to_send, self.key)
+
+        data = recv_by_size(self.socket, self.key)
+        if data == b"":
+            raise Exception("Server is down")
+        fields = data.decode().split("#")
+        action = fields[0]
+        parameters = fields[1].split('$')
+
+        if action != "SHPA":
+            raise ValueError("Illegal action sent by the server")
+        self.balance = int(float(parameters[0]))
+        self.inventory = parameters[1].split('|')
+
+        # Update the balance label
+        self.money_title.setText(f"Balance: {self.balance}")
     
+    def show_leaderboard(self):
+        # Send a request to the server to retrieve the richest pilots
+        to_send = f"LDRR#".encode()
+        send_with_size(self.socket, to_send, self.key)
+
+        data = recv_by_size(self.socket, self.key)
+        if data == b"":
+            raise Exception("Server is down")
+        fields = data.decode().split("#")
+        action = fields[0]
+        parameters = fields[1].split('$')
+
+        if action != "LDRA":
+            raise ValueError("Illegal action sent by the server")
+        lines = []
+        for place, leader in enumerate(filter(None, parameters[1:]), start=1):
+            username, balance = leader.split('|')
+            lines.append(f"{place}. {username} - {balance}")
+        lines.append(f"You are ranked #{parameters[0]}")
+
+        # Display the leaderboard dialog
+        self.leaderboard_dialog = OkDialog(dialogName="Leaderboard",
+                                        text="\n".join(lines),
+                                        command=self.close_leaderboard)
+
+    def close_leaderboard(self, arg):
+        # Clean up the leaderboard dialog
+        self.leaderboard_dialog.cleanup()
+
     def confirm_purchase(self, aircraft_to_purchase):
         # Create the confirmation purchase dialog
         self.confirm_purchase_dialog = YesNoDialog(dialogName="YesNoDialog",
-                                                text=f"Are you sure you wish to buy the {aircraft_to_purchase} for {self.sql.get_price(self.select_aircraft_id)[0]}?",
+                                                text=f"Are you sure you wish to buy the {aircraft_to_purchase} for {self.catalog.by_name(aircraft_to_purchase).price}?",
                                                 command=self.purchase,
                                                 extraArgs=[aircraft_to_purchase])
 
@@ -514,7 +590,7 @@ class GUI:
                                                     text=f"Your purchase was successful. You now own {aircraft_to_purchase}.",
                                                     command=self.finish_purchase,
                                                     extraArgs=[aircraft_to_purchase])
-                self.balance -= int(self.sql.get_price(self.select_aircraft_id)[0])
+                self.balance -= self.catalog.by_name(aircraft_to_purchase).price
                 self.money_title.setText(f"Balance: {self.balance}")
             else:
                 # Display an unsuccessful purchase dialog
@@ -534,8 +610,8 @@ class GUI:
         self.titleSignUp.hide()
         self.titleSignUpBackdrop.hide()
 
-        # Call select_aircraft_menu function
-        self.select_aircraft_menu()
+        # Fill in the select aircraft menu for the player
+        self.enter_select_aircraft_menu()
 
         # Show Select Aircraft Menu
         self.titleSelectAircraft.show()
@@ -546,33 +622,34 @@ class GUI:
         self.titleLogin.hide()
         self.titleLoginBackdrop.hide()
 
-        # Call select_aircraft_menu function
-        self.select_aircraft_menu()
+        # Fill in the select aircraft menu for the player
+        self.enter_select_aircraft_menu()
 
         # Show Select Aircraft Menu
         self.titleSelectAircraft.show()
         self.titleSelectAircraftBackdrop.show()
 
     def swipe_right(self):
-        self.select_aircraft_id = (self.select_aircraft_id + 1) % self.sql.get_aircrafts_amount()[0]
+        self.select_aircraft_id = (self.select_aircraft_id + 1) % len(self.catalog)
         self.update_select_aircraft_menu()
 
     def swipe_left(self):
-        self.select_aircraft_id = (self.select_aircraft_id - 1) % self.sql.get_aircrafts_amount()[0]
+        self.select_aircraft_id = (self.select_aircraft_id - 1) % len(self.catalog)
         self.update_select_aircraft_menu()
 
     def update_select_aircraft_menu(self):
-        name, description = self.sql.get_aircraft_name_and_description(self.select_aircraft_id)
+        aircraft = self.catalog.by_id(self.select_aircraft_id)
+        name, description = aircraft.name, aircraft.description
 
-        # Update the image of the selected aircraft
-        self.select_aircraft_image['image'] = f"models/UI/select_aircraft/{name}.png"
+        # Update the image of the selected aircraft, from the preloaded textures
+        self.select_aircraft_image.setImage(self.aircraft_textures[name])
         self.select_aircraft_image.setTransparency(True)
 
         self.select_aircraft_label['extraArgs'] = [name]
 
         if self.select_aircraft_label['extraArgs'][0] not in self.inventory:
             # Display the price and set the command to confirm_purchase
-            self.select_aircraft_label['text'] = f"PRICE: {self.sql.get_price(self.select_aircraft_id)[0]}"
+            self.select_aircraft_label['text'] = f"PRICE: {aircraft.price}"
             self.select_aircraft_label['command'] = self.confirm_purchase
         else:
             # Display the description and set the command to select_aircraft_menu_to_world
@@ -587,7 +664,7 @@ class GUI:
         # Generate token
         token = secrets.token_urlsafe(20)
         
-        to_send = f"SELR#{self.sql.get_aircraft_name_and_description(self.select_aircraft_id)[0]}|{token}".encode()
+        to_send = f"SELR#{self.catalog.by_id(self.select_aircraft_id).name}|{token}".encode()
         send_with_size(self.socket, to_send, self.key)
         data = recv_by_size(self.socket, self.key)
         if data == b"":
@@ -599,7 +676,7 @@ class GUI:
             raise ValueError("Illegal action sent by the server")
         if int(parameters) == 1:
             # Start the game with the selected aircraft
-            self.start_game_func(args, token, self.username, self.sql.get_mass_and_max_thrust(self.select_aircraft_id))
+            self.start_game_func(args, token, self.username, self.catalog.by_id(self.select_aircraft_id))
         else:
             # Show the Plane Selection Menu again
             self.titleSelectAircraft.show()
@@ -663,24 +740,7 @@ class GUI:
         send_with_size(self.socket, to_send, self.key)
 
         # Request updated information from the server about the player's inventory and balance
-        to_send = f"SHPR#".encode()
-        send_with_size(self.socket, to_send, self.key)
-
-        # Receive data from the server
-        data = recv_by_size(self.socket, self.key)
-        if data == b"":
-            raise Exception("Server is down")
-        fields = data.decode().split("#")
-        action = fields[0]
-        parameters = fields[1].split('$')
-
-        if action != "SHPA":
-            raise ValueError("Illegal action sent by the server")
-        self.balance = int(float(parameters[0]))
-        self.inventory = parameters[1].split('|')
-
-        # Update the money title with the new balance
-        self.money_title.setText(f"Balance: {self.balance}")
+        self.request_balance_and_inventory()
 
         # Show the aircraft selection menu
         self.titleSelectAircraft.show()
@@ -3,15 +3,282 @@ from direct.gui.OnscreenImage import OnscreenImage
 
 from panda3d.core import TextNode
 from panda3d.core import Texture
+from panda3d.core import Shader
+from panda3d.core import TransparencyAttrib
+
+import math
+import time
+import threading
 
 import numpy as np
 import cv2
 import imutils
 
-MAP = "alps"
+# The size in pixels of the minimap texture, whatever the zoom is
+MINIMAP_SIZE = 256
+
+# The most times a second the minimap is redrawn
+MINIMAP_MAX_FPS = 30
+
+# The step in degrees between the pre-rotated aircraft icons
+ICON_ANGLE_STEP = 5
+
+# The position and the scale of the minimap on the screen
+MINIMAP_POS = (1.4, 0, -0.55)
+MINIMAP_SCALE = 0.4
+
+# The shader of the GPU minimap. The card shows a circle of the satellite
+# texture around center, radius away in texture coordinates, rotated by heading.
+MINIMAP_VERTEX_SHADER = """
+#version 120
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+
+attribute vec4 p3d_Vertex;
+attribute vec2 p3d_MultiTexCoord0;
+
+varying vec2 texcoord;
+
+void main() {
+    gl_Position = p3d_ModelViewProjectionMatrix * p3d_Vertex;
+    texcoord = p3d_MultiTexCoord0;
+}
+"""
+
+MINIMAP_FRAGMENT_SHADER = """
+#version 120
+
+uniform sampler2D p3d_Texture0;
+uniform vec2 center;
+uniform vec2 radius;
+uniform float heading;
+
+varying vec2 texcoord;
+
+void main() {
+    // The offset from the center of the card, -1 to 1 on both axes
+    vec2 offset = texcoord * 2.0 - 1.0;
+    float distance = length(offset);
+
+    // Rotate the offset into the map, so the heading of the aircraft points up
+    float c = cos(heading);
+    float s = sin(heading);
+    vec2 rotated = vec2(c * offset.x - s * offset.y, s * offset.x + c * offset.y);
+
+    vec3 color = texture2D(p3d_Texture0, center + rotated * radius).rgb;
+    gl_FragColor = vec4(color, 1.0 - smoothstep(0.99, 1.0, distance));
+}
+"""
+
+def build_icon_atlas(icon: np.ndarray, step: int = ICON_ANGLE_STEP) -> list:
+    """
+    Rotates an icon once to every multiple of step degrees.
+
+    Args:
+        icon (np.ndarray): The BGRA icon.
+        step (int): The angle between two icons of the atlas.
+
+    Returns:
+        list: (color, alpha, inverse alpha) tuples of uint16 arrays, ready to be blended.
+    """
+    atlas = []
+    for angle in range(0, 360, step):
+        rotated = imutils.rotate(icon, angle)
+        alpha = rotated[:, :, 3:].astype(np.uint16)
+        atlas.append((rotated[:, :, :3] * alpha, alpha, 255 - alpha))
+    return atlas
+
+
+def blend_icon(image: np.ndarray, atlas: list, angle: float, x: int, y: int) -> None:
+    """
+    Draws the icon of the atlas nearest to an angle, centered on (x, y),
+    clipping the parts outside of the image.
+
+    Args:
+        image (np.ndarray): The BGR uint8 image to draw on.
+        atlas (list): The atlas from build_icon_atlas.
+        angle (float): The rotation of the icon in degrees.
+        x (int): The column of the center of the icon.
+        y (int): The row of the center of the icon.
+    """
+    color, alpha, inverse_alpha = atlas[round(angle / ICON_ANGLE_STEP) % len(atlas)]
+    height, width = alpha.shape[:2]
+
+    # The part of the icon inside the image
+    top, left = y - height // 2, x - width // 2
+    row0, row1 = max(top, 0), min(top + height, image.shape[0])
+    column0, column1 = max(left, 0), min(left + width, image.shape[1])
+    if row0 >= row1 or column0 >= column1:
+        return
+
+    icon_rows = slice(row0 - top, row1 - top)
+    icon_columns = slice(column0 - left, column1 - left)
+    region = image[row0:row1, column0:column1]
+
+    # (icon * alpha + image * (255 - alpha)) / 255, in integers and rounded
+    blended = color[icon_rows, icon_columns] + region * inverse_alpha[icon_rows, icon_columns] + 127
+    region[:] = blended // 255
+
+
+class MinimapCompositor:
+    """
+    This class composites the CPU minimap and compass on a background thread,
+    since cv2 and NumPy release the GIL. The main thread posts the latest
+    state of the map and uploads the newest finished frame, without ever
+    waiting for the thread. Frames are double buffered: the thread draws into
+    the back buffer while the published one can be uploaded.
+    """
+
+    def __init__(self, map_pyramid):
+        """
+        Constructor for the MinimapCompositor class.
+
+        Args:
+            map_pyramid (MapPyramid): The loaded pyramid of the satellite image of the map.
+        """
+        self.map_pyramid = map_pyramid
+
+        # Read and flip the aircraft icon image, and rotate it once to every angle
+        aircraft_icon_img = cv2.imread(f"models/HUD/f16-icon.png", cv2.IMREAD_UNCHANGED)
+        self.aircraft_icon_atlas = build_icon_atlas(cv2.flip(aircraft_icon_img, 0))
+
+        # Read and flip the compass image
+        self.compass_img = cv2.imread(f"models/HUD/compass.png", cv2.IMREAD_UNCHANGED)
+        self.compass_img = cv2.flip(self.compass_img, 0)
+
+        # The buffers the minimap is composited in, reused every frame
+        self.crop_buffers = {}  # window size -> crop buffer
+        self.resized_img = np.empty((MINIMAP_SIZE, MINIMAP_SIZE, 3), dtype=np.uint8)
+        self.rotated_img = np.empty((MINIMAP_SIZE, MINIMAP_SIZE, 3), dtype=np.uint8)
+
+        # The two frames. The alpha channel of the minimap is the circle, drawn only once.
+        circle_mask = np.zeros((MINIMAP_SIZE, MINIMAP_SIZE), dtype=np.uint8)
+        circle_mask = cv2.circle(circle_mask, (MINIMAP_SIZE // 2, MINIMAP_SIZE // 2), MINIMAP_SIZE // 2, 255, -1)
+        self.minimap_frames = [np.zeros((MINIMAP_SIZE, MINIMAP_SIZE, 4), dtype=np.uint8) for _ in range(2)]
+        for frame in self.minimap_frames:
+            frame[:, :, 3] = circle_mask
+        self.compass_frames = [np.empty_like(self.compass_img) for _ in range(2)]
+        self.compass_headings = [None, None]  # the heading each compass frame was drawn at
+        self.uploaded_compass_heading = None
+
+        self.back = 0  # the frame being drawn
+        self.published = None  # the newest finished frame, until it is uploaded
+        self.request = None  # the newest state posted, until it is drawn
+        self.running = True
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def post(self, center_x: int, center_y: int, zoom: int, markers: tuple) -> None:
+        """
+        Posts the newest state of the map, replacing one not drawn yet.
+
+        Args:
+            center_x (int): The column of the center of the minimap.
+            center_y (int): The row of the center of the minimap.
+            zoom (int): The distance in pixels from the center to the edge.
+            markers (tuple): The (column, row, heading) of every aircraft on the map.
+        """
+        with self.condition:
+            self.request = (center_x, center_y, zoom, markers)
+            self.condition.notify()
+
+    def upload(self, minimap_texture, compass_texture) -> None:
+        """
+        Uploads the newest finished frame to the textures, if there is one.
+        setRamImage copies the frame, so the thread may draw over it after.
+        """
+        with self.condition:
+            if self.published is None:
+                return
+            frame = self.published
+            self.published = None
+
+            minimap_texture.setRamImage(self.minimap_frames[frame])
+            if self.compass_headings[frame] != self.uploaded_compass_heading:
+                self.uploaded_compass_heading = self.compass_headings[frame]
+                compass_texture.setRamImage(self.compass_frames[frame])
+
+    def run(self) -> None:
+        """
+        Draws the posted states into the back frame and publishes it.
+        """
+        while True:
+            with self.condition:
+                while self.request is None and self.running:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                request = self.request
+                self.request = None
+
+            self.composite(self.back, *request)
+
+            with self.condition:
+                self.published = self.back
+                self.back = 1 - self.back
+
+    def stop(self) -> None:
+        """
+        Stops the thread.
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+    def composite(self, frame: int, center_x: int, center_y: int, zoom: int, markers: tuple) -> None:
+        """
+        Draws the minimap and the compass into a frame.
+        """
+        heading = markers[0][2]
+
+        # Extract the minimap image centered around the current position of the aircraft, from the
+        # level of the pyramid whose resolution is closest to the minimap, and scale it to the minimap
+        level = self.map_pyramid.level_for(2 * zoom, MINIMAP_SIZE)
+        window = (2 * zoom) >> level
+        if window not in self.crop_buffers:
+            self.crop_buffers[window] = np.empty((window, window, 3), dtype=np.uint8)
+        crop_img = self.map_pyramid.crop(level, (center_y - zoom) >> level, (center_x - zoom) >> level,
+                                         window, out=self.crop_buffers[window])
+        cv2.resize(crop_img, (MINIMAP_SIZE, MINIMAP_SIZE), dst=self.resized_img, interpolation=cv2.INTER_LINEAR)
+        minimap_scale = MINIMAP_SIZE / (2 * zoom)
+
+        # Loop through all the aircrafts and add them to the minimap image
+        for column, row, aircraft_heading in markers:
+            # Calculate the position of the aircraft relative to the center of the minimap
+            x_offset = int((column - (center_x - zoom)) * minimap_scale)
+            y_offset = int((row - (center_y - zoom)) * minimap_scale)
+
+            # Draw the aircraft icon rotated to match its heading
+            blend_icon(self.resized_img, self.aircraft_icon_atlas, -aircraft_heading, x_offset, y_offset)
+
+        # Rotate the image, and copy it into the frame whose alpha channel is the circle
+        rotation = cv2.getRotationMatrix2D((MINIMAP_SIZE / 2, MINIMAP_SIZE / 2), heading, 1.0)
+        cv2.warpAffine(self.resized_img, rotation, (MINIMAP_SIZE, MINIMAP_SIZE), dst=self.rotated_img)
+        self.minimap_frames[frame][:, :, :3] = self.rotated_img
+
+        # Rotate the compass image, only when the heading of this frame changed
+        if heading != self.compass_headings[frame]:
+            self.compass_headings[frame] = heading
+            rows, columns = self.compass_img.shape[:2]
+            rotation = cv2.getRotationMatrix2D((columns / 2, rows / 2), heading, 1.0)
+            cv2.warpAffine(self.compass_img, rotation, (columns, rows), dst=self.compass_frames[frame])
+
 
 class HUD:
-    def __init__(self):
+    def __init__(self, map_pyramid, map_texture=None, rendering="gpu", max_fps=MINIMAP_MAX_FPS):
+        """
+        Constructor for the HUD class.
+
+        Args:
+            map_pyramid (MapPyramid): The loaded pyramid of the satellite image of the map.
+            map_texture (Texture): The satellite image as a texture, for the GPU minimap.
+            rendering (str): "gpu" to draw the minimap and the compass with a shader and
+                rotated cards, or "cpu" to composite them with OpenCV.
+            max_fps (int): The most times a second the minimap is redrawn.
+        """
         # Initialize altitude HUD element
         self.heightHUD = OnscreenText(text="0", pos=(0.675, 0 + 0.025), scale=0.05,
                                       fg=(70, 192, 22, 255), mayChange=True, align=TextNode.ARight)
@@ -20,130 +287,208 @@ class HUD:
         self.velocityHUD = OnscreenText(text="0", pos=(-0.675, 0 + 0.025), scale=0.05,
                                         fg=(70, 192, 22, 255), mayChange=True, align=TextNode.ALeft)
 
+        # Initialize ground proximity warning HUD element
+        self.warningHUD = OnscreenText(text="", pos=(0, 0.3), scale=0.08,
+                                       fg=(255, 0, 0, 255), mayChange=True, align=TextNode.ACenter)
+
         # Initialize heading HUD element
         self.headingHUD = OnscreenImage(image="models/HUD/heading.png", pos=(0, 0, 0), scale=(0.8, 0.1, 0.1))
         self.headingHUD.setTransparency(True)
 
-        # Read and flip the environment map image
-        self.map_img = cv2.imread(f"models/enviorment/{MAP}/GOOGLE_SAT_WM.tif", cv2.IMREAD_UNCHANGED)
-        self.map_img = cv2.flip(self.map_img, 0)
+        # The environment map image pyramid, preloaded
+        self.map_pyramid = map_pyramid
+
+        # The GPU minimap needs the satellite texture
+        self.rendering = rendering if map_texture is not None else "cpu"
+        if self.rendering == "gpu":
+            self.setup_gpu_minimap(map_texture)
+        else:
+            self.setup_cpu_minimap()
 
-        # Read and flip the aircraft icon image
-        self.aircraft_icon_img = cv2.imread(f"models/HUD/f16-icon.png", cv2.IMREAD_UNCHANGED)
-        self.aircraft_icon_img = cv2.flip(self.aircraft_icon_img, 0)
+        # Set the initial zoom level
+        self.zoom = 200
+
+        # What is currently shown, so elements are only redrawn when it changes
+        self.texts = {}  # element -> its text
+        self.minimap_key = None
+        self.min_redraw_interval = 1 / max_fps
+        self.last_redraw_time = 0
+
+    def setup_cpu_minimap(self) -> None:
+        """
+        Creates the minimap and the compass drawn from images composited on
+        the CPU, by a MinimapCompositor thread.
+        """
+        self.compositor = MinimapCompositor(self.map_pyramid)
 
         # Initialize minimap texture
         self.minimap_texture = Texture()
+        self.minimap_texture.setup2dTexture(MINIMAP_SIZE, MINIMAP_SIZE, Texture.T_unsigned_byte, Texture.F_rgba)
 
         # Initialize minimap HUD element
-        self.minimapHUD = OnscreenImage(image=self.minimap_texture, pos=(1.4, 0, -0.55), scale=0.4)
-
-        # Read and flip the compass image
-        self.compass_img = cv2.imread(f"models/HUD/compass.png", cv2.IMREAD_UNCHANGED)
-        self.compass_img = cv2.flip(self.compass_img, 0)
+        self.minimapHUD = OnscreenImage(image=self.minimap_texture, pos=MINIMAP_POS, scale=MINIMAP_SCALE)
+        self.minimapHUD.setTransparency(True)
 
         # Initialize compass texture
+        compass_rows, compass_columns = self.compositor.compass_img.shape[:2]
         self.compass_texture = Texture()
+        self.compass_texture.setup2dTexture(compass_columns, compass_rows, Texture.T_unsigned_byte, Texture.F_rgba)
 
         # Initialize compass HUD element
-        self.compassHUD = OnscreenImage(image=self.compass_texture, pos=(1.4, 0, -0.55), scale=0.5)
+        self.compassHUD = OnscreenImage(image=self.compass_texture, pos=MINIMAP_POS, scale=0.5)
         self.compassHUD.setTransparency(True)
 
-        # Set the initial zoom level
-        self.zoom = 200
+    def setup_gpu_minimap(self, map_texture) -> None:
+        """
+        Creates the minimap as a card showing the satellite texture through a
+        shader, and the compass and the aircraft icons as cards that are only
+        moved and rotated every frame.
+        """
+        self.map_texture = map_texture
+
+        # Initialize minimap HUD element, cut into a circle by its shader
+        self.minimapHUD = OnscreenImage(image=map_texture, pos=MINIMAP_POS, scale=MINIMAP_SCALE)
+        self.minimapHUD.setShader(Shader.make(Shader.SL_GLSL, MINIMAP_VERTEX_SHADER, MINIMAP_FRAGMENT_SHADER))
+        self.minimapHUD.setShaderInput("center", (0.5, 0.5))
+        self.minimapHUD.setShaderInput("radius", (0.5, 0.5))
+        self.minimapHUD.setShaderInput("heading", 0.0)
+        self.minimapHUD.setTransparency(TransparencyAttrib.MAlpha)
+
+        # The aircraft icons are children of the minimap, so their positions
+        # are in the minimap's own -1 to 1 coordinates
+        icon = cv2.imread(f"models/HUD/f16-icon.png", cv2.IMREAD_UNCHANGED)
+        self.aircraft_icon_scale = (icon.shape[1] / MINIMAP_SIZE, 1, icon.shape[0] / MINIMAP_SIZE)
+        self.aircraft_icons = []
 
-    def update(self, aircrafts_pos, aircrafts_hpr, velocity, ground_height):
+        # Initialize compass HUD element
+        self.compassHUD = OnscreenImage(image="models/HUD/compass.png", pos=MINIMAP_POS, scale=0.5)
+        self.compassHUD.setTransparency(True)
+
+    def update(self, aircrafts_pos, aircrafts_hpr, velocity, ground_height, time_to_impact=None):
         """
         Updates the HUD elements, minimap, and compass based on the current state of the aircraft.
+        time_to_impact is the number of seconds until the terrain ahead is hit, or None.
+        Elements are only redrawn when what they show changed.
         """
         ground_height = 0 if ground_height is None else ground_height
         
         # Update the height HUD with the current height of the aircraft
-        heightHUD_text = f'{aircrafts_pos[0].z - ground_height:.0f}'
-        self.heightHUD.setText(heightHUD_text)
+        self.set_text(self.heightHUD, f'{aircrafts_pos[0].z - ground_height:.0f}')
 
         # Update the velocity HUD with the current velocity of the aircraft
-        velocityHUD_text = f'{velocity.length():.0f}'
-        self.velocityHUD.setText(velocityHUD_text)
+        self.set_text(self.velocityHUD, f'{velocity.length():.0f}')
+
+        # Warn the pilot when the terrain ahead is about to be hit
+        self.set_text(self.warningHUD, "" if time_to_impact is None else f"PULL UP {time_to_impact:.0f}")
 
         # Calculate the coordinates of the center of the minimap
-        x = int((aircrafts_pos[0].x + (408400/2)) * (13056/408400))
-        y = int((aircrafts_pos[0].y + (233000/2)) * (7424/233000))
+        map_rows, map_columns = self.map_pyramid.shape
+        x = int((aircrafts_pos[0].x + (408400/2)) * (map_columns/408400))
+        y = int((aircrafts_pos[0].y + (233000/2)) * (map_rows/233000))
 
         # Adjust the center coordinates based on the zoom level and the size of the map
         if x - self.zoom < 0:
             self.center_x = self.zoom
-        elif x + self.zoom > self.map_img.shape[1]:
-            self.center_x = self.map_img.shape[1] - self.zoom
+        elif x + self.zoom > map_columns:
+            self.center_x = map_columns - self.zoom
         else:
             self.center_x = x
 
         if y - self.zoom < 0:
             self.center_y = self.zoom
-        elif y + self.zoom > self.map_img.shape[0]:
-            self.center_y = self.map_img.shape[0] - self.zoom
+        elif y + self.zoom > map_rows:
+            self.center_y = map_rows - self.zoom
         else:
             self.center_y = y
 
-        # Extract the minimap image centered around the current position of the aircraft
-        crop_img = np.copy(self.map_img[self.center_y-self.zoom:self.center_y+self.zoom, self.center_x-self.zoom:self.center_x+self.zoom])
-
-        # Loop through all the aircrafts and add them to the minimap image
-        for aircraft_pos, aircraft_hpr in zip(aircrafts_pos, aircrafts_hpr):
-            # Calculate the position of the aircraft relative to the center of the minimap
-            x_offset = int((aircraft_pos.x + (408400/2)) * (13056/408400)) - (self.center_x - self.zoom)
-            y_offset = int((aircraft_pos.y + (233000/2)) * (7424/233000)) - (self.center_y - self.zoom)
-
-            # Rotate the aircraft icon to match its heading
-            rotated_aircraft_icon = imutils.rotate(self.aircraft_icon_img, -aircraft_hpr[0])
-
-            # Calculate the offsets for the aircraft icon
-            y_offset_start = y_offset - (rotated_aircraft_icon.shape[0] // 2)
-            y_offset_end = y_offset + (rotated_aircraft_icon.shape[0] // 2)
-            x_offset_start = x_offset - (rotated_aircraft_icon.shape[1] // 2)
-            x_offset_end = x_offset + (rotated_aircraft_icon.shape[1] // 2)
-
-            # Blend the aircraft icon with the minimap image
-            alpha_s = rotated_aircraft_icon[:, :, 3] / 255.0
-            alpha_l = 1.0 - alpha_s
-
-            try:
-                for c in range(0, 3):
-                    crop_img[y_offset_start:y_offset_end, x_offset_start:x_offset_end, c] = (alpha_s * rotated_aircraft_icon[:, :, c] +
-                                                                                            alpha_l * crop_img[y_offset_start:y_offset_end, x_offset_start:x_offset_end, c])
-            except:
-                # out of border
-                pass
-        
-        # Rotate the image
-        crop_img = imutils.rotate(crop_img, aircrafts_hpr[0][0])
-
-        # Create a circular mask with same shape as input
-        circle_mask = np.zeros_like(crop_img)
-        circle_mask = cv2.circle(circle_mask, (crop_img.shape[0] // 2, crop_img.shape[1] // 2), self.zoom, (255,255,255), -1)
+        # The pixel and the heading in whole degrees of every aircraft on the map
+        markers = tuple((int((aircraft_pos.x + (408400/2)) * (map_columns/408400)),
+                         int((aircraft_pos.y + (233000/2)) * (map_rows/233000)),
+                         round(aircraft_hpr[0]))
+                        for aircraft_pos, aircraft_hpr in zip(aircrafts_pos, aircrafts_hpr))
+
+        # Upload the frame the compositor finished since the last update, if any
+        if self.rendering == "cpu":
+            self.compositor.upload(self.minimap_texture, self.compass_texture)
+
+        # Redraw the minimap only when something on it moved, and at most max_fps times a second
+        minimap_key = (self.center_x, self.center_y, self.zoom, markers)
+        now = time.monotonic()
+        if minimap_key == self.minimap_key or now - self.last_redraw_time < self.min_redraw_interval:
+            return
+        self.minimap_key = minimap_key
+        self.last_redraw_time = now
+
+        if self.rendering == "gpu":
+            self.update_gpu_minimap(markers)
+        else:
+            self.update_cpu_minimap(markers)
 
-        # Convert the image to BGRA format and add the circle mask to alpha channel
-        crop_img = cv2.cvtColor(crop_img, cv2.COLOR_BGR2BGRA)
-        crop_img[:, :, 3] = circle_mask[:,:,0]
+    def set_text(self, element, text: str) -> None:
+        """
+        Sets the text of an element, unless it already shows it.
+        """
+        if self.texts.get(element) != text:
+            self.texts[element] = text
+            element.setText(text)
 
-        # Convert the image to a NumPy array
-        crop_img = np.array(crop_img)
+    def update_gpu_minimap(self, markers) -> None:
+        """
+        Moves the minimap and its icons. Nothing is drawn on the CPU, the
+        shader samples the satellite texture around the new center.
 
-        # Setup a 2D texture for minimap, set the image and transparency
-        self.minimap_texture.setup2dTexture(crop_img.shape[0], crop_img.shape[1],  Texture.T_unsigned_byte, Texture.F_rgba)
-        self.minimap_texture.setRamImage(crop_img)
-        self.minimapHUD.setImage(self.minimap_texture)
-        self.minimapHUD.setTransparency(True)
+        Args:
+            markers (tuple): The (column, row, heading) of every aircraft on the map.
+        """
+        map_rows, map_columns = self.map_pyramid.shape
+        heading = markers[0][2]
+
+        self.minimapHUD.setShaderInput("center", (self.center_x / map_columns, self.center_y / map_rows))
+        self.minimapHUD.setShaderInput("radius", (self.zoom / map_columns, self.zoom / map_rows))
+        self.minimapHUD.setShaderInput("heading", math.radians(heading))
+
+        # Rotate the compass card with the map
+        self.compassHUD.setR(heading)
+
+        # Create the missing aircraft icons
+        while len(self.aircraft_icons) < len(markers):
+            icon = OnscreenImage(image="models/HUD/f16-icon.png", parent=self.minimapHUD,
+                                 scale=self.aircraft_icon_scale)
+            icon.setTransparency(True)
+            icon.setShaderOff(1)
+            self.aircraft_icons.append(icon)
+
+        cos_heading = math.cos(math.radians(heading))
+        sin_heading = math.sin(math.radians(heading))
+        for icon, (column, row, aircraft_heading) in zip(self.aircraft_icons, markers):
+            # The position of the aircraft relative to the center of the minimap, -1 to 1
+            x_offset = (column - self.center_x) / self.zoom
+            y_offset = (row - self.center_y) / self.zoom
+
+            # Rotate the offset with the map, and hide the icons outside of its circle
+            x_rotated = cos_heading * x_offset + sin_heading * y_offset
+            y_rotated = -sin_heading * x_offset + cos_heading * y_offset
+            if x_rotated ** 2 + y_rotated ** 2 > 1:
+                icon.hide()
+                continue
+
+            icon.show()
+            icon.setPos(x_rotated, 0, y_rotated)
+            icon.setR(heading - aircraft_heading)
+
+        for icon in self.aircraft_icons[len(markers):]:
+            icon.hide()
+
+    def update_cpu_minimap(self, markers) -> None:
+        """
+        Asks the compositor thread for a new frame of the minimap. It is
+        uploaded by a later update, once it is ready.
 
-        # Rotate the compass image
-        true_compass = imutils.rotate(self.compass_img, aircrafts_hpr[0][0])
+        Args:
+            markers (tuple): The (column, row, heading) of every aircraft on the map.
+        """
+        self.compositor.post(self.center_x, self.center_y, self.zoom, markers)
 
-        # Setup a 2D texture for compass, set the image and transparency
-        self.compass_texture.setup2dTexture(true_compass.shape[0], true_compass.shape[1],  Texture.T_unsigned_byte, Texture.F_rgba)
-        self.compass_texture.setRamImage(true_compass)
-        self.compassHUD.setImage(self.compass_texture)
-        self.compassHUD.setTransparency(True)
-    
     def update_zoom(self, amount) -> None:
         """Update zoom level by amount between 100 and 400."""
         new_zoom = self.zoom + int(amount * 4) 
@@ -154,6 +499,12 @@ class HUD:
         """Destroy all Heads-Up Display (HUD) objects."""
         self.headingHUD.destroy()
         self.heightHUD.destroy()
+        self.warningHUD.destroy()
         self.minimapHUD.destroy()
         self.compassHUD.destroy()
+        if self.rendering == "cpu":
+            self.compositor.stop()
+        else:
+            for icon in self.aircraft_icons:
+                icon.destroy()
         self.velocityHUD.destroy()
@@ -0,0 +1,207 @@
+"""
+Tiled, multi-resolution pyramid of the satellite image used by the minimap.
+
+The satellite image is baked once into one memory-mapped .npy file per zoom
+level, every level half the size of the previous one and cut into square
+tiles. The minimap then only reads the few tiles around the aircraft, at the
+level whose resolution matches the minimap, so neither the memory nor the
+cost of a frame depend on the size of the image or on the zoom.
+
+Usage (from the client directory), to bake the pyramid of a map ahead of time:
+    python minimap.py alps
+"""
+import os
+import sys
+import json
+import math
+
+import cv2
+import numpy as np
+
+# The size of a tile of the pyramid in pixels
+TILE_SIZE = 256
+
+# The largest texture the minimap keeps on the GPU. Most GPUs support 8192.
+MAX_TEXTURE_SIZE = 8192
+
+
+class MapPyramid:
+    """
+    This class represents the image pyramid of the satellite image of a map.
+    """
+
+    def __init__(self, directory: str, name: str = "GOOGLE_SAT_WM"):
+        """
+        Constructor for the MapPyramid class.
+
+        Args:
+            directory (str): The directory of the map.
+            name (str): The name of the satellite image inside the directory.
+        """
+        self.source_path = os.path.join(directory, f"{name}.tif")
+        self.pyramid_directory = os.path.join(directory, f"{name}.pyramid")
+        self.meta_path = os.path.join(self.pyramid_directory, "meta.json")
+
+        self.levels = []  # will store the memory-mapped tiles of every level
+        self.shapes = []  # will store the (rows, columns) of every level
+
+    def level_path(self, level: int) -> str:
+        return os.path.join(self.pyramid_directory, f"level{level}.npy")
+
+    def needs_bake(self) -> bool:
+        """
+        Returns True if the pyramid is missing or older than the source.
+        """
+        if not os.path.exists(self.meta_path):
+            return True
+        return os.path.getmtime(self.meta_path) < os.path.getmtime(self.source_path)
+
+    def bake(self) -> None:
+        """
+        Decodes the satellite image and writes every level of the pyramid as
+        a tiled .npy file, until a level fits in a single tile.
+        """
+        image = cv2.imread(self.source_path, cv2.IMREAD_COLOR)
+        if image is None:
+            raise FileNotFoundError(self.source_path)
+
+        # Row 0 should be the southern edge of the map, like the world's Y axis
+        image = cv2.flip(image, 0)
+        os.makedirs(self.pyramid_directory, exist_ok=True)
+
+        shapes = []
+        level = 0
+        while True:
+            rows, columns = image.shape[:2]
+            shapes.append([rows, columns])
+
+            # Pad to a whole number of tiles and reorder as (tile row, tile column, row, column, channel)
+            tile_rows = math.ceil(rows / TILE_SIZE)
+            tile_columns = math.ceil(columns / TILE_SIZE)
+            padded = np.pad(image, ((0, tile_rows * TILE_SIZE - rows),
+                                    (0, tile_columns * TILE_SIZE - columns), (0, 0)), mode="edge")
+            tiles = padded.reshape(tile_rows, TILE_SIZE, tile_columns, TILE_SIZE, 3).swapaxes(1, 2)
+            with open(self.level_path(level) + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(tiles))
+            os.replace(self.level_path(level) + ".tmp", self.level_path(level))
+
+            if rows <= TILE_SIZE and columns <= TILE_SIZE:
+                break
+            image = cv2.resize(image, ((columns + 1) // 2, (rows + 1) // 2), interpolation=cv2.INTER_AREA)
+            level += 1
+
+        # The meta file is written last, so it only exists for a complete pyramid
+        with open(self.meta_path + ".tmp", "w") as f:
+            json.dump({"shapes": shapes, "tile_size": TILE_SIZE}, f)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+
+    def load(self) -> None:
+        """
+        Memory-maps every level of the pyramid, baking it first if needed.
+        """
+        if self.levels:
+            return
+        if self.needs_bake():
+            self.bake()
+
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        if meta["tile_size"] != TILE_SIZE:
+            self.bake()
+            return self.load()
+
+        self.shapes = [tuple(shape) for shape in meta["shapes"]]
+        self.levels = [np.load(self.level_path(level), mmap_mode="r") for level in range(len(self.shapes))]
+
+    @property
+    def shape(self) -> tuple:
+        """
+        The (rows, columns) of the full resolution image.
+        """
+        return self.shapes[0]
+
+    def level_for(self, size: int, max_size: int) -> int:
+        """
+        Returns the finest level at which size full resolution pixels take
+        at most max_size pixels.
+        """
+        level = max(math.ceil(math.log2(size / max_size)), 0)
+        return min(level, len(self.levels) - 1)
+
+    def crop(self, level: int, row: int, column: int, size: int, out: np.ndarray = None) -> np.ndarray:
+        """
+        Copies a square window of a level, touching only the tiles it covers.
+        Parts of the window outside of the image are black.
+
+        Args:
+            level (int): The level of the pyramid.
+            row (int): The first row of the window in the level.
+            column (int): The first column of the window in the level.
+            size (int): The size of the window in pixels.
+            out (np.ndarray): A (size, size, 3) uint8 buffer to copy into.
+
+        Returns:
+            np.ndarray: The window.
+        """
+        if out is None:
+            out = np.zeros((size, size, 3), dtype=np.uint8)
+        else:
+            out[:] = 0
+
+        tiles = self.levels[level]
+        rows, columns = self.shapes[level]
+        row0, row1 = max(row, 0), min(row + size, rows)
+        column0, column1 = max(column, 0), min(column + size, columns)
+        if row0 >= row1 or column0 >= column1:
+            return out
+
+        for tile_row in range(row0 // TILE_SIZE, (row1 - 1) // TILE_SIZE + 1):
+            for tile_column in range(column0 // TILE_SIZE, (column1 - 1) // TILE_SIZE + 1):
+                # The part of the window inside this tile
+                top = max(row0, tile_row * TILE_SIZE)
+                bottom = min(row1, (tile_row + 1) * TILE_SIZE)
+                left = max(column0, tile_column * TILE_SIZE)
+                right = min(column1, (tile_column + 1) * TILE_SIZE)
+                out[top - row:bottom - row, left - column:right - column] = tiles[
+                    tile_row, tile_column,
+                    top - tile_row * TILE_SIZE:bottom - tile_row * TILE_SIZE,
+                    left - tile_column * TILE_SIZE:right - tile_column * TILE_SIZE]
+        return out
+
+    def image(self, level: int) -> np.ndarray:
+        """
+        Returns a whole level of the pyramid as a single image.
+        """
+        tiles = self.levels[level]
+        rows, columns = self.shapes[level]
+        tile_rows, tile_columns = tiles.shape[:2]
+        image = np.asarray(tiles).swapaxes(1, 2).reshape(tile_rows * TILE_SIZE, tile_columns * TILE_SIZE, 3)
+        return np.ascontiguousarray(image[:rows, :columns])
+
+    def texture(self):
+        """
+        Builds a texture of the finest level that fits in MAX_TEXTURE_SIZE.
+        The image is dropped from the RAM once it was uploaded to the GPU.
+
+        Returns:
+            Texture: The texture, row 0 being the southern edge of the map.
+        """
+        from panda3d.core import Texture, SamplerState
+
+        level = next(level for level, shape in enumerate(self.shapes) if max(shape) <= MAX_TEXTURE_SIZE)
+        image = self.image(level)
+
+        texture = Texture("minimap")
+        texture.setup2dTexture(image.shape[1], image.shape[0], Texture.T_unsigned_byte, Texture.F_rgb)
+        texture.setRamImage(image)
+        texture.setWrapU(SamplerState.WM_clamp)
+        texture.setWrapV(SamplerState.WM_clamp)
+        texture.setMinfilter(SamplerState.FT_linear_mipmap_linear)
+        texture.setKeepRamImage(False)
+        return texture
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        raise ValueError("No map entered")
+    MapPyramid(f"models/enviorment/{sys.argv[1]}").bake()
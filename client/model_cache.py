@@ -0,0 +1,206 @@
+"""
+Cache of glTF models converted to Panda3D's native .bam format.
+
+Parsing a glTF goes through the Python importer, which is slow. The first
+time a model is loaded it is converted to a .bam file keyed by the hash of
+its source files, and every load after that reads the .bam directly.
+
+Usage (from the client directory), to bake all the aircrafts and maps ahead
+of time:
+    python model_cache.py prewarm
+"""
+import os
+import sys
+import glob
+import json
+import hashlib
+import threading
+
+CACHE_DIRECTORY = "cache/models"
+
+
+class ModelCache:
+    """
+    This class represents the cache of converted models on the disk. The
+    preloader's threads and the main thread share one, so the index is only
+    used under a lock, and a model is only baked by one thread at a time.
+    """
+
+    def __init__(self, directory: str = CACHE_DIRECTORY):
+        """
+        Constructor for the ModelCache class.
+
+        Args:
+            directory (str): The directory the .bam files are stored in.
+        """
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+
+        # The index remembers the hash of every model by the size and
+        # modification time of all its source files, so unchanged sources are
+        # never hashed again.
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        self.lock = threading.Lock()
+        self.bake_locks = {}  # model path -> lock held while it is baked
+
+    def source_files(self, path: str) -> list:
+        """
+        Returns the glTF file and the buffers and images it references.
+        """
+        files = [path]
+        if path.endswith(".gltf"):
+            with open(path) as f:
+                gltf = json.load(f)
+            for item in gltf.get("buffers", []) + gltf.get("images", []):
+                uri = item.get("uri", "")
+                if uri and not uri.startswith("data:"):
+                    files.append(os.path.join(os.path.dirname(path), uri))
+        return files
+
+    @staticmethod
+    def stamp(path: str) -> list:
+        """
+        Returns the [size, modification time] of a file.
+        """
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime]
+
+    def is_unchanged(self, entry: dict) -> bool:
+        """
+        Returns True if none of the source files of an index entry changed
+        since it was hashed. Editing a buffer or a texture without touching
+        the .gltf changes the model too.
+        """
+        try:
+            return all(self.stamp(source) == stamp for source, stamp in entry.get("files", {}).items())
+        except OSError:
+            return False
+
+    def source_hash(self, path: str) -> str:
+        """
+        Returns the hash of a model and all of its source files.
+
+        Args:
+            path (str): The path of the model.
+
+        Returns:
+            str: The hex digest of the sources.
+        """
+        with self.lock:
+            entry = self.index.get(path)
+        if entry and "files" in entry and self.is_unchanged(entry):
+            return entry["hash"]
+
+        files = {}  # source -> [size, modification time]
+        digest = hashlib.sha256()
+        for source in self.source_files(path):
+            files[source] = self.stamp(source)
+            with open(source, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        source_hash = digest.hexdigest()[:16]
+
+        with self.lock:
+            old_entry = self.index.get(path)
+            self.index[path] = {"files": files, "hash": source_hash}
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.index_path + ".tmp", "w") as f:
+                json.dump(self.index, f)
+            os.replace(self.index_path + ".tmp", self.index_path)
+
+        # The bake of the old sources is never loaded again
+        if old_entry and old_entry["hash"] != source_hash:
+            try:
+                os.remove(self.bam_path(path, old_entry["hash"]))
+            except FileNotFoundError:
+                pass
+        return source_hash
+
+    def bam_path(self, path: str, source_hash: str) -> str:
+        """
+        Returns the path of the .bam file of a model with the given hash.
+        """
+        name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.directory, f"{name}-{source_hash}.bam")
+
+    def cache_path(self, path: str) -> str:
+        """
+        Returns the path of the .bam file of a model.
+        """
+        return self.bam_path(path, self.source_hash(path))
+
+    def bake(self, path: str) -> str:
+        """
+        Converts a model to a .bam file, unless it was already converted.
+        The textures are embedded, so the .bam doesn't depend on the paths
+        of the source.
+
+        Args:
+            path (str): The path of the model.
+
+        Returns:
+            str: The path of the .bam file.
+        """
+        from panda3d.core import BamFile, BamWriter, Filename
+
+        with self.lock:
+            bake_lock = self.bake_locks.setdefault(path, threading.Lock())
+
+        with bake_lock:
+            bam_path = self.cache_path(path)
+            if os.path.exists(bam_path):
+                return bam_path
+
+            model = loader.loadModel(path, noCache=True)
+            bam = BamFile()
+            if not bam.openWrite(Filename.fromOsSpecific(bam_path + ".tmp")):
+                raise IOError(f"Could not write {bam_path}")
+            bam.getWriter().setFileTextureMode(BamWriter.BTM_rawdata)
+            bam.writeObject(model.node())
+            bam.close()
+            model.removeNode()
+
+            os.replace(bam_path + ".tmp", bam_path)
+            return bam_path
+
+    def load(self, path: str, **kwargs):
+        """
+        Loads a model through the cache.
+
+        Args:
+            path (str): The path of the model.
+            **kwargs: Passed on to loader.loadModel.
+
+        Returns:
+            NodePath: The loaded model.
+        """
+        return loader.loadModel(self.bake(path), **kwargs)
+
+
+def prewarm() -> None:
+    """
+    Bakes all the aircrafts into the cache, and tiles all the maps and bakes
+    the pyramids of their minimaps.
+    """
+    from terrain_chunks import ensure_chunks
+    from minimap import MapPyramid
+
+    cache = ModelCache()
+    for path in sorted(glob.glob("models/aircrafts/*.gltf")):
+        print(f"Baking {path}")
+        cache.bake(path)
+    for directory in sorted(glob.glob("models/enviorment/*/")):
+        print(f"Tiling {directory}")
+        ensure_chunks(directory)
+        MapPyramid(directory).load()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["prewarm"]:
+        raise ValueError("Usage: python model_cache.py prewarm")
+    from direct.showbase.ShowBase import ShowBase
+    ShowBase(windowType="none")
+    prewarm()
@@ -0,0 +1,193 @@
+import glob
+import threading
+
+from panda3d.core import NodePath
+
+from terrain import HeightMap, HeightPyramid
+from terrain_chunks import TerrainStreamer, ensure_chunks, read_manifest
+from minimap import MapPyramid
+
+# What the menus show for every loading step that reports its progress
+STEP_NAMES = {"aircrafts": "Preparing the aircrafts", "terrain chunks": "Preparing the terrain"}
+
+
+class AssetPreloader:
+    """
+    This class loads the assets of the world in the background while the
+    player is still in the menus, so that entering the world doesn't freeze
+    the game. Everything is loaded on threads into a shared cache: baking
+    the aircrafts and tiling the map the first time can take minutes, so
+    they never run on the main thread, and report their progress instead.
+    Only the terrain streamer is started on the main thread, as Panda3D's
+    loader runs its callbacks there.
+    """
+
+    def __init__(self, model_cache):
+        """
+        Constructor for the AssetPreloader class.
+
+        Args:
+            model_cache (ModelCache): The cache the models are loaded through.
+        """
+        self.model_cache = model_cache
+        self.assets = {}  # asset name -> the asset, or the error loading it
+        self.ready = {}  # asset name -> event set once the asset was loaded
+        self.progress = {}  # loading step -> (done, total), for the menus to show
+        self.terrain_args = None  # (map directory, spawn position) the terrain is started with
+
+    def start(self, map_name: str, spawn_pos: tuple) -> None:
+        """
+        Starts loading the aircrafts and the assets of a map.
+
+        Args:
+            map_name (str): The name of the map.
+            spawn_pos (tuple): The (x, y, z) the aircraft enters the world at.
+        """
+        directory = f"models/enviorment/{map_name}"
+
+        # The aircraft models. Once loaded they stay in the model pool, so
+        # loading them again when entering the world is instant.
+        self.load_in_thread(["aircrafts"], self.load_aircrafts)
+
+        # The chunks of the terrain and its height map, which is placed by the
+        # extent of the tiled terrain. cv2 and NumPy release the GIL, so the
+        # menus stay responsive while these are loaded.
+        self.load_in_thread(["terrain chunks", "height map", "height pyramid"], self.load_terrain, directory)
+        self.load_in_thread(["satellite map", "satellite texture"], self.load_satellite_map, directory)
+
+        # The streamer starts with the chunks around the spawn point as soon
+        # as the map is tiled
+        self.terrain_args = (directory, spawn_pos)
+        self.ready["terrain"] = threading.Event()
+        taskMgr.add(self.poll_terrain, "Start streaming the terrain")
+
+    def load_in_thread(self, names: list, function, *args) -> None:
+        """
+        Runs a loading function on a thread. The function returns a dict
+        with the assets it loaded.
+
+        Args:
+            names (list): The names of the assets the function loads.
+            function: The loading function.
+            *args: The arguments of the function.
+        """
+        for name in names:
+            self.ready[name] = threading.Event()
+
+        def load():
+            try:
+                self.assets.update(function(*args))
+            except Exception as error:
+                for name in names:
+                    self.assets[name] = error
+            for name in names:
+                self.ready[name].set()
+
+        threading.Thread(target=load, daemon=True).start()
+
+    def get(self, name: str):
+        """
+        Returns a preloaded asset, waiting for it if it is still loading.
+
+        Args:
+            name (str): The name of the asset.
+
+        Returns:
+            The asset.
+        """
+        # The terrain is started on the main thread, which may be the one waiting for it
+        if name == "terrain" and not self.ready[name].is_set():
+            self.ready["terrain chunks"].wait()
+            self.start_terrain()
+
+        self.ready[name].wait()
+        asset = self.assets[name]
+        if isinstance(asset, Exception):
+            raise asset
+        return asset
+
+    def report(self, step: str, done: int, total: int) -> None:
+        """
+        Records the progress of a loading step.
+        """
+        self.progress[step] = (done, total)
+
+    def progress_text(self) -> str:
+        """
+        Returns the loading steps still running with their progress, e.g.
+        "Preparing the terrain 120/400", or "" if there are none.
+        """
+        return "   ".join(f"{STEP_NAMES[step]} {done}/{total}"
+                          for step, (done, total) in list(self.progress.items()) if done < total)
+
+    def done(self) -> bool:
+        """
+        Returns True once all the assets were loaded.
+        """
+        return all(event.is_set() for event in self.ready.values())
+
+    def load_aircrafts(self) -> dict:
+        """
+        Bakes the aircraft models that weren't baked yet, and loads them into
+        the model pool.
+        """
+        paths = sorted(glob.glob("models/aircrafts/*.gltf"))
+        self.report("aircrafts", 0, len(paths))
+        for done, path in enumerate(paths, 1):
+            loader.loadModel(self.model_cache.bake(path))
+            self.report("aircrafts", done, len(paths))
+        return {"aircrafts": paths}
+
+    def load_terrain(self, directory: str) -> dict:
+        """
+        Tiles the map if it was never tiled, then opens the height map of the
+        terrain and builds its pyramid.
+        """
+        ensure_chunks(directory, lambda done, total: self.report("terrain chunks", done, total))
+        extent = read_manifest(directory)["extent"]
+
+        height_map = HeightMap(directory)
+        height_map.load()
+        height_map.set_extent(*extent)
+        return {"terrain chunks": extent, "height map": height_map, "height pyramid": HeightPyramid(height_map)}
+
+    def poll_terrain(self, task):
+        """
+        Starts the terrain once the map is tiled.
+        """
+        return task.done if self.start_terrain() else task.cont
+
+    def start_terrain(self) -> bool:
+        """
+        Starts streaming the chunks around the spawn point, if the map was
+        tiled. The streamer stays detached from the scene until the world is
+        entered. Runs on the main thread.
+
+        Returns:
+            bool: True once the terrain was started, or failed to.
+        """
+        if self.ready["terrain"].is_set():
+            return True
+        if not self.ready["terrain chunks"].is_set():
+            return False
+
+        directory, spawn_pos = self.terrain_args
+        try:
+            self.get("terrain chunks")
+            terrain = TerrainStreamer(directory, NodePath("terrain"))
+            terrain.update(spawn_pos[0], spawn_pos[1])
+            self.assets["terrain"] = terrain
+        except Exception as error:
+            self.assets["terrain"] = error
+        self.ready["terrain"].set()
+        return True
+
+    @staticmethod
+    def load_satellite_map(directory: str) -> dict:
+        """
+        Opens the pyramid of the satellite image of the minimap, and builds
+        the texture the minimap draws from on the GPU.
+        """
+        map_pyramid = MapPyramid(directory)
+        map_pyramid.load()
+        return {"satellite map": map_pyramid, "satellite texture": map_pyramid.texture()}
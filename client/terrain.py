@@ -0,0 +1,449 @@
+import os
+os.environ["OPENCV_IO_ENABLE_OPENEXR"] = "1"
+
+import json
+import math
+
+import numpy as np
+
+# The baked height map is stored as square tiles of TILE_SIZE x TILE_SIZE
+# pixels, so that a lookup only pages in the tiles around the aircraft.
+TILE_SIZE = 256
+
+# Every leaf of the height pyramid covers LEAF_SIZE x LEAF_SIZE pixels. Must
+# divide TILE_SIZE.
+LEAF_SIZE = 8
+
+
+class HeightMap:
+    """
+    This class represents the height service of the terrain. The height map
+    of the map (srtm.exr) is baked once into a tiled raw .npy file, which is
+    then memory-mapped instead of being decoded on every world entry.
+    """
+
+    def __init__(self, directory: str, name: str = "srtm"):
+        """
+        Constructor for the HeightMap class.
+
+        Args:
+            directory (str): The directory of the map.
+            name (str): The name of the height map inside the directory.
+        """
+        self.source_path = os.path.join(directory, f"{name}.exr")
+        self.tiles_path = os.path.join(directory, f"{name}.tiles.npy")
+        self.meta_path = os.path.join(directory, f"{name}.tiles.json")
+
+        self.tiles = None  # will store the memory-mapped tiles
+        self.shape = None  # will store the (rows, columns) of the height map
+
+        # The size of the terrain in world units, used to convert world
+        # coordinates to pixels.
+        self.width = None
+        self.depth = None
+
+    def set_extent(self, width: float, depth: float) -> None:
+        """
+        Sets the size of the terrain the height map is stretched over.
+
+        Args:
+            width (float): The size of the terrain along the X axis.
+            depth (float): The size of the terrain along the Y axis.
+        """
+        self.width = width
+        self.depth = depth
+
+    def needs_bake(self) -> bool:
+        """
+        Returns True if the baked tiles are missing or older than the source.
+        """
+        if not os.path.exists(self.tiles_path) or not os.path.exists(self.meta_path):
+            return True
+        return os.path.getmtime(self.tiles_path) < os.path.getmtime(self.source_path)
+
+    def bake(self) -> None:
+        """
+        Decodes the EXR height map and writes it as a tiled .npy file next to
+        it, together with a small JSON file describing the original shape.
+        """
+        import cv2
+
+        height_map = cv2.imread(self.source_path, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH)
+        if height_map is None:
+            raise FileNotFoundError(self.source_path)
+
+        # Row 0 should be the southern edge of the map, like the world's Y axis
+        height_map = cv2.flip(height_map, 0)
+        if height_map.ndim == 3:
+            height_map = height_map[:, :, 0]
+        height_map = np.ascontiguousarray(height_map, dtype=np.float32)
+        rows, columns = height_map.shape
+
+        # Pad to a whole number of tiles and reorder as (tile row, tile column, row, column)
+        tile_rows = math.ceil(rows / TILE_SIZE)
+        tile_columns = math.ceil(columns / TILE_SIZE)
+        height_map = np.pad(height_map, ((0, tile_rows * TILE_SIZE - rows),
+                                         (0, tile_columns * TILE_SIZE - columns)), mode="edge")
+        tiles = height_map.reshape(tile_rows, TILE_SIZE, tile_columns, TILE_SIZE).swapaxes(1, 2)
+
+        # Write to temporary files first so a crash never leaves a half-baked cache
+        with open(self.tiles_path + ".tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(tiles))
+        with open(self.meta_path + ".tmp", "w") as f:
+            json.dump({"rows": rows, "columns": columns, "tile_size": TILE_SIZE}, f)
+        os.replace(self.tiles_path + ".tmp", self.tiles_path)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+
+    def load(self) -> None:
+        """
+        Memory-maps the baked tiles, baking them first if needed. Only the
+        header is read here; the pages are loaded when they are sampled.
+        """
+        if self.tiles is not None:
+            return
+        if self.needs_bake():
+            self.bake()
+
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        if meta["tile_size"] != TILE_SIZE:
+            self.bake()
+            return self.load()
+
+        self.shape = (meta["rows"], meta["columns"])
+        self.tiles = np.load(self.tiles_path, mmap_mode="r")
+
+    def world_to_pixel(self, x, y):
+        """
+        Converts world coordinates to (fractional) height map coordinates.
+
+        Args:
+            x (float or np.ndarray): The X value(s) in the world.
+            y (float or np.ndarray): The Y value(s) in the world.
+
+        Returns:
+            tuple: The column(s) and row(s) in the height map.
+        """
+        column = (x + self.width / 2) * (self.shape[1] / self.width)
+        row = (y + self.depth / 2) * (self.shape[0] / self.depth)
+        return column, row
+
+    def pixel_to_world(self, column, row):
+        """
+        Converts height map coordinates to world coordinates.
+
+        Args:
+            column (float or np.ndarray): The column(s) in the height map.
+            row (float or np.ndarray): The row(s) in the height map.
+
+        Returns:
+            tuple: The X and Y value(s) in the world.
+        """
+        x = column * (self.width / self.shape[1]) - self.width / 2
+        y = row * (self.depth / self.shape[0]) - self.depth / 2
+        return x, y
+
+    def pixels(self, rows, columns) -> np.ndarray:
+        """
+        Returns the raw heights at integer height map coordinates.
+
+        Args:
+            rows (np.ndarray): The rows, inside the height map.
+            columns (np.ndarray): The columns, inside the height map.
+
+        Returns:
+            np.ndarray: The heights at the given pixels.
+        """
+        return self.tiles[rows // TILE_SIZE, columns // TILE_SIZE,
+                          rows % TILE_SIZE, columns % TILE_SIZE]
+
+    def sample(self, x: float, y: float) -> float:
+        """
+        Returns the bilinearly interpolated height of the terrain at (x,y).
+        Outside of the terrain the height is 0.
+
+        Args:
+            x (float): The X value in the world.
+            y (float): The Y value in the world.
+
+        Returns:
+            float: The height of the terrain.
+        """
+        column, row = self.world_to_pixel(x, y)
+        rows, columns = self.shape
+        if not (0 <= column < columns and 0 <= row < rows):
+            return 0.0
+
+        column0, row0 = int(column), int(row)
+        column1, row1 = min(column0 + 1, columns - 1), min(row0 + 1, rows - 1)
+        fx, fy = column - column0, row - row0
+
+        tiles = self.tiles
+        h00 = tiles[row0 // TILE_SIZE, column0 // TILE_SIZE, row0 % TILE_SIZE, column0 % TILE_SIZE]
+        h01 = tiles[row0 // TILE_SIZE, column1 // TILE_SIZE, row0 % TILE_SIZE, column1 % TILE_SIZE]
+        h10 = tiles[row1 // TILE_SIZE, column0 // TILE_SIZE, row1 % TILE_SIZE, column0 % TILE_SIZE]
+        h11 = tiles[row1 // TILE_SIZE, column1 // TILE_SIZE, row1 % TILE_SIZE, column1 % TILE_SIZE]
+
+        top = h00 + (h01 - h00) * fx
+        bottom = h10 + (h11 - h10) * fx
+        return float(top + (bottom - top) * fy)
+
+    def sample_many(self, xs, ys) -> np.ndarray:
+        """
+        Vectorized version of sample for many (x,y) points at once.
+
+        Args:
+            xs (array-like): The X values in the world.
+            ys (array-like): The Y values in the world.
+
+        Returns:
+            np.ndarray: The heights of the terrain, 0 outside of it.
+        """
+        columns_f, rows_f = self.world_to_pixel(np.asarray(xs, dtype=np.float64),
+                                                np.asarray(ys, dtype=np.float64))
+        rows, columns = self.shape
+        inside = (columns_f >= 0) & (columns_f < columns) & (rows_f >= 0) & (rows_f < rows)
+
+        heights = np.zeros(columns_f.shape, dtype=np.float32)
+        if not inside.any():
+            return heights
+
+        columns_f, rows_f = columns_f[inside], rows_f[inside]
+        column0 = columns_f.astype(np.int64)
+        row0 = rows_f.astype(np.int64)
+        column1 = np.minimum(column0 + 1, columns - 1)
+        row1 = np.minimum(row0 + 1, rows - 1)
+        fx = (columns_f - column0).astype(np.float32)
+        fy = (rows_f - row0).astype(np.float32)
+
+        top = self.pixels(row0, column0) * (1 - fx) + self.pixels(row0, column1) * fx
+        bottom = self.pixels(row1, column0) * (1 - fx) + self.pixels(row1, column1) * fx
+        heights[inside] = top * (1 - fy) + bottom * fy
+        return heights
+
+
+def clip_segment(start, delta, box, t0, t1):
+    """
+    Clips the parameter range [t0, t1] of the 2D segment start + t * delta
+    to an axis aligned box (slab method).
+
+    Args:
+        start (tuple): The (column, row) at t = 0.
+        delta (tuple): The (column, row) change between t = 0 and t = 1.
+        box (tuple): The (min column, min row, max column, max row) of the box.
+        t0 (float): The start of the parameter range.
+        t1 (float): The end of the parameter range.
+
+    Returns:
+        tuple: The clipped (t0, t1), or None if the segment misses the box.
+    """
+    for axis in range(2):
+        low, high = box[axis], box[axis + 2]
+        if delta[axis] == 0:
+            if not (low <= start[axis] <= high):
+                return None
+            continue
+        entry = (low - start[axis]) / delta[axis]
+        leave = (high - start[axis]) / delta[axis]
+        if entry > leave:
+            entry, leave = leave, entry
+        t0 = max(t0, entry)
+        t1 = min(t1, leave)
+        if t0 > t1:
+            return None
+    return t0, t1
+
+
+class HeightPyramid:
+    """
+    This class represents a min/max quadtree over a HeightMap. Every node
+    stores the lowest and highest terrain below it, which lets a segment be
+    tested against the terrain by only descending into the few nodes that it
+    passes close to.
+    """
+
+    def __init__(self, height_map: HeightMap):
+        """
+        Constructor for the HeightPyramid class.
+
+        Args:
+            height_map (HeightMap): The loaded height map to build the pyramid over.
+        """
+        self.height_map = height_map
+
+        # Level 0 holds the leaves, the last level holds the single root node
+        self.min_levels = []
+        self.max_levels = []
+        self.build()
+
+    def build(self) -> None:
+        """
+        Builds the pyramid levels, one row of tiles at a time so that the
+        whole height map never has to be resident at once.
+        """
+        tiles = self.height_map.tiles
+        tile_rows, tile_columns = tiles.shape[:2]
+        leaves = TILE_SIZE // LEAF_SIZE
+
+        minimum = np.empty((tile_rows * leaves, tile_columns * leaves), dtype=np.float32)
+        maximum = np.empty_like(minimum)
+        for tile_row in range(tile_rows):
+            blocks = np.asarray(tiles[tile_row]).reshape(
+                tile_columns, leaves, LEAF_SIZE, leaves, LEAF_SIZE)
+            rows = slice(tile_row * leaves, (tile_row + 1) * leaves)
+            minimum[rows] = blocks.min(axis=(2, 4)).transpose(1, 0, 2).reshape(leaves, -1)
+            maximum[rows] = blocks.max(axis=(2, 4)).transpose(1, 0, 2).reshape(leaves, -1)
+
+        # Bilinear sampling inside a leaf also reads the first pixels of the
+        # next leaves, so each leaf takes its neighbours' extremes into account
+        minimum = self.dilate(minimum, np.minimum)
+        maximum = self.dilate(maximum, np.maximum)
+
+        self.min_levels = [minimum]
+        self.max_levels = [maximum]
+        while minimum.shape != (1, 1):
+            minimum = self.reduce(minimum, np.minimum)
+            maximum = self.reduce(maximum, np.maximum)
+            self.min_levels.append(minimum)
+            self.max_levels.append(maximum)
+
+    @staticmethod
+    def dilate(level: np.ndarray, op) -> np.ndarray:
+        """
+        Combines every node with its neighbours on the next row and column.
+        """
+        padded = np.pad(level, ((0, 1), (0, 1)), mode="edge")
+        return op(op(padded[:-1, :-1], padded[1:, :-1]), op(padded[:-1, 1:], padded[1:, 1:]))
+
+    @staticmethod
+    def reduce(level: np.ndarray, op) -> np.ndarray:
+        """
+        Combines every 2x2 block of nodes into the node of the next level.
+        """
+        rows, columns = level.shape
+        level = np.pad(level, ((0, rows % 2), (0, columns % 2)), mode="edge")
+        return op(op(level[0::2, 0::2], level[1::2, 0::2]), op(level[0::2, 1::2], level[1::2, 1::2]))
+
+    def segment_hit(self, start, end):
+        """
+        Finds where the segment between two points first goes below the
+        terrain. Parts of the segment outside of the terrain are ignored.
+
+        Args:
+            start (sequence): The (x, y, z) at the start of the segment.
+            end (sequence): The (x, y, z) at the end of the segment.
+
+        Returns:
+            float: The fraction of the segment at which the terrain is hit,
+            or None if the segment stays above the terrain.
+        """
+        height_map = self.height_map
+        start_column, start_row = height_map.world_to_pixel(start[0], start[1])
+        end_column, end_row = height_map.world_to_pixel(end[0], end[1])
+        origin = (start_column, start_row)
+        delta = (end_column - start_column, end_row - start_row)
+        start_z, delta_z = start[2], end[2] - start[2]
+
+        rows, columns = height_map.shape
+        clipped = clip_segment(origin, delta, (0, 0, columns - 1, rows - 1), 0.0, 1.0)
+        if clipped is None:
+            return None
+
+        # Depth first traversal that visits children in the order the segment
+        # enters them, so the first hit found is the earliest one
+        top = len(self.max_levels) - 1
+        stack = [(top, 0, 0, clipped[0], clipped[1])]
+        while stack:
+            level, i, j, t0, t1 = stack.pop()
+            z0 = start_z + delta_z * t0
+            z1 = start_z + delta_z * t1
+            if min(z0, z1) > self.max_levels[level][i, j]:
+                continue
+            if max(z0, z1) < self.min_levels[level][i, j]:
+                return t0
+
+            if level == 0:
+                hit = self.leaf_hit(origin, delta, start_z, delta_z, t0, t1)
+                if hit is not None:
+                    return hit
+                continue
+
+            size = LEAF_SIZE << (level - 1)
+            next_rows, next_columns = self.max_levels[level - 1].shape
+            children = []
+            for child_i in (2 * i, 2 * i + 1):
+                for child_j in (2 * j, 2 * j + 1):
+                    if child_i >= next_rows or child_j >= next_columns:
+                        continue
+                    box = (child_j * size, child_i * size, (child_j + 1) * size, (child_i + 1) * size)
+                    child = clip_segment(origin, delta, box, t0, t1)
+                    if child is not None:
+                        children.append((child[0], child[1], child_i, child_j))
+            for child_t0, child_t1, child_i, child_j in sorted(children, reverse=True):
+                stack.append((level - 1, child_i, child_j, child_t0, child_t1))
+        return None
+
+    def leaf_hit(self, origin, delta, start_z, delta_z, t0, t1):
+        """
+        Exactly tests the part [t0, t1] of the segment inside a leaf against
+        the bilinear terrain. Along a straight line the height inside a single
+        pixel cell is a quadratic of t, so every cell is solved analytically.
+
+        Returns:
+            float: The fraction of the segment at which the terrain is hit,
+            or None if this part of the segment stays above the terrain.
+        """
+        # Split [t0, t1] where the segment crosses pixel borders, so that
+        # every piece lies inside a single cell
+        cuts = [np.array([t0, t1])]
+        for axis in range(2):
+            if delta[axis] == 0:
+                continue
+            a = origin[axis] + delta[axis] * t0
+            b = origin[axis] + delta[axis] * t1
+            borders = np.arange(math.floor(min(a, b)) + 1, math.ceil(max(a, b)))
+            cuts.append((borders - origin[axis]) / delta[axis])
+        cuts = np.unique(np.concatenate(cuts))
+        start_t, end_t = cuts[:-1], cuts[1:]
+        if len(start_t) == 0:
+            start_t = end_t = cuts
+
+        # Find the cell of every piece by its middle
+        rows, columns = self.height_map.shape
+        middle = (start_t + end_t) / 2
+        column0 = np.clip(np.floor(origin[0] + delta[0] * middle), 0, columns - 1).astype(np.int64)
+        row0 = np.clip(np.floor(origin[1] + delta[1] * middle), 0, rows - 1).astype(np.int64)
+        column1 = np.minimum(column0 + 1, columns - 1)
+        row1 = np.minimum(row0 + 1, rows - 1)
+
+        h00 = self.height_map.pixels(row0, column0).astype(np.float64)
+        ex = self.height_map.pixels(row0, column1) - h00
+        ey = self.height_map.pixels(row1, column0) - h00
+        exy = self.height_map.pixels(row1, column1) - h00 - ex - ey
+
+        # The position inside the cell is fx = fx0 + delta x * t (same for y),
+        # so the height h00 + ex*fx + ey*fy + exy*fx*fy is a*t^2 + b*t + c
+        fx0 = origin[0] - column0
+        fy0 = origin[1] - row0
+        a = exy * delta[0] * delta[1]
+        b = ex * delta[0] + ey * delta[1] + exy * (fx0 * delta[1] + fy0 * delta[0])
+        c = h00 + ex * fx0 + ey * fy0 + exy * fx0 * fy0
+
+        # The segment is below the terrain where A*t^2 + B*t + C < 0
+        A, B, C = -a, delta_z - b, start_z - c
+        hit = np.where((A * start_t + B) * start_t + C < 0, start_t, np.inf)
+
+        # Otherwise the first root inside the piece is where it goes below
+        with np.errstate(divide="ignore", invalid="ignore"):
+            linear = np.abs(A) < 1e-12
+            discriminant = np.sqrt(np.where(linear, 0.0, B * B - 4 * A * C))
+            roots = [np.where(linear, -C / B, (-B - discriminant) / (2 * A)),
+                     np.where(linear, np.nan, (-B + discriminant) / (2 * A))]
+        for root in roots:
+            valid = (root >= start_t) & (root <= end_t)
+            hit = np.where(valid, np.minimum(hit, root), hit)
+
+        first = np.min(hit)
+        if first == np.inf:
+            return None
+        return float(first)
@@ -0,0 +1,363 @@
+"""
+Terrain chunking and streaming.
+
+The map is split offline into square chunks of the height map, each one
+baked at several levels of detail (LODs) into a .bam file with its own crop
+of the satellite image as a texture. While flying, TerrainStreamer pages the
+chunks around the aircraft in and out on Panda3D's loader thread, so the
+memory held by the terrain depends on the view distance and not on the size
+of the map.
+
+Usage (from the client directory):
+    python terrain_chunks.py alps
+"""
+import os
+import sys
+import json
+import math
+
+import numpy as np
+
+from terrain import HeightMap
+
+# The size of a chunk in height map pixels. Must be divisible by 2 ** (LODS - 1).
+CHUNK_SIZE = 128
+
+# The number of levels of detail. Every level halves the resolution of the
+# geometry and the texture of the previous one.
+LODS = 4
+
+# Chunks up to LOAD_RADIUS chunks away from the aircraft are loaded, and
+# chunks more than UNLOAD_RADIUS chunks away are released.
+LOAD_RADIUS = 4
+UNLOAD_RADIUS = LOAD_RADIUS + 1
+
+# How deep the skirts around every chunk go, to hide the cracks between
+# chunks of different LODs.
+SKIRT_DEPTH = 200
+
+
+def chunks_directory(directory: str) -> str:
+    return os.path.join(directory, "chunks")
+
+
+def chunk_path(directory: str, column: int, row: int, lod: int) -> str:
+    return os.path.join(chunks_directory(directory), f"{column}_{row}_{lod}.bam")
+
+
+def map_extent(directory: str) -> tuple:
+    """
+    Loads the full glTF of the map once to measure its size. Only used when
+    the map is tiled.
+
+    Args:
+        directory (str): The directory of the map.
+
+    Returns:
+        tuple: The size of the terrain along the X and Y axes.
+    """
+    name = os.path.basename(os.path.normpath(directory))
+    terrain = loader.loadModel(os.path.join(directory, f"{name}.gltf"), noCache=True)
+    min_bound, max_bound = terrain.getTightBounds()
+    terrain.removeNode()
+    return max_bound.x - min_bound.x, max_bound.y - min_bound.y
+
+
+def build_chunk_geometry(heights: np.ndarray, xs: np.ndarray, ys: np.ndarray):
+    """
+    Builds a textured grid mesh with skirts from a block of heights.
+
+    Args:
+        heights (np.ndarray): The heights, row 0 being the southern edge.
+        xs (np.ndarray): The X value in the world of every column.
+        ys (np.ndarray): The Y value in the world of every row.
+
+    Returns:
+        GeomNode: The node holding the mesh.
+    """
+    from panda3d.core import (Geom, GeomNode, GeomTriangles, GeomVertexData,
+                              GeomVertexFormat, GeomEnums)
+
+    rows, columns = heights.shape
+    heights = heights.astype(np.float32)
+
+    # Positions, normals and texture coordinates of the grid
+    grid_y, grid_x = np.meshgrid(ys, xs, indexing="ij")
+    dz_dy, dz_dx = np.gradient(heights, ys, xs)
+    normals = np.dstack((-dz_dx, -dz_dy, np.ones_like(heights)))
+    normals /= np.linalg.norm(normals, axis=2, keepdims=True)
+    u = (grid_x - xs[0]) / (xs[-1] - xs[0])
+    v = (grid_y - ys[0]) / (ys[-1] - ys[0])
+    grid = np.dstack((grid_x, grid_y, heights, normals, u, v)).reshape(-1, 8)
+
+    # The skirts repeat the vertices of the border lowered by SKIRT_DEPTH
+    index = np.arange(rows * columns).reshape(rows, columns)
+    borders = [index[0, :], index[-1, :], index[:, 0], index[:, -1]]
+    skirts = []
+    triangles = []
+    offset = len(grid)
+    for border in borders:
+        skirt = grid[border].copy()
+        skirt[:, 2] -= SKIRT_DEPTH
+        skirts.append(skirt)
+        lowered = np.arange(offset, offset + len(border))
+        offset += len(border)
+
+        # Both windings, so the skirt is visible from either side
+        a, b, c, d = border[:-1], border[1:], lowered[1:], lowered[:-1]
+        triangles += [np.stack((a, b, c), axis=1), np.stack((a, c, d), axis=1),
+                      np.stack((a, c, b), axis=1), np.stack((a, d, c), axis=1)]
+
+    # Two counter clockwise triangles for every cell of the grid
+    a = index[:-1, :-1].ravel()
+    b = index[:-1, 1:].ravel()
+    c = index[1:, 1:].ravel()
+    d = index[1:, :-1].ravel()
+    triangles += [np.stack((a, b, c), axis=1), np.stack((a, c, d), axis=1)]
+
+    vertices = np.ascontiguousarray(np.concatenate([grid] + skirts), dtype=np.float32)
+    triangles = np.ascontiguousarray(np.concatenate(triangles), dtype=np.uint32)
+
+    vertex_data = GeomVertexData("chunk", GeomVertexFormat.getV3n3t2(), Geom.UHStatic)
+    vertex_data.uncleanSetNumRows(len(vertices))
+    memoryview(vertex_data.modifyArray(0)).cast("B").cast("f")[:] = vertices.ravel()
+
+    primitive = GeomTriangles(Geom.UHStatic)
+    primitive.setIndexType(GeomEnums.NT_uint32)
+    primitive.modifyVertices().uncleanSetNumRows(triangles.size)
+    memoryview(primitive.modifyVertices()).cast("B").cast("I")[:] = triangles.ravel()
+
+    geom = Geom(vertex_data)
+    geom.addPrimitive(primitive)
+    node = GeomNode("chunk")
+    node.addGeom(geom)
+    return node
+
+
+def tile_map(directory: str, extent: tuple, progress=None) -> None:
+    """
+    Splits the map into chunks at every LOD and writes them, together with a
+    manifest, into the chunks directory of the map.
+
+    Args:
+        directory (str): The directory of the map.
+        extent (tuple): The size of the terrain along the X and Y axes.
+        progress: Called with the number of chunks written and the total after every chunk, if given.
+    """
+    import cv2
+    from panda3d.core import NodePath, Texture, TexturePool
+
+    os.makedirs(chunks_directory(directory), exist_ok=True)
+
+    height_map = HeightMap(directory)
+    height_map.load()
+    height_map.set_extent(*extent)
+    rows, columns = height_map.shape
+
+    satellite = cv2.imread(os.path.join(directory, "GOOGLE_SAT_WM.tif"), cv2.IMREAD_COLOR)
+    if satellite is None:
+        raise FileNotFoundError(os.path.join(directory, "GOOGLE_SAT_WM.tif"))
+    texture_rows, texture_columns = satellite.shape[:2]
+
+    chunk_columns = math.ceil((columns - 1) / CHUNK_SIZE)
+    chunk_rows = math.ceil((rows - 1) / CHUNK_SIZE)
+
+    for chunk_row in range(chunk_rows):
+        for chunk_column in range(chunk_columns):
+            # The chunk shares its last row and column with the next chunks
+            row0 = chunk_row * CHUNK_SIZE
+            column0 = chunk_column * CHUNK_SIZE
+            row1 = min(row0 + CHUNK_SIZE, rows - 1)
+            column1 = min(column0 + CHUNK_SIZE, columns - 1)
+            block_rows, block_columns = np.mgrid[row0:row1 + 1, column0:column1 + 1]
+            heights = height_map.pixels(block_rows, block_columns)
+
+            # The satellite image is not flipped, so its first row is the north
+            top = int(texture_rows - row1 * texture_rows / rows)
+            bottom = int(math.ceil(texture_rows - row0 * texture_rows / rows))
+            left = int(column0 * texture_columns / columns)
+            right = int(math.ceil(column1 * texture_columns / columns))
+            image = satellite[top:bottom, left:right]
+
+            for lod in range(LODS):
+                step = 2 ** lod
+
+                # Keep the last row and column so neighbouring chunks meet
+                lod_rows = np.union1d(np.arange(0, heights.shape[0], step), [heights.shape[0] - 1])
+                lod_columns = np.union1d(np.arange(0, heights.shape[1], step), [heights.shape[1] - 1])
+                xs, ys = height_map.pixel_to_world(column0 + lod_columns, row0 + lod_rows)
+                node = build_chunk_geometry(heights[np.ix_(lod_rows, lod_columns)], xs, ys)
+                chunk = NodePath(node)
+
+                image_path = os.path.join(chunks_directory(directory), f"{chunk_column}_{chunk_row}_{lod}.jpg")
+                lod_image = cv2.resize(image, (max(image.shape[1] // step, 1), max(image.shape[0] // step, 1)),
+                                       interpolation=cv2.INTER_AREA)
+                cv2.imwrite(image_path, lod_image)
+
+                texture = TexturePool.loadTexture(image_path)
+                texture.setWrapU(Texture.WM_clamp)
+                texture.setWrapV(Texture.WM_clamp)
+                texture.setMinfilter(Texture.FT_linear_mipmap_linear)
+                chunk.setTexture(texture)
+                chunk.writeBamFile(chunk_path(directory, chunk_column, chunk_row, lod))
+                TexturePool.releaseTexture(texture)
+
+            if progress is not None:
+                progress(chunk_row * chunk_columns + chunk_column + 1, chunk_rows * chunk_columns)
+
+    manifest = {"extent": list(extent), "shape": [rows, columns], "chunk_size": CHUNK_SIZE,
+                "chunks": [chunk_columns, chunk_rows], "lods": LODS}
+    with open(os.path.join(chunks_directory(directory), "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+
+
+def ensure_chunks(directory: str, progress=None) -> None:
+    """
+    Tiles the map if it was never tiled before.
+
+    Args:
+        directory (str): The directory of the map.
+        progress: Passed on to tile_map.
+    """
+    if not os.path.exists(os.path.join(chunks_directory(directory), "manifest.json")):
+        tile_map(directory, map_extent(directory), progress)
+
+
+def read_manifest(directory: str) -> dict:
+    """
+    Returns the manifest tile_map wrote for a map.
+    """
+    with open(os.path.join(chunks_directory(directory), "manifest.json")) as f:
+        return json.load(f)
+
+
+class TerrainStreamer:
+    """
+    This class represents the terrain while flying. It keeps the chunks
+    around the aircraft loaded at a level of detail that drops with the
+    distance, loading them on Panda3D's loader thread. It must only be used
+    from the main thread, which runs the loader's callbacks.
+    """
+
+    def __init__(self, directory: str, parent):
+        """
+        Constructor for the TerrainStreamer class.
+
+        Args:
+            directory (str): The directory of the map.
+            parent (NodePath): The node to attach the terrain to.
+        """
+        self.directory = directory
+        manifest = read_manifest(directory)
+
+        self.extent = tuple(manifest["extent"])
+        self.shape = tuple(manifest["shape"])
+        self.chunk_size = manifest["chunk_size"]
+        self.chunk_columns, self.chunk_rows = manifest["chunks"]
+        self.lods = manifest["lods"]
+
+        # The size of a chunk in the world
+        self.chunk_width = self.chunk_size * self.extent[0] / self.shape[1]
+        self.chunk_depth = self.chunk_size * self.extent[1] / self.shape[0]
+
+        self.root = parent.attachNewNode("terrain")
+        self.loaded = {}  # (column, row) -> (lod, NodePath)
+        self.pending = {}  # (column, row) -> (lod, request)
+
+    def chunk_at(self, x: float, y: float) -> tuple:
+        """
+        Returns the (column, row) of the chunk below a point in the world.
+        """
+        column = math.floor((x + self.extent[0] / 2) / self.chunk_width)
+        row = math.floor((y + self.extent[1] / 2) / self.chunk_depth)
+        return column, row
+
+    def lod_for_distance(self, distance: int) -> int:
+        """
+        Returns the LOD of a chunk that is distance chunks away.
+        """
+        return min(max(distance - 1, 0), self.lods - 1)
+
+    def update(self, x: float, y: float) -> None:
+        """
+        Requests the chunks needed around (x,y) and releases the far ones.
+
+        Args:
+            x (float): The X value of the aircraft in the world.
+            y (float): The Y value of the aircraft in the world.
+        """
+        center_column, center_row = self.chunk_at(x, y)
+
+        # Request every missing chunk, or a chunk whose LOD should change
+        for row in range(max(center_row - LOAD_RADIUS, 0), min(center_row + LOAD_RADIUS + 1, self.chunk_rows)):
+            for column in range(max(center_column - LOAD_RADIUS, 0),
+                                min(center_column + LOAD_RADIUS + 1, self.chunk_columns)):
+                key = (column, row)
+                lod = self.lod_for_distance(max(abs(column - center_column), abs(row - center_row)))
+                if key in self.pending:
+                    if self.pending[key][0] == lod:
+                        continue
+                    loader.cancelRequest(self.pending[key][1])
+                if key in self.loaded and self.loaded[key][0] == lod:
+                    self.pending.pop(key, None)
+                    continue
+                request = loader.loadModel(chunk_path(self.directory, column, row, lod), noCache=True,
+                                           callback=self.on_chunk_loaded, extraArgs=[key, lod])
+                self.pending[key] = (lod, request)
+
+        # Release the chunks that are too far away
+        for key in list(self.loaded) + list(self.pending):
+            if max(abs(key[0] - center_column), abs(key[1] - center_row)) > UNLOAD_RADIUS:
+                self.release(key)
+
+    def on_chunk_loaded(self, model, key: tuple, lod: int) -> None:
+        """
+        Called on the main thread when a chunk finished loading.
+        """
+        if self.pending.get(key, (None,))[0] != lod:
+            # The chunk is no longer wanted at this LOD
+            self.unload_model(model)
+            return
+        del self.pending[key]
+
+        if key in self.loaded:
+            self.unload_model(self.loaded[key][1])
+        model.reparentTo(self.root)
+        self.loaded[key] = (lod, model)
+
+    def release(self, key: tuple) -> None:
+        """
+        Unloads a chunk and cancels its pending request.
+        """
+        if key in self.pending:
+            loader.cancelRequest(self.pending.pop(key)[1])
+        if key in self.loaded:
+            self.unload_model(self.loaded.pop(key)[1])
+
+    @staticmethod
+    def unload_model(model) -> None:
+        """
+        Removes a chunk and frees its texture.
+        """
+        from panda3d.core import TexturePool
+
+        for texture in model.findAllTextures():
+            TexturePool.releaseTexture(texture)
+        model.removeNode()
+
+    def destroy(self) -> None:
+        """
+        Unloads all the chunks.
+        """
+        for key in list(self.loaded) + list(self.pending):
+            self.release(key)
+        self.root.removeNode()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        raise ValueError("No map entered")
+    from direct.showbase.ShowBase import ShowBase
+    ShowBase(windowType="none")
+    map_directory = f"models/enviorment/{sys.argv[1]}"
+    tile_map(map_directory, map_extent(map_directory))
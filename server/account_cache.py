@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+
+
+class AccountCache:
+    """
+    This class keeps the balance and inventory of the most recently used
+    accounts in memory, evicting the least recently used one when full.
+    AccountManagement writes every change through it, so for an active
+    player the menus never query the DB.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        """
+        Constructor for the AccountCache class.
+
+        Args:
+            capacity (int): The most accounts kept in the cache.
+        """
+        self.capacity = capacity
+        self.entries = OrderedDict()  # account id -> [username, balance, inventory]
+        self.ids = {}  # username -> account id
+        self.lock = threading.Lock()
+
+    def get(self, account_id: int):
+        """
+        Returns the (balance, inventory) of an account, or None if it isn't cached.
+        """
+        with self.lock:
+            entry = self.entries.get(account_id)
+            if entry is None:
+                return None
+            self.entries.move_to_end(account_id)
+            return entry[1], entry[2]
+
+    def put(self, account_id: int, username: str, balance: int, inventory: str) -> None:
+        """
+        Caches the balance and inventory of an account.
+        """
+        with self.lock:
+            self.entries[account_id] = [username, balance, inventory]
+            self.entries.move_to_end(account_id)
+            self.ids[username] = account_id
+
+            while len(self.entries) > self.capacity:
+                _, (evicted_username, _, _) = self.entries.popitem(last=False)
+                del self.ids[evicted_username]
+
+    def add_to_balance(self, account_id: int, delta: int) -> None:
+        with self.lock:
+            entry = self.entries.get(account_id)
+            if entry is not None:
+                entry[1] += delta
+
+    def set_inventory(self, account_id: int, inventory: str) -> None:
+        with self.lock:
+            entry = self.entries.get(account_id)
+            if entry is not None:
+                entry[2] = inventory
+
+    def invalidate_username(self, username: str) -> None:
+        """
+        Drops an account from the cache.
+        """
+        with self.lock:
+            account_id = self.ids.pop(username, None)
+            if account_id is not None:
+                del self.entries[account_id]
@@ -1,12 +1,23 @@
+import os
 import sqlite3
+import threading
 import secrets
 import hashlib
+import hmac
 import base64
-import time
 import sys
+import logging
 import traceback
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 
+from balance_ledger import BalanceLedger
+from account_cache import AccountCache
+from db_executor import DBExecutor, runs_on_executor
+from aircraft_catalog import AircraftCatalog
+from leaderboard import Leaderboard
+
 
 @dataclass
 class Account:
@@ -19,42 +30,346 @@ class Account:
     token: str = None
 
 
+# The pragmas every connection is opened with. In WAL mode readers don't block
+# the writer, and NORMAL synchronous only syncs the WAL on checkpoints.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+# The KDF new passwords are hashed with. Passwords stored with another one
+# still log in, and are rehashed with this one when they do.
+DEFAULT_HASH = "scrypt"
+
+# The seconds between two writes of the balance changes to the DB
+BALANCE_FLUSH_INTERVAL = 1.0
+
+# The most accounts whose balance and inventory are kept in memory
+ACCOUNT_CACHE_SIZE = 1024
+
+# The number of accounts whose inventories are migrated in one transaction
+MIGRATION_BATCH_SIZE = 500
+
+# The user_version of a DB whose inventories were all migrated to account_aircraft
+INVENTORY_MIGRATED_VERSION = 1
+
+# The user_version of a DB whose accounts table never gives the id of a deleted account again
+ACCOUNTS_AUTOINCREMENT_VERSION = 2
+
+# The accounts table. AUTOINCREMENT keeps ids of deleted accounts from being
+# reused, so nothing kept by id, like the ledger's pending changes, can reach
+# a new account.
+ACCOUNTS_TABLE = """
+    CREATE TABLE {name} (
+        id integer PRIMARY KEY AUTOINCREMENT,
+        username text NOT NULL UNIQUE,
+        password text,
+        balance integer,
+        inventory text
+    );
+"""
+
+# The number of processes passwords are hashed in
+KDF_WORKERS = os.cpu_count() or 1
+
+
+def sha256(password: bytes, salt: bytes, pepper: bytes) -> bytes:
+    """
+    The legacy hash, a single SHA-256 of the pepper, the salt and the password.
+    """
+    return hashlib.sha256(pepper + salt + password).digest()
+
+
+def pbkdf2_sha256(password: bytes, salt: bytes, pepper: bytes) -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", pepper + password, salt, 200_000)
+
+
+def scrypt(password: bytes, salt: bytes, pepper: bytes) -> bytes:
+    return hashlib.scrypt(pepper + password, salt=salt, n=2 ** 14, r=8, p=1, dklen=32)
+
+
+HASH_FUNCTIONS = {hash_fn.__name__: hash_fn for hash_fn in (sha256, pbkdf2_sha256, scrypt)}
+
+
+def hash_password(hash_name: str, password: str, salt: str, pepper: str) -> str:
+    """
+    Hashes a password with a KDF and encodes the hash in base64. This runs in
+    the KDF processes, so it only takes picklable arguments.
+
+    Args:
+        hash_name (str): The name of the KDF.
+        password (str): The password.
+        salt (str): The salt of the account.
+        pepper (str): The global pepper.
+
+    Returns:
+        str: The base64 of the hash.
+    """
+    hash_fn = HASH_FUNCTIONS[hash_name]
+    hash_bytes = hash_fn(password.encode("utf-8"), salt.encode("utf-8"), pepper.encode("utf-8"))
+    return base64.b64encode(hash_bytes).decode("ascii")
+
+
 class AccountManagement:
-    def __init__(self):
-        self.conn = None  # will store the DB connection
-        self.cursor = None  # will store the DB connection cursor
+    def __init__(self, path: str = "database.db", balance_flush_interval: float = BALANCE_FLUSH_INTERVAL):
+        """
+        Constructor for the AccountManagement class. All client threads share
+        one instance, and every thread gets its own connection to read the DB.
+        All the writes run on the thread of a DBExecutor.
+
+        Args:
+            path (str): The path of the DB file.
+            balance_flush_interval (float): The seconds between two writes of the balances.
+        """
+        self.path = path
+        self.local = threading.local()  # will store the connection of every thread
+        self.connections = []  # will store all the connections, to close them
+        self.connections_lock = threading.Lock()
+
+        # The aircrafts of the game and their prices, read once
+        self.catalog = AircraftCatalog.load(path)
+
+        # Passwords are hashed in other processes, so a login storm uses all
+        # the cores and doesn't hold the GIL of the client threads. The pool
+        # is warmed now, so its processes are forked before any thread starts.
+        self.kdf_pool = ProcessPoolExecutor(max_workers=KDF_WORKERS)
+        self.kdf_pool.submit(int).result()
+
+        # The thread all the writes run on
+        self.writer = DBExecutor(self)
+        self.writer.start()
+
+        # Balance changes are written behind by the ledger's thread
+        self.ledger = BalanceLedger(self, balance_flush_interval)
+        self.ledger.start()
+
+        # The balances and inventories of the active players
+        self.cache = AccountCache(ACCOUNT_CACHE_SIZE)
+
+        # The richest accounts
+        self.leaderboard = Leaderboard(self)
+
+        # Set by create_table, True once the inventories are all in account_aircraft
+        self.inventory_migrated = False
 
-    def open_DB(self):
+        # Held while the migration uses its connection, so close() doesn't close it under a query
+        self.migrating = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Returns the connection of the calling thread, opening it on first use.
+        The connection keeps its prepared statements cached, so queries with
+        the same text and different parameters are only compiled once. It is
+        in autocommit mode, transactions are opened by transaction().
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, cached_statements=256, check_same_thread=False,
+                                   isolation_level=None)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self.local.conn = conn
+            with self.connections_lock:
+                self.connections.append(conn)
+        return conn
+
+    def release_connection(self) -> None:
         """
-        Will open DB file and put value in:
-        self.conn (need DB file name)
-        self.cursor
+        Closes the connection of the calling thread, if it opened one. Every
+        thread that used the DB calls it before it exits.
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            return
+        self.local.conn = None
+        with self.connections_lock:
+            if conn not in self.connections:
+                return  # already closed by close_DB
+            self.connections.remove(conn)
+        conn.close()
+
+    @contextmanager
+    def transaction(self):
         """
-        self.conn = sqlite3.connect("database.db")
-        self.current = self.conn.cursor()
+        Runs a block in a BEGIN IMMEDIATE transaction on the calling thread's
+        connection. The write lock is taken at the start, so the reads in the
+        block see what the writes will be applied to, and the transaction
+        never fails midway for another writer. It is committed at the end of
+        the block, or rolled back if the block raises. Inside another
+        transaction, like a batch of the DBExecutor, the block runs in a
+        savepoint instead.
+
+        Yields:
+            sqlite3.Connection: The connection.
+        """
+        conn = self.connection()
+        if conn.in_transaction:
+            conn.execute("SAVEPOINT nested")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK TO nested")
+                conn.execute("RELEASE nested")
+                raise
+            conn.execute("RELEASE nested")
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
 
     def close_DB(self):
-        self.conn.close()
+        """
+        Closes the connections of all the threads.
+        """
+        with self.connections_lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections.clear()
+        self.local = threading.local()
+
+    def write(self, function, *args):
+        """
+        Queues a write to run on the DBExecutor's thread.
 
-    def commit(self):
-        self.conn.commit()
+        Returns:
+            Future: The future of the result of the write.
+        """
+        return self.writer.submit(function, *args)
+
+    def close(self):
+        """
+        Writes the pending balances and writes, closes the connections and
+        stops the KDF processes.
+        """
+        self.ledger.stop()
+        self.writer.stop()
+        with self.migrating:
+            self.close_DB()
+        self.kdf_pool.shutdown()
 
+    @runs_on_executor
     def create_table(self):
         """
-        Creates the accounts table if it doesn't exist already.
-        """
-        self.open_DB()
-        self.current.execute("""
-            CREATE TABLE IF NOT EXISTS accounts (
-                id integer PRIMARY KEY,
-                username text NOT NULL UNIQUE,
-                password text,
-                balance integer,
-                inventory text
-            );
-        """)
-        self.commit()
-        self.close_DB()
+        Creates the accounts table and the account_aircraft table if they
+        don't exist already. account_aircraft holds a row for every aircraft
+        an account owns, and its primary key is the index ownership is
+        looked up in. The inventory column of accounts is only read by the
+        migration. A new DB has nothing to migrate.
+        """
+        with self.transaction() as conn:
+            query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'accounts'"
+            if conn.execute(query).fetchone() is None:
+                conn.execute(ACCOUNTS_TABLE.format(name="accounts"))
+                conn.execute(f"PRAGMA user_version = {ACCOUNTS_AUTOINCREMENT_VERSION}")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS account_aircraft (
+                    account_id integer NOT NULL,
+                    aircraft_name text NOT NULL,
+                    PRIMARY KEY (account_id, aircraft_name)
+                ) WITHOUT ROWID;
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS accounts_balance ON accounts (balance);")
+        self.inventory_migrated = conn.execute("PRAGMA user_version").fetchone()[0] >= INVENTORY_MIGRATED_VERSION
+
+    def migrate_inventories(self, batch_size: int = MIGRATION_BATCH_SIZE) -> None:
+        """
+        Copies the inventory column of all the accounts into account_aircraft,
+        one short transaction per batch of accounts, so the server keeps
+        serving while it runs. Accounts that log in meanwhile are migrated
+        on login, and running it again is harmless. Then rebuilds the
+        accounts table with AUTOINCREMENT ids, if it is older. Stops once
+        the DB executor is stopping, the next start goes on from there.
+
+        Args:
+            batch_size (int): The number of accounts migrated in one transaction.
+        """
+        with self.migrating:
+            conn = self.connection()
+            if not self.inventory_migrated:
+                last_id = -1
+                while True:
+                    if self.writer.stopped:
+                        return
+                    query = "SELECT id, inventory FROM accounts WHERE id > ? ORDER BY id LIMIT ?"
+                    rows = conn.execute(query, (last_id, batch_size)).fetchall()
+                    if not rows:
+                        break
+                    self.migrate_batch(rows)
+                    last_id = rows[-1][0]
+
+                if self.writer.stopped:
+                    return
+                self.set_user_version(INVENTORY_MIGRATED_VERSION)
+                self.inventory_migrated = True
+                logging.info("Migrated the inventories to account_aircraft")
+
+            if self.writer.stopped:
+                return
+            if conn.execute("PRAGMA user_version").fetchone()[0] < ACCOUNTS_AUTOINCREMENT_VERSION:
+                self.rebuild_accounts()
+                logging.info("Rebuilt the accounts table with AUTOINCREMENT ids")
+
+    @runs_on_executor
+    def set_user_version(self, version: int) -> None:
+        with self.transaction() as conn:
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+
+    @runs_on_executor
+    def rebuild_accounts(self) -> None:
+        """
+        Copies the accounts into a new table with AUTOINCREMENT ids and
+        replaces the old one, in one transaction. The ids stay the same, and
+        new ones start after the largest.
+        """
+        with self.transaction() as conn:
+            conn.execute(ACCOUNTS_TABLE.format(name="accounts_new"))
+            conn.execute("""
+                INSERT INTO accounts_new (id, username, password, balance, inventory)
+                SELECT id, username, password, balance, inventory FROM accounts;
+            """)
+            conn.execute("DROP TABLE accounts;")
+            conn.execute("ALTER TABLE accounts_new RENAME TO accounts;")
+            conn.execute("CREATE INDEX accounts_balance ON accounts (balance);")
+            conn.execute(f"PRAGMA user_version = {ACCOUNTS_AUTOINCREMENT_VERSION}")
+
+    @runs_on_executor
+    def migrate_batch(self, rows: list) -> None:
+        """
+        Copies the inventory column of a batch of (id, inventory) accounts into
+        account_aircraft, in one transaction.
+        """
+        with self.transaction() as conn:
+            for account_id, inventory in rows:
+                self.migrate_inventory(conn, account_id, inventory)
+
+    def migrate_inventory(self, conn, account_id: int, inventory: str) -> None:
+        """
+        Copies the inventory column of one account into account_aircraft.
+        """
+        query = "INSERT OR IGNORE INTO account_aircraft (account_id, aircraft_name) VALUES (?, ?)"
+        conn.executemany(query, [(account_id, name) for name in (inventory or "").split('|') if name])
+
+    def get_inventory(self, account_id: int) -> str:
+        """
+        Returns the aircrafts of an account, joined by '|'.
+        """
+        query = "SELECT GROUP_CONCAT(aircraft_name, '|') FROM account_aircraft WHERE account_id = ?"
+        return self.connection().execute(query, (account_id,)).fetchone()[0] or ""
+
+    def owns_aircraft(self, account: Account, aircraft: str) -> bool:
+        """
+        Returns True if an account owns an aircraft, with one indexed lookup.
+        """
+        query = "SELECT 1 FROM account_aircraft WHERE account_id = ? AND aircraft_name = ?"
+        return self.connection().execute(query, (account.id, aircraft)).fetchone() is not None
     
     def log_in(self, account: Account, password: str) -> bool:
         """
@@ -67,12 +382,9 @@ class AccountManagement:
         Returns:
             bool: True if the login was successful, False otherwise.
         """
-        # Sanitize the user input
-        self.open_DB()
-        query = "SELECT * FROM accounts WHERE username = '%s'"
-        self.current.execute(query % account.username)
-        result = self.current.fetchone()
-        self.close_DB()
+        # The username is passed as a parameter, so it can't inject SQL
+        query = "SELECT * FROM accounts WHERE username = ?"
+        result = self.connection().execute(query, (account.username,)).fetchone()
 
         if not result:
             account.is_logged = False
@@ -84,13 +396,22 @@ class AccountManagement:
         pepper = self.get_global_pepper()
 
         # Hash the password using the same salt, pepper, and hash function, and compare to the stored hashed password
-        h = self.hash_str_and_b64_encode(hash_fn, pepper + salt + password)
+        h = self.hash_str_and_b64_encode(hash_fn, password, salt, pepper)
         account.is_logged = self.compare_passwords(h.encode(), hashed_password.encode())
 
         if account.is_logged:
             account.id = result[0]
-            account.balance = result[3]
-            account.inventory = result[4]
+            account.balance = self.get_balance(account.id)
+
+            # Migrate the inventory of the account now if the migration didn't reach it yet
+            if not self.inventory_migrated:
+                self.migrate_batch([(account.id, result[4])])
+            account.inventory = self.get_inventory(account.id)
+            self.cache.put(account.id, account.username, account.balance, account.inventory)
+
+            # Upgrade passwords stored with an older KDF
+            if hash_fn_name != DEFAULT_HASH:
+                self.rehash_password(account, password)
 
     def sign_up(self, account: Account, password: str, hash_fn=None) -> None:
         """
@@ -104,32 +425,12 @@ class AccountManagement:
             account.is_logged = False
             return
         
-        # Get next ID
-        self.open_DB()
-        query = "SELECT MAX(id) FROM accounts;"
-        self.current.execute(query)
-        result = self.current.fetchone()
-        if result[0] is None:
-            account.id = 0
-        else:
-            account.id = result[0] + 1
-    
         # Hash the password with a new salt and pepper
-        if not hash_fn:
-            hash_fn = self.hash_from_name('sha256')
-
-        salt = secrets.token_urlsafe(20)
-        pepper = self.get_global_pepper()
-        hashed_password = self.hash_str_and_b64_encode(hash_fn, pepper + salt + password)
-        account.password = f"{self.hash_name(hash_fn)}${salt}${hashed_password}"
-
-        # Add the new user account to the database
-        query = "INSERT INTO accounts (id, username, password, balance, inventory) VALUES (%s, '%s', '%s', %s, '%s');"
-        params = (account.id, account.username, account.password,
-                  account.balance, account.inventory)
+        account.password = self.new_password_hash(password, hash_fn)
 
+        # Add the new user account and its inventory to the database
         try:
-            self.current.execute(query % params)
+            account.id = self.insert_account(account)
         except sqlite3.Error as er:
             print('SQLite error: %s' % (' '.join(er.args)))
             print("Exception class is: ", er.__class__)
@@ -141,91 +442,196 @@ class AccountManagement:
             account.password = None
             account.is_logged = False
             account.token = None
-            
-            self.commit()
-            self.close_DB()
             return
 
         # If the insertion worked
-        self.commit()
-        self.close_DB()
+        self.cache.put(account.id, account.username, account.balance, account.inventory)
+        self.leaderboard.update(account.username, account.balance)
         account.is_logged = True
 
+    @runs_on_executor
+    def insert_account(self, account: Account) -> int:
+        """
+        Adds an account and its inventory to the database in one transaction.
+        The id is picked by SQLite under the write lock, and never was the id
+        of another account.
+
+        Returns:
+            int: The id of the account.
+        """
+        query = "INSERT INTO accounts (username, password, balance, inventory) VALUES (?, ?, ?, ?);"
+        params = (account.username, account.password,
+                  account.balance, account.inventory)
+
+        with self.transaction() as conn:
+            account_id = conn.execute(query, params).lastrowid
+            self.migrate_inventory(conn, account_id, account.inventory)
+        return account_id
+
+    def new_password_hash(self, password: str, hash_fn=None) -> str:
+        """
+        Hashes a password with a new salt, in the name$salt$hash format.
+
+        Args:
+            password (str): The password.
+            hash_fn: The KDF, DEFAULT_HASH if not given.
+
+        Returns:
+            str: The password field of the account.
+        """
+        if not hash_fn:
+            hash_fn = self.hash_from_name(DEFAULT_HASH)
+
+        salt = secrets.token_urlsafe(20)
+        pepper = self.get_global_pepper()
+        hashed_password = self.hash_str_and_b64_encode(hash_fn, password, salt, pepper)
+        return f"{self.hash_name(hash_fn)}${salt}${hashed_password}"
+
+    def rehash_password(self, account: Account, password: str) -> None:
+        """
+        Rehashes the password of a logged in account with DEFAULT_HASH.
+        """
+        account.password = self.new_password_hash(password)
+        self.store_password(account.id, account.password)
+
+    @runs_on_executor
+    def store_password(self, account_id: int, password: str) -> None:
+        query = "UPDATE accounts SET password = ? WHERE id = ?"
+        with self.transaction() as conn:
+            conn.execute(query, (password, account_id))
+
     def get_global_pepper(self):
         return "Z0dFBDC2gwWyY_Up-FP_9XMyQ3w"
 
     def compare_passwords(self, a, b):
-        starting_time = time.time()
-        is_equal = a == b
-        time.sleep(1 - (time.time() - starting_time))
-        return is_equal
+        # Takes the same time wherever the hashes differ
+        return hmac.compare_digest(a, b)
 
     def hash_name(self, hash_fn):
-        if hash_fn.name == "sha256":
-            return "sha256"
-        raise ValueError
+        return hash_fn.__name__
 
     def hash_from_name(self, name):
-        if name == "sha256":
-            def hash_fn(b: bytes) -> bytes:
-                return hashlib.sha256(b).digest()
-
-            hash_fn.name = "sha256"
-            return hash_fn
+        if name in HASH_FUNCTIONS:
+            return HASH_FUNCTIONS[name]
         raise ValueError
 
-    def hash_str_and_b64_encode(self, hash_fn, password):
-        pw_bytes = password.encode("utf-8")
-        hash_bytes = hash_fn(pw_bytes)
-        hash_bytes = base64.b64encode(hash_bytes)
-        hashed_password = hash_bytes.decode("ascii")
-        return hashed_password
+    def hash_str_and_b64_encode(self, hash_fn, password, salt, pepper):
+        """
+        Hashes a password in the KDF processes. The calling thread waits for
+        the hash without holding the GIL.
+        """
+        future = self.kdf_pool.submit(hash_password, self.hash_name(hash_fn), password, salt, pepper)
+        return future.result()
+
+    def get_balance(self, account_id: int) -> int:
+        """
+        Returns the balance of an account with the changes the ledger didn't
+        write yet. The ledger doesn't flush between reading the DB and the
+        pending changes, so none is counted twice or missed.
+        """
+        query = "SELECT balance FROM accounts WHERE id = ?;"
+        with self.ledger.flushing:
+            balance = self.connection().execute(query, (account_id,)).fetchone()[0]
+            return balance + self.ledger.pending(account_id)
 
     def get_balance_and_inventory(self, account):
-        self.open_DB()
-        query = f"SELECT balance, inventory FROM accounts WHERE id = {account.id};"
-        balance, inventory = self.current.execute(query).fetchone()
-        self.close_DB()
+        cached = self.cache.get(account.id)
+        if cached is not None:
+            return cached
+
+        balance = self.get_balance(account.id)
+        inventory = self.get_inventory(account.id)
+        self.cache.put(account.id, account.username, balance, inventory)
         return balance, inventory
 
     def buy_aircraft(self, account, aircraft_to_purchase):
-        # Double check to make sure that the user isn't buying a plane that he already has
-        if aircraft_to_purchase in account.inventory.split('|'):
-            return False
+        """
+        Buys an aircraft in one transaction: the price is only taken if the
+        balance covers it, together with adding the aircraft to the inventory.
 
-        self.open_DB()
-        query = f"SELECT price FROM aircrafts WHERE name = '{aircraft_to_purchase}'"
-        print(query)
-        price = self.current.execute(query).fetchone()[0]
+        Args:
+            account (Account): The logged in account.
+            aircraft_to_purchase (str): The name of the aircraft.
 
-        if price >= account.balance:
-            self.close_DB()
+        Returns:
+            bool: True if the aircraft was bought.
+        """
+        price = self.purchase(account, aircraft_to_purchase)
+        if price is None:
             return False
 
-        query = f"UPDATE accounts SET inventory = '{account.inventory}|{aircraft_to_purchase}' WHERE username = '{account.username}'"
-        self.current.execute(query)
-
-        self.commit()
-        self.close_DB()
-
-        self.update_balance(account, -price)
+        account.balance -= price
         account.inventory = f"{account.inventory}|{aircraft_to_purchase}"
+        self.cache.add_to_balance(account.id, -price)
+        self.leaderboard.update(account.username, account.balance, account.balance + price)
+        self.cache.set_inventory(account.id, account.inventory)
         return True
 
-    def update_balance(self, account, price):
-        self.open_DB()
-        query = f"UPDATE accounts SET balance = balance + {price} WHERE username = '{account.username}'"
-        self.current.execute(query)
+    @runs_on_executor
+    def purchase(self, account, aircraft_to_purchase):
+        """
+        Takes the price of an aircraft and adds it to the inventory, if the
+        account doesn't own it and its balance covers it. Earnings the ledger
+        didn't write yet count towards the balance. They are read here, on
+        the DB executor, which also applies the flushes, so a flush is either
+        in the DB or still pending, never both.
+
+        Returns:
+            int: The price, or None if the aircraft wasn't bought.
+        """
+        aircraft = self.catalog.by_name(aircraft_to_purchase)
+        if aircraft is None:
+            return None
+        price = aircraft.price
+
+        with self.transaction() as conn:
+            # Double check to make sure that the user isn't buying a plane that he already has
+            if self.owns_aircraft(account, aircraft_to_purchase):
+                return None
 
-        self.commit()
-        self.close_DB()
+            pending = self.ledger.pending(account.id)
+            query = "UPDATE accounts SET balance = balance - ? WHERE id = ? AND balance + ? >= ?"
+            if conn.execute(query, (price, account.id, pending, price)).rowcount == 0:
+                return None
 
+            query = "INSERT INTO account_aircraft (account_id, aircraft_name) VALUES (?, ?)"
+            conn.execute(query, (account.id, aircraft_to_purchase))
+        return price
+
+    def update_balance(self, account, price):
+        """
+        Adds to the balance of an account. The DB is updated by the ledger.
+        """
+        self.ledger.add(account.id, price)
+        self.cache.add_to_balance(account.id, price)
         account.balance += price
+        self.leaderboard.update(account.username, account.balance, account.balance - price)
 
     def delete_account(self, username):
-        self.open_DB()
-        query = f"DELETE FROM accounts WHERE username = '{username}'"
-        self.current.execute(query)
+        deleted = self.delete_account_rows(username)
+        if deleted is None:
+            return
+        account_id, balance = deleted
+
+        # Balance changes the ledger didn't write yet belong to no account now
+        self.ledger.discard(account_id)
+        self.cache.invalidate_username(username)
+        self.leaderboard.remove(username, balance)
 
-        self.commit()
-        self.close_DB()
\ No newline at end of file
+    @runs_on_executor
+    def delete_account_rows(self, username):
+        """
+        Deletes an account and its inventory.
+
+        Returns:
+            tuple: The id of the account and its last balance, or None if there is no such account.
+        """
+        with self.transaction() as conn:
+            query = "SELECT id, balance FROM accounts WHERE username = ?"
+            result = conn.execute(query, (username,)).fetchone()
+            if result is None:
+                return None
+            account_id, balance = result
+            conn.execute("DELETE FROM account_aircraft WHERE account_id = ?", (account_id,))
+            conn.execute("DELETE FROM accounts WHERE id = ?", (account_id,))
+        return account_id, balance + self.ledger.pending(account_id)
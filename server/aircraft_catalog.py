@@ -0,0 +1,80 @@
+import sqlite3
+from dataclasses import dataclass
+from types import MappingProxyType
+
+# How far the camera is behind every aircraft, relative to its size
+CAMERA_DISTANCES = {
+    "efroni": 0.7,
+    "tsofit": 0.6,
+    "lavie": 0.8,
+    "baz": 1.3,
+    "raam": 1.3,
+    "adir": 1.5,
+    "barak": 1,
+    "sufa": 1,
+}
+DEFAULT_CAMERA_DISTANCE = 1
+
+
+@dataclass(frozen=True)
+class Aircraft:
+    id: int
+    name: str
+    description: str
+    mass: int
+    max_thrust: int
+    price: int
+    camera_distance: float
+
+
+class AircraftCatalog:
+    """
+    This class holds all the aircrafts of the game. It is read from the DB
+    once at startup and never changes, so looking an aircraft up costs a
+    dict access instead of a query.
+    """
+
+    def __init__(self, aircrafts):
+        """
+        Constructor for the AircraftCatalog class.
+
+        Args:
+            aircrafts: The Aircraft entries.
+        """
+        self.aircrafts = tuple(sorted(aircrafts, key=lambda aircraft: aircraft.id))
+        self.ids = MappingProxyType({aircraft.id: aircraft for aircraft in self.aircrafts})
+        self.names = MappingProxyType({aircraft.name: aircraft for aircraft in self.aircrafts})
+
+    @classmethod
+    def load(cls, path: str = "database.db"):
+        """
+        Reads the aircrafts table.
+
+        Args:
+            path (str): The path of the DB file.
+
+        Returns:
+            AircraftCatalog: The catalog.
+        """
+        conn = sqlite3.connect(path)
+        try:
+            query = "SELECT id, name, description, mass, max_thrust, price FROM aircrafts;"
+            rows = conn.execute(query).fetchall()
+        finally:
+            conn.close()
+        return cls(Aircraft(*row, CAMERA_DISTANCES.get(row[1], DEFAULT_CAMERA_DISTANCE)) for row in rows)
+
+    def __len__(self) -> int:
+        return len(self.aircrafts)
+
+    def __iter__(self):
+        return iter(self.aircrafts)
+
+    def by_id(self, id: int) -> Aircraft:
+        return self.ids[id]
+
+    def by_name(self, name: str) -> Aircraft:
+        """
+        Returns the aircraft with a name, or None if there is none.
+        """
+        return self.names.get(name)
@@ -0,0 +1,121 @@
+import threading
+import logging
+
+
+class BalanceLedger:
+    """
+    This class keeps the balance changes of the accounts in memory, and a
+    thread flushes them to the DB in one write every interval.
+    Adding to a balance then never touches the DB on the calling thread.
+    Stopping the ledger flushes what is left, so no change is lost on a
+    clean shutdown. Changes being flushed stay pending until the write that
+    applies them ran, so a balance never misses them in between.
+    """
+
+    def __init__(self, db, interval: float = 1.0):
+        """
+        Constructor for the BalanceLedger class.
+
+        Args:
+            db (AccountManagement): The accounts DB the changes are written to.
+            interval (float): The seconds between two flushes.
+        """
+        self.db = db
+        self.interval = interval
+        self.deltas = {}  # account id -> the change to its balance not written yet
+        self.in_flight = {}  # the changes a flush is writing, until the DB executor wrote them
+        self.lock = threading.Lock()
+        self.flushing = threading.Lock()  # held for a whole flush, to read a balance no flush is halfway through
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def add(self, account_id: int, delta: int) -> None:
+        """
+        Adds to the balance of an account.
+
+        Args:
+            account_id (int): The id of the account.
+            delta (int): The amount to add, negative to subtract.
+        """
+        with self.lock:
+            self.deltas[account_id] = self.deltas.get(account_id, 0) + delta
+
+    def discard(self, account_id: int) -> None:
+        """
+        Drops the pending changes of a deleted account.
+        """
+        with self.lock:
+            self.deltas.pop(account_id, None)
+            self.in_flight.pop(account_id, None)
+
+    def pending(self, account_id: int) -> int:
+        """
+        Returns the change to the balance of an account not written yet.
+        """
+        with self.lock:
+            return self.deltas.get(account_id, 0) + self.in_flight.get(account_id, 0)
+
+    def snapshot(self) -> dict:
+        """
+        Returns the changes to the balances of all the accounts not written
+        yet, to read many balances at once.
+        """
+        with self.lock:
+            pending = dict(self.in_flight)
+            for account_id, delta in self.deltas.items():
+                pending[account_id] = pending.get(account_id, 0) + delta
+            return pending
+
+    def flush(self) -> None:
+        """
+        Writes all the pending changes in a single transaction. If the write
+        fails, the changes are kept for the next flush.
+        """
+        with self.flushing:
+            with self.lock:
+                deltas = self.deltas
+                self.deltas = {}
+                self.in_flight = deltas
+            if not deltas:
+                return
+
+            try:
+                self.db.write(self.write_deltas, deltas).result()
+            except Exception as error:
+                logging.error(f"Could not write balances: {error}")
+                with self.lock:
+                    if self.in_flight is deltas:
+                        self.in_flight = {}
+                    for account_id, delta in deltas.items():
+                        self.deltas[account_id] = self.deltas.get(account_id, 0) + delta
+
+    def write_deltas(self, deltas: dict) -> None:
+        """
+        Adds the changes to the balances in the DB. Runs on the DB executor,
+        whose later writes see the changes in the DB, so they stop being
+        pending right after they are applied.
+        """
+        query = "UPDATE accounts SET balance = balance + ? WHERE id = ?"
+        with self.db.transaction() as conn:
+            conn.executemany(query, [(delta, account_id) for account_id, delta in deltas.items()])
+        with self.lock:
+            if self.in_flight is deltas:
+                self.in_flight = {}
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def stop(self) -> None:
+        """
+        Stops the thread, after it wrote all the pending changes.
+        """
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        else:
+            self.flush()
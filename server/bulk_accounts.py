@@ -0,0 +1,247 @@
+"""
+Bulk administration of the accounts: streaming import and export as CSV or
+JSONL, and deleting all the accounts whose username matches a pattern, in
+which % matches any text and every other character only matches itself.
+
+Files are read and written one chunk of rows at a time, and every chunk is
+written in its own transaction, so millions of accounts take bounded memory
+and the server keeps serving while it runs.
+
+Usage (from the server directory):
+    python bulk_accounts.py export accounts.csv
+    python bulk_accounts.py import accounts.jsonl
+    python bulk_accounts.py delete "test_%"
+"""
+import os
+import sys
+import csv
+import json
+import itertools
+
+from account_management import AccountManagement, HASH_FUNCTIONS
+
+# The number of accounts read, written or deleted in one transaction
+CHUNK_SIZE = 10000
+
+# The fields of an account in the files, in order
+FIELDS = ("username", "password", "balance", "inventory")
+
+
+def file_format(path: str) -> str:
+    """
+    Returns "csv" or "jsonl" by the extension of a path.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in (".csv", ".jsonl"):
+        raise ValueError(f"Unknown format of {path}, expected .csv or .jsonl")
+    return extension[1:]
+
+
+def export_accounts(db: AccountManagement, path: str, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Writes all the accounts to a file. The password is the stored hash, and
+    the inventory is joined by '|'.
+
+    Args:
+        db (AccountManagement): The accounts DB.
+        path (str): The .csv or .jsonl file.
+        chunk_size (int): The number of accounts fetched at once.
+
+    Returns:
+        int: The number of accounts exported.
+    """
+    fmt = file_format(path)
+
+    # Write the balance changes not written yet, so the balances are up to date
+    db.ledger.flush()
+
+    query = """
+        SELECT username, password, balance,
+               (SELECT GROUP_CONCAT(aircraft_name, '|') FROM account_aircraft WHERE account_id = accounts.id)
+        FROM accounts ORDER BY id
+    """
+    cursor = db.connection().execute(query)
+
+    count = 0
+    with open(path + ".tmp", "w", newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                if fmt == "csv":
+                    writer.writerow(row[:3] + (row[3] or "",))
+                else:
+                    f.write(json.dumps(dict(zip(FIELDS, row[:3] + (row[3] or "",)))) + "\n")
+            count += len(rows)
+    os.replace(path + ".tmp", path)
+    return count
+
+
+def read_accounts(path: str):
+    """
+    Yields the (username, password, balance, inventory) of every account in
+    a file, reading it line by line.
+    """
+    fmt = file_format(path)
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            for row in csv.DictReader(f):
+                yield row["username"], row["password"], int(float(row["balance"])), row["inventory"]
+        else:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    yield row["username"], row["password"], int(float(row["balance"])), row["inventory"]
+
+
+def valid_password(password: str) -> bool:
+    """
+    Returns True if a password is stored the way log_in reads it, as
+    name$salt$hash with a known KDF name.
+    """
+    fields = password.split('$')
+    return len(fields) == 3 and fields[0] in HASH_FUNCTIONS and all(fields[1:])
+
+
+def import_chunk(db: AccountManagement, rows: list) -> list:
+    """
+    Adds a chunk of accounts in one transaction. Accounts whose username
+    already exists get the imported password and balance, and the imported
+    aircrafts are added to their inventory. Balance changes the ledger
+    didn't write yet for them are dropped, the imported balance replaces
+    them. Runs on the DB executor, so no flush writes them afterwards.
+
+    Returns:
+        list: The (username, balance before or None for a new account, imported balance) of the accounts.
+    """
+    with db.transaction() as conn:
+        query = "SELECT id, balance FROM accounts WHERE username = ?"
+        old_balances = {}  # username -> balance before the import
+        for username, _, _, _ in rows:
+            result = conn.execute(query, (username,)).fetchone()
+            if result is not None:
+                account_id, balance = result
+                old_balances[username] = balance + db.ledger.pending(account_id)
+                db.ledger.discard(account_id)
+
+        query = """
+            INSERT INTO accounts (username, password, balance, inventory) VALUES (?, ?, ?, ?)
+            ON CONFLICT (username) DO UPDATE SET password = excluded.password, balance = excluded.balance
+        """
+        conn.executemany(query, rows)
+
+        query = """
+            INSERT OR IGNORE INTO account_aircraft (account_id, aircraft_name)
+            SELECT id, ? FROM accounts WHERE username = ?
+        """
+        conn.executemany(query, [(name, username) for username, _, _, inventory in rows
+                                 for name in inventory.split('|') if name])
+    return [(username, old_balances.get(username), balance) for username, _, balance, _ in rows]
+
+
+def import_accounts(db: AccountManagement, path: str, chunk_size: int = CHUNK_SIZE) -> tuple:
+    """
+    Adds all the accounts in a file, chunk_size accounts per transaction.
+    Accounts whose password isn't a stored hash are skipped, they could
+    never log in. An account that appears more than once in a chunk is
+    imported once, with its last row.
+
+    Args:
+        db (AccountManagement): The accounts DB.
+        path (str): The .csv or .jsonl file, as written by export_accounts.
+        chunk_size (int): The number of accounts written in one transaction.
+
+    Returns:
+        tuple: The number of accounts imported, and the number skipped.
+    """
+    count = 0
+    skipped = 0
+    accounts = read_accounts(path)
+    while True:
+        rows = list(itertools.islice(accounts, chunk_size))
+        if not rows:
+            break
+        valid = [row for row in rows if valid_password(row[1])]
+        skipped += len(rows) - len(valid)
+        rows = list({row[0]: row for row in valid}.values())
+        if not rows:
+            continue
+        imported = db.write(import_chunk, db, rows).result()
+
+        # The cached balances and inventories of these accounts are out of date
+        for username, old_balance, balance in imported:
+            db.cache.invalidate_username(username)
+            db.leaderboard.update(username, balance, old_balance)
+        count += len(rows)
+    return count, skipped
+
+
+def glob_pattern(pattern: str) -> str:
+    """
+    Returns the GLOB pattern of a username pattern. % becomes *, and the
+    characters GLOB treats specially match themselves. GLOB is case
+    sensitive like the usernames, and unlike LIKE, '_' is no wildcard.
+    """
+    return "".join("*" if char == "%" else f"[{char}]" if char in "*?[" else char for char in pattern)
+
+
+def delete_chunk(db: AccountManagement, pattern: str, chunk_size: int) -> list:
+    """
+    Deletes up to chunk_size accounts matching a GLOB pattern in one transaction.
+
+    Returns:
+        list: The (id, username, last balance) of the deleted accounts.
+    """
+    with db.transaction() as conn:
+        query = "SELECT id, username, balance FROM accounts WHERE username GLOB ? LIMIT ?"
+        rows = conn.execute(query, (pattern, chunk_size)).fetchall()
+        conn.executemany("DELETE FROM account_aircraft WHERE account_id = ?", [(id,) for id, _, _ in rows])
+        conn.executemany("DELETE FROM accounts WHERE id = ?", [(id,) for id, _, _ in rows])
+    return [(id, username, balance + db.ledger.pending(id)) for id, username, balance in rows]
+
+
+def delete_accounts(db: AccountManagement, pattern: str, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Deletes all the accounts whose username matches a pattern.
+
+    Args:
+        db (AccountManagement): The accounts DB.
+        pattern (str): A username pattern, % matching any text, e.g. "test_%".
+        chunk_size (int): The number of accounts deleted in one transaction.
+
+    Returns:
+        int: The number of accounts deleted.
+    """
+    count = 0
+    while True:
+        rows = db.write(delete_chunk, db, glob_pattern(pattern), chunk_size).result()
+        if not rows:
+            break
+        for account_id, username, balance in rows:
+            db.ledger.discard(account_id)
+            db.cache.invalidate_username(username)
+            db.leaderboard.remove(username, balance)
+        count += len(rows)
+    return count
+
+
+if __name__ == "__main__":
+    commands = {"export": export_accounts, "import": import_accounts, "delete": delete_accounts}
+    done = {"export": "Exported", "import": "Imported", "delete": "Deleted"}
+    if len(sys.argv) != 3 or sys.argv[1] not in commands:
+        raise ValueError("Usage: python bulk_accounts.py export|import FILE, or delete PATTERN")
+
+    db = AccountManagement()
+    db.create_table()
+    try:
+        count = commands[sys.argv[1]](db, sys.argv[2])
+    finally:
+        db.close()
+    if sys.argv[1] == "import":
+        count, skipped = count
+        print(f"Skipped {skipped} accounts with an invalid password")
+    print(f"{done[sys.argv[1]]} {count} accounts")
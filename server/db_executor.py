@@ -0,0 +1,137 @@
+import queue
+import logging
+import threading
+import functools
+from concurrent.futures import Future
+
+
+class DBExecutor:
+    """
+    This class runs all the writes to the DB on a single thread, which takes
+    them from a queue. Writes waiting together in the queue are committed in
+    one transaction, every write in its own savepoint, so a failing write
+    doesn't undo the others. Callers get a future, so client handlers wait
+    for their own result instead of competing for SQLite's write lock.
+    """
+
+    def __init__(self, db, max_batch: int = 64):
+        """
+        Constructor for the DBExecutor class.
+
+        Args:
+            db (AccountManagement): The DB the writes run on.
+            max_batch (int): The most writes committed in one transaction.
+        """
+        self.db = db
+        self.max_batch = max_batch
+        self.requests = queue.Queue()  # (function, args, future) tuples, None to stop
+        self.stopped = False
+        self.lock = threading.Lock()  # orders the writes queued with the stop
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def submit(self, function, *args) -> Future:
+        """
+        Queues a write. A write submitted from the executor's own thread,
+        like one write calling another, runs right away. A write submitted
+        after stop() fails with a RuntimeError, as nothing would run it.
+
+        Args:
+            function: The function that writes, using db.transaction().
+            *args: The arguments of the function.
+
+        Returns:
+            Future: The future of the result of the function.
+        """
+        future = Future()
+        if threading.current_thread() is self.thread:
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(function(*args))
+            except Exception as error:
+                future.set_exception(error)
+        else:
+            with self.lock:
+                if self.stopped:
+                    future.set_exception(RuntimeError("executor stopped"))
+                else:
+                    self.requests.put((function, args, future))
+        return future
+
+    def run(self) -> None:
+        stopping = False
+        while not stopping:
+            request = self.requests.get()
+            if request is None:
+                return
+
+            # Take the writes that are already waiting, up to max_batch
+            batch = [request]
+            while len(batch) < self.max_batch:
+                try:
+                    request = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+
+            self.execute(batch)
+
+    def execute(self, batch: list) -> None:
+        """
+        Runs a batch of writes in one transaction, and completes their futures
+        once it is committed.
+        """
+        results = []  # (succeeded, result or error) of every write
+        try:
+            with self.db.transaction():
+                for function, args, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        results.append(None)
+                        continue
+                    try:
+                        with self.db.transaction():
+                            results.append((True, function(*args)))
+                    except Exception as error:
+                        results.append((False, error))
+        except Exception as error:
+            logging.error(f"Could not commit a batch of {len(batch)} writes: {error}")
+            for _, _, future in batch:
+                if future.running():
+                    future.set_exception(error)
+            return
+
+        for (_, _, future), result in zip(batch, results):
+            if result is None:
+                continue
+            succeeded, value = result
+            if succeeded:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def stop(self) -> None:
+        """
+        Stops the thread, after it ran all the writes queued before.
+        """
+        with self.lock:
+            if not self.stopped:
+                self.stopped = True
+                self.requests.put(None)
+        if self.thread.is_alive():
+            self.thread.join()
+
+
+def runs_on_executor(method):
+    """
+    Decorates an AccountManagement method that writes, so it runs on the DB
+    executor's thread. The caller waits for its result.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        return self.write(method, self, *args).result()
+    return wrapper
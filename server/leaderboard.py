@@ -0,0 +1,182 @@
+import threading
+
+# Balances are counted in buckets, 2 ** BUCKET_BITS of them between every two
+# powers of two, so a rank adds up a few hundred bucket counts at most
+BUCKET_BITS = 3
+
+
+def bucket_of(balance) -> int:
+    """
+    Returns the bucket of a balance. Larger balances are in buckets with
+    larger numbers, and balances of 0 or less are all in bucket 0.
+    """
+    value = int(balance)
+    if value <= 0:
+        return 0
+    bits = value.bit_length()
+    if bits <= BUCKET_BITS:
+        return value
+    return (bits << BUCKET_BITS) | ((value >> (bits - 1 - BUCKET_BITS)) & ((1 << BUCKET_BITS) - 1))
+
+
+class Leaderboard:
+    """
+    This class keeps the richest accounts in memory, so the leaderboard is
+    answered without sorting the accounts table. It holds the exact balances
+    of twice as many accounts as it shows, and every balance change updates
+    it in O(1). It only goes back to the DB, through the balance index, when
+    accounts it holds fell below one it doesn't hold.
+
+    It also counts the balances of all the accounts in buckets, so the rank
+    of a balance adds up the buckets above it instead of counting rows. All
+    the balances it holds include the changes the ledger didn't write yet,
+    like the balances of the sessions it is updated with. Balances are
+    rounded down to whole coins like LDRA sends them, as old accounts still
+    have fractions.
+    """
+
+    def __init__(self, db, size: int = 10):
+        """
+        Constructor for the Leaderboard class.
+
+        Args:
+            db (AccountManagement): The accounts DB.
+            size (int): The number of accounts shown.
+        """
+        self.db = db
+        self.size = size
+        self.capacity = 2 * size
+        self.balances = {}  # username -> balance, of the richest accounts
+        self.floor = None  # no account outside balances is richer than this, None if there is none
+        self.buckets = {}  # bucket -> {balance: number of accounts}, of all the accounts
+        self.totals = {}  # bucket -> number of accounts
+        self.loaded = False
+        self.counted = False
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Reads the richest accounts and counts all the balances. The server
+        calls it once before it takes clients, changes that come before the
+        load aren't counted.
+        """
+        with self.lock:
+            self.load_top()
+            self.count_all()
+
+    def load_top(self) -> None:
+        """
+        Reads the richest accounts from the DB.
+        """
+        query = "SELECT id, username, balance FROM accounts ORDER BY balance DESC LIMIT ?"
+        with self.db.ledger.flushing:
+            rows = self.db.connection().execute(query, (self.capacity + 1,)).fetchall()
+            pending = self.db.ledger.snapshot()
+        rows = [(username, int(balance + pending.get(account_id, 0))) for account_id, username, balance in rows]
+        self.balances = dict(rows[:self.capacity])
+        self.floor = rows[self.capacity][1] if len(rows) > self.capacity else None
+        self.loaded = True
+
+    def count_all(self) -> None:
+        """
+        Counts the balances of all the accounts, in one pass over the table
+        that holds one row in memory at a time.
+        """
+        self.buckets = {}
+        self.totals = {}
+        with self.db.ledger.flushing:
+            pending = self.db.ledger.snapshot()
+            for account_id, balance in self.db.connection().execute("SELECT id, balance FROM accounts"):
+                self.count(balance + pending.get(account_id, 0), 1)
+        self.counted = True
+
+    def count(self, balance, change: int) -> None:
+        """
+        Adds change to the number of accounts with a balance.
+        """
+        balance = int(balance)
+        bucket = bucket_of(balance)
+        values = self.buckets.setdefault(bucket, {})
+        number = values.get(balance, 0) + change
+        if number < 0:
+            number = 0
+            change = -values.get(balance, 0)  # a balance that was never counted
+        if number:
+            values[balance] = number
+        else:
+            values.pop(balance, None)
+        if values:
+            self.totals[bucket] = self.totals.get(bucket, 0) + change
+        else:
+            del self.buckets[bucket]
+            self.totals.pop(bucket, None)
+
+    def update(self, username: str, balance: int, old_balance: int = None) -> None:
+        """
+        Updates the balance of an account, after it changed.
+
+        Args:
+            username (str): The account.
+            balance (int): The balance now.
+            old_balance (int): The balance before, None for a new account.
+        """
+        balance = int(balance)
+        with self.lock:
+            if self.counted:
+                if old_balance is not None:
+                    self.count(old_balance, -1)
+                self.count(balance, 1)
+
+            if not self.loaded:
+                return
+
+            # An account outside the leaderboard that is still under the floor stays outside
+            if username not in self.balances and self.floor is not None and balance <= self.floor:
+                return
+
+            self.balances[username] = balance
+            if len(self.balances) > self.capacity:
+                # Drop the poorest account, which becomes the floor if it is richer than it
+                username, balance = min(self.balances.items(), key=lambda item: item[1])
+                del self.balances[username]
+                self.floor = balance if self.floor is None else max(self.floor, balance)
+
+    def remove(self, username: str, balance: int) -> None:
+        """
+        Removes a deleted account, whose last balance was balance.
+        """
+        with self.lock:
+            self.balances.pop(username, None)
+            if self.counted:
+                self.count(balance, -1)
+
+    def top(self) -> list:
+        """
+        Returns the (username, balance) of the richest accounts, richest first.
+        """
+        with self.lock:
+            if not self.loaded:
+                self.load_top()
+
+            ranking = sorted(self.balances.items(), key=lambda item: item[1], reverse=True)[:self.size]
+
+            # Accounts held may have fallen below accounts that aren't
+            if self.floor is not None and (len(ranking) < self.size or ranking[-1][1] < self.floor):
+                self.load_top()
+                ranking = sorted(self.balances.items(), key=lambda item: item[1], reverse=True)[:self.size]
+            return ranking
+
+    def rank(self, balance: int) -> int:
+        """
+        Returns the rank of a balance among all the accounts: one more than
+        the number of accounts richer than it.
+        """
+        with self.lock:
+            if not self.counted:
+                self.count_all()
+
+            balance = int(balance)
+            bucket = bucket_of(balance)
+            richer = sum(total for other, total in self.totals.items() if other > bucket)
+            richer += sum(number for value, number in self.buckets.get(bucket, {}).items() if value > balance)
+            return richer + 1
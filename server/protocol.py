@@ -76,3 +76,26 @@ def send_with_size(sock, data, key=None):
 
     if TCP_DEBUG and data_len > 0:
         print(f"\nSent({data_len})>>> {message_bytes[:min(len(message_bytes), LEN_TO_PRINT)]}")
+
+
+def encode_update(token, x, y, z, h, p, r) -> bytes:
+    """Build the UPDR a client sends with the position and rotation of its aircraft."""
+    return f"UPDR#{token}${x}${y}${z}${h}${p}${r}".encode()
+
+def decode_update(parameters: str) -> list:
+    """Split the parameters of an UPDR into [token, x, y, z, h, p, r], as strings."""
+    return parameters.split("$")
+
+def encode_players(players) -> bytes:
+    """Build the UPDA the server broadcasts, from [username, aircraft, x, y, z, h, p, r] lists."""
+    return ("UPDA#" + "$".join("|".join(map(str, player)) for player in players)).encode()
+
+def decode_players(parameters: str) -> list:
+    """Split the parameters of an UPDA into (username, aircraft, x, y, z, h, p, r) tuples, with float values."""
+    players = []
+    if not parameters:
+        return players
+    for player in parameters.split("$"):
+        name, aircraft, x, y, z, h, p, r = player.split("|")
+        players.append((name, aircraft, float(x), float(y), float(z), float(h), float(p), float(r)))
+    return players
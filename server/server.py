@@ -5,19 +5,17 @@ import time
 import rsa
 import pickle
 
-from protocol import send_with_size, recv_by_size
+from protocol import send_with_size, recv_by_size, decode_update, encode_players
 from account_management import Account, AccountManagement
+from bulk_accounts import import_accounts, export_accounts, delete_accounts
 
 exit_all = False
-logging.basicConfig(level=logging.INFO, filename="logs/serverside.log", filemode="w")
 
 """ Open World Global Variables """
 players = {}
 lock = threading.Lock()
 
-open_world_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-open_world_socket.settimeout(0.001)
-open_world_socket.bind(('0.0.0.0', 8888))
+open_world_socket = None  # bound in main, so processes spawned by the KDF pool don't bind it again
 
 client_addresses = {}
 """ End Of Open World Global Variables """
@@ -30,7 +28,7 @@ def manage_server_by_input(db):
     """
     # print instructions
     print("Welcome to FlightIL's control senter. Available commands are:\n")
-    print('* HELP *\n* DELETE ACCOUNT *\n* EXIT *\n')
+    print('* HELP *\n* DELETE ACCOUNT *\n* DELETE ACCOUNTS *\n* IMPORT ACCOUNTS *\n* EXPORT ACCOUNTS *\n* EXIT *\n')
 
     # loop until user requested to exit
     while True:
@@ -38,7 +36,21 @@ def manage_server_by_input(db):
         if cmd == 'DELETE ACCOUNT':
             name = input("Please enter account name:\n")
             db.delete_account(name)
-        if cmd == 'EXIT':
+        elif cmd in ('DELETE ACCOUNTS', 'IMPORT ACCOUNTS', 'EXPORT ACCOUNTS'):
+            try:
+                if cmd == 'DELETE ACCOUNTS':
+                    pattern = input("Please enter a username pattern, % matching any text:\n")
+                    print(f"Deleted {delete_accounts(db, pattern)} accounts")
+                elif cmd == 'IMPORT ACCOUNTS':
+                    path = input("Please enter the path of a .csv or .jsonl file:\n")
+                    count, skipped = import_accounts(db, path)
+                    print(f"Imported {count} accounts, skipped {skipped} with an invalid password")
+                else:
+                    path = input("Please enter the path of a .csv or .jsonl file:\n")
+                    print(f"Exported {export_accounts(db, path)} accounts")
+            except Exception as error:
+                print(f"{cmd} failed: {error}")
+        elif cmd == 'EXIT':
             logging.info(f"Shutting down all clients")
             exit_all = True
             break
@@ -62,11 +74,10 @@ def handle_clients_open_world():
         fields = data.decode().split("#") # Split data into fields based on "#" delimiter
         action = fields[0] # Get the action from the first field
         if action == "UPDR": # If the action is "UPDR", update the player's position
-            parameters = fields[1]
-            token, x, y, z, h, p, r = parameters.split("$") # Extract the position and rotation
+            token, x, y, z, h, p, r = decode_update(fields[1]) # Extract the position and rotation
             with lock:
                 try:
-                    players[token] = [players[token].pop(0), players[token].pop(0), x, y, z, h, p, r] # Update player's position
+                    players[token] = players[token][:2] + [x, y, z, h, p, r] # Update player's position, in a new list so a broadcast being built keeps the old one
                 except:
                     logging.error("Invalid token recieved.")
         elif action == "ADDS": # If the action is "ADDS", update the client's address
@@ -89,21 +100,42 @@ def broadcast_players():
 
     while not exit_all:
         with lock:
-            location_data = players.values() # Get the current location data of all players
-
-        to_send = f'UPDA#' # Start building the message to be sent
-        for username, aircraft, x, y, z, h, p, r in location_data:
-            to_send += f"{username}|{aircraft}|{x}|{y}|{z}|{h}|{p}|{r}$" # Add each player's position data to the message
+            location_data = list(players.values()) # Get the current location data of all players
 
-        to_send = to_send[:-1] # Get rid of last "$" delimiter
+        to_send = encode_players(location_data) # Build the message to be sent
 
         with lock:
             for client_address in client_addresses.values():
                 if type(client_address) is tuple: # Check if the client address is a tuple (i.e., not a token)
-                    open_world_socket.sendto(to_send.encode(), client_address) # Send the message to the client's address
+                    open_world_socket.sendto(to_send, client_address) # Send the message to the client's address
         time.sleep(0.02) # Sleep for a short time before sending the next update
 
 
+def serve_client(sock, addr, thread_id, db, AES_key):
+    """
+    This function runs handle_client, then closes the DB connection of the client's thread.
+    """
+    try:
+        handle_client(sock, addr, thread_id, db, AES_key)
+    finally:
+        db.release_connection()
+
+
+def run_migration(db):
+    """
+    This function runs the inventory migration, then closes the DB connection of its thread.
+    A shutdown in the middle of a batch stops it, and the next start goes on from there.
+    """
+    try:
+        db.migrate_inventories()
+    except Exception:
+        if not db.writer.stopped:
+            raise
+        logging.info("The migration stopped with the server")
+    finally:
+        db.release_connection()
+
+
 def handle_client(sock, addr, thread_id, db, AES_key):
     """
     This function handles a single client connection by receiving and processing messages sent from the client.
@@ -171,11 +203,16 @@ def handle_client(sock, addr, thread_id, db, AES_key):
                     if int(is_bought):
                         logging.info(f"Client number {str(thread_id)} succesfully bought {parameters}")
 
+                elif action == "LDRR":
+                    # The richest pilots, and the rank of the player among all of them
+                    leaders = "$".join(f"{username}|{int(balance)}" for username, balance in db.leaderboard.top())
+                    to_send = f"LDRA#{db.leaderboard.rank(account.balance)}${leaders}".encode()
+
                 elif action == "SELR":
                     aircraft, token = fields[1].split('|')
 
                     # If the aircraft chosen is in the inventory, move to open world
-                    if aircraft in account.inventory.split('|'):
+                    if db.owns_aircraft(account, aircraft):
                         with lock:
                             # Add player to the global lists. The token will be replaced by the clients' address
                             # In the future
@@ -209,9 +246,9 @@ def handle_client(sock, addr, thread_id, db, AES_key):
                         del players[token]
                         del client_addresses[account.username]
 
-                        # Update his balance for his time playing
-                        earned_coins = int((time.time() - time_started_playing) / 60)
-                        db.update_balance(account, earned_coins)
+                    # Update his balance for his time playing
+                    earned_coins = int((time.time() - time_started_playing) / 60)
+                    db.update_balance(account, earned_coins)
                     current_window = "select windows"
                     continue
                 elif action == "EXTC":
@@ -221,9 +258,9 @@ def handle_client(sock, addr, thread_id, db, AES_key):
                         del players[token]
                         del client_addresses[account.username]
 
-                        # Update his balance for his time playing
-                        earned_coins = int((time.time() - time_started_playing) / 60)
-                        db.update_balance(account, earned_coins)
+                    # Update his balance for his time playing
+                    earned_coins = int((time.time() - time_started_playing) / 60)
+                    db.update_balance(account, earned_coins)
                     sock.close()
                     return
             
@@ -238,8 +275,8 @@ def handle_client(sock, addr, thread_id, db, AES_key):
                 with lock:
                     del players[token]
                     del client_addresses[account.username]
-                    earned_coins = (time.time() - time_started_playing) / 60
-                    db.update_balance(account, earned_coins)
+                earned_coins = int((time.time() - time_started_playing) / 60)
+                db.update_balance(account, earned_coins)
             sock.close()
             return
 
@@ -251,8 +288,8 @@ def handle_client(sock, addr, thread_id, db, AES_key):
                 with lock:
                     del players[token]
                     del client_addresses[account.username]
-                    earned_coins = (time.time() - time_started_playing) / 60
-                    db.update_balance(account, earned_coins)
+                earned_coins = int((time.time() - time_started_playing) / 60)
+                db.update_balance(account, earned_coins)
             sock.close()
             return
 
@@ -264,18 +301,31 @@ def handle_client(sock, addr, thread_id, db, AES_key):
 
 def main():
     global exit_all
+    global open_world_socket
 
     exit_all = False
 
+    # Open the open world socket
+    open_world_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    open_world_socket.settimeout(0.001)
+    open_world_socket.bind(('0.0.0.0', 8888))
+
     # Open the Database for future use
     db = AccountManagement()
     db.create_table()
 
+    # Count the balances for the leaderboard's ranks before any of them changes
+    db.leaderboard.load()
+
+    # Move the inventories to their own table in the background, if they weren't yet
+    threading.Thread(target=run_migration, args=(db,), daemon=True).start()
+
     # Set up the RSA key exchange
     public_key, private_key = rsa.newkeys(1024)
 
     # Create the socket and bind it
     s = socket.socket()
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # So a restart doesn't wait for the old connections to time out
     s.bind(("0.0.0.0", 33445))
 
 
@@ -314,7 +364,7 @@ def main():
         AES_key_encoded = recv_by_size(cli_s)
         AES_key = rsa.decrypt(AES_key_encoded, private_key)
         
-        t = threading.Thread(target=handle_client, args=(cli_s, addr, i, db, AES_key))
+        t = threading.Thread(target=serve_client, args=(cli_s, addr, i, db, AES_key))
         t.start()
         i += 1
         threads.append(t)
@@ -322,7 +372,10 @@ def main():
     for t in threads:
         t.join()
     s.close()
+    db.close()
 
 
 if __name__ == "__main__":
+    # Set up here, so the processes of the KDF pool, which import this module, don't truncate the log
+    logging.basicConfig(level=logging.INFO, filename="logs/serverside.log", filemode="w")
     main()